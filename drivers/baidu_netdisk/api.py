@@ -1,6 +1,8 @@
 import os
+import threading
 import time
 from pprint import pprint
+from urllib.parse import urlparse, parse_qs
 
 import requests
 from requests import Request
@@ -11,6 +13,13 @@ import json
 import logging
 from easydict import EasyDict
 
+from .resolver import BatchResolver
+
+DLINK_DEFAULT_EXPIRES = 8 * 3600  # dlink 默认有效期 8 小时
+DLINK_REFRESH_MARGIN = 600  # dlink 过期前多久开始提前刷新(秒)
+DOWNLOAD_TIMEOUT = (10, 30)  # 下载的连接超时和两次收到数据之间的超时(秒)，卡住的请求不会让读取者一直等待
+DOWNLOAD_CHUNK = 65536  # 服务端忽略 Range 时每次从响应中读取的大小
+
 
 class BaiduNetdisk:
     def __init__(self, config, debug=False):
@@ -24,6 +33,11 @@ class BaiduNetdisk:
 
         self.session = requests.Session()
 
+        self.dlinks = {}  # 下载链接缓存 fs_id -> (url, 过期时间)
+        self.refreshing = set()  # 正在后台刷新下载链接的 fs_id
+        self.dlink_lock = threading.Lock()
+        self.meta_resolver = BatchResolver(self._filemetas)  # 合并并发的 filemetas 请求
+
         if self.access_token is None:
             if self.refresh_token is not None:
                 print("No access token, refreshing")
@@ -32,7 +46,8 @@ class BaiduNetdisk:
                 raise Exception("No access token or refresh token")
 
         retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
+        # 分段下载会同时使用多个连接，连接池需要足够大
+        self.session.mount('https://', HTTPAdapter(max_retries=retries, pool_maxsize=32))
 
     def check_access_token(self):
         if time.time() - self.config.access_token_time > 1728000:
@@ -168,6 +183,37 @@ class BaiduNetdisk:
         response = self.get("/xpan/file", kwargs)
         return EasyDict(response.json())
 
+    def listall(self, **kwargs):
+        """
+        递归列出目录下的所有文件
+
+        以下参数可选：
+            path：       需要list的目录，以/开头的绝对路径, 默认为/
+            recursion：  是否递归，0 不递归，1 递归，默认为0
+            order：      排序字段：time(修改时间)，name(文件名)，size(大小)，默认为文件名
+            desc：       默认为升序，设置为1实现降序
+            start：      查询起点，为上一次返回的 cursor，默认为0
+            limit：      查询数目，默认为1000，最大不超过1000
+            ctime：      文件上传时间，设置此参数，表示只返回上传时间大于ctime的文件
+            mtime：      文件修改时间，设置此参数，表示只返回修改时间大于mtime的文件
+            web：        值为1时，返回缩略图数据
+        :return: 包含 has_more 和 cursor，has_more 为 1 时使用 cursor 作为 start 继续查询
+        """
+        kwargs["method"] = 'listall'
+        response = self.get("/xpan/multimedia", kwargs)
+        return EasyDict(response.json())
+
+    def diff(self, cursor=None):
+        """
+        获取增量变化
+
+        :param cursor: 上一次返回的 cursor，第一次查询时传入 None
+        :return: 包含 entries、cursor、has_more、reset，entries 为 path -> 文件信息，被删除的项 isdelete 为 1
+        """
+        params = {"method": "diff", "cursor": cursor if cursor is not None else "null"}
+        response = self.get("/xpan/file", params)
+        return EasyDict(response.json())
+
     def list_doc(self, **kwargs):
         """
         列出文档
@@ -466,6 +512,23 @@ class BaiduNetdisk:
         response = self.get("/xpan/multimedia", kwargs)
         return EasyDict(response.json())
 
+    def _filemetas(self, fsids):
+        """
+        批量获取文件信息（包含下载链接），供 meta_resolver 合并请求使用
+        :param fsids: 文件fsid列表, 上限100
+        :return: {fs_id: 文件信息}
+        """
+        data = self.files(fsids, dlink=1)
+        return {item.fs_id: item for item in data.get('list', [])}
+
+    def file_meta(self, fsid):
+        """
+        获取单个文件的信息，短时间内的并发查询会合并为一次 filemetas 请求
+        :param fsid: 文件fsid
+        :return:
+        """
+        return self.meta_resolver.get(fsid)
+
     def manage(self, opera, filelist):
         """
         文件管理
@@ -547,29 +610,137 @@ class BaiduNetdisk:
         final_url = response.headers.get('Location')
         return final_url
 
+    @staticmethod
+    def parse_dlink_expires(dlink):
+        """
+        解析 dlink 中的 expires 参数，例如 expires=8h
+        :param dlink:
+        :return: 有效期(秒)
+        """
+        value = parse_qs(urlparse(dlink).query).get('expires', [''])[0]
+        units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        try:
+            if value and value[-1] in units:
+                return int(value[:-1]) * units[value[-1]]
+            return int(value)
+        except ValueError:
+            return DLINK_DEFAULT_EXPIRES
+
+    def _resolve_dlink(self, fsid):
+        """
+        请求新的下载链接并放入缓存
+        :param fsid:
+        :return:
+        """
+        res_url = self.file_meta(fsid).dlink
+        url = self.get_final_download_link(res_url)
+        self.dlinks[fsid] = (url, time.time() + self.parse_dlink_expires(res_url))
+        return url
+
+    def _refresh_dlink_async(self, fsid):
+        """
+        在后台刷新即将过期的下载链接
+        :param fsid:
+        :return:
+        """
+        with self.dlink_lock:
+            if fsid in self.refreshing:
+                return
+            self.refreshing.add(fsid)
+
+        def refresh():
+            try:
+                self._resolve_dlink(fsid)
+            except Exception as e:
+                logging.info(f"[baidu_netdisk] refresh dlink {fsid} failed: {e}")
+            finally:
+                with self.dlink_lock:
+                    self.refreshing.discard(fsid)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
     def get_res_url(self, fsids):
         """
         获取资源链接(单个资源)
+
+        下载链接按 fs_id 缓存，在 expires 参数指定的有效期内重复使用，
+        临近过期时会在后台提前刷新
         :return:
         """
         """
         'https://d.pcs.baidu.com/file/099a1e8a4sfb9a56bbaff2c9cd15a4fd?fid=1102622167898-250528-617439386979391&rt=pr&sign=FDtAERK-DCb740ccc5511e5e8fedcff06b081203-38lyfHqiuy42swSiz8pyA3CZR7E%3D&expires=8h&chkbd=0&chkv=0&dp-logid=3028221541306415243&dp-callid=0&dstime=1721667913&r=917247469&vuk=1102622167898&origin_appid=25571201&file_type=0'
         
         """
-        res_url = self.files(fsids, dlink=1).list[0].dlink
-        # return res_url
-        return self.get_final_download_link(res_url)
+        fsid = fsids[0] if isinstance(fsids, list) else fsids
+        cached = self.dlinks.get(fsid)
+        if cached:
+            url, expires_at = cached
+            remain = expires_at - time.time()
+            if remain > 0:
+                if remain < DLINK_REFRESH_MARGIN:
+                    self._refresh_dlink_async(fsid)
+                return url
+        return self._resolve_dlink(fsid)
+
+    def download(self, fsid, start, end):
+        """
+        通过 HTTP Range 下载资源的一部分
+
+        下载链接失效(403/410)时会重新获取链接并重试一次
+        :param fsid: 文件fsid
+        :param start: 起始字节位置(包含)
+        :param end: 结束字节位置(不包含)
+        :return: bytes
+        """
+        headers = {
+            'User-Agent': 'pan.baidu.com',
+            'Range': f'bytes={start}-{end - 1}',
+        }
+        for retry in range(2):
+            with self.session.get(self.get_res_url(fsid), headers=headers, stream=True,
+                                  timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status_code == 206:
+                    return response.content
+                if response.status_code == 200:  # 服务端忽略了 Range，返回的是整个文件
+                    return self._read_range(response, start, end)
+                if response.status_code in [403, 410] and retry == 0:
+                    logging.info(f"[baidu_netdisk] dlink of {fsid} expired, resolving again.")
+                    self.dlinks.pop(fsid, None)
+                    continue
+                raise Exception(f"download: [{start}-{end}] ,errno: {response.status_code}, {response.text}")
+
+    @staticmethod
+    def _read_range(response, start, end):
+        """
+        从返回整个文件的响应中截取 [start, end)，读到 end 后立即断开，不会把整个文件读入内存
+
+        :return: bytes
+        """
+        logging.info(f"[baidu_netdisk] server ignored range [{start}-{end}], reading from the beginning.")
+        data = bytearray()
+        position = 0
+        for chunk in response.iter_content(DOWNLOAD_CHUNK):
+            if position + len(chunk) > start:
+                data += chunk[max(start - position, 0):end - position]
+            position += len(chunk)
+            if position >= end:
+                break
+        return bytes(data)
 
     def path_to_fsid(self, path):
         """
         根据路径获取文件fsid
+
+        调用 search 接口查找，目录列表中已有 fs_id 的文件不需要调用
         :param path:
         :return:
         """
         dir, file = os.path.split(path)
-        fsid = self.search(file, dir=dir).list[0].fs_id
-
-        return fsid
+        # search 是模糊匹配，需要按完整路径筛选，避免同名文件被误用
+        matches = [item for item in self.search(file, dir=dir).get('list', []) if item.path == path]
+        if not matches:
+            raise FileNotFoundError(path)
+        return matches[0].fs_id
 
     def get_m3u8(self, path, definition_type=1080):
         """
@@ -1,12 +1,25 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from easydict import EasyDict
 
 from .api import BaiduNetdisk
 
+LIST_LIMIT = 1000  # list 接口每页的最大数量
+LIST_FANOUT = 4  # 大目录同时请求的页数
+
 
 class Driver:
     def __init__(self, config):
         self.config = config
         self.api = BaiduNetdisk(config)
+        self.list_pool = ThreadPoolExecutor(LIST_FANOUT)  # 并发分页读取大目录
+        try:
+            self.use_diff = bool(config.use_diff)  # diff 不是公开的接口，需要在配置中开启
+        except (KeyError, AttributeError):
+            self.use_diff = False
 
     def quota(self):
         """
@@ -23,14 +36,125 @@ class Driver:
         """
         获取文件列表
 
+        没有指定 start/limit 时会读取所有分页，返回完整的列表
+
+        :param kwargs:
+        :return:
+        """
+        if 'start' in kwargs or 'limit' in kwargs:
+            return self._list_page(**kwargs)
+
+        return_lists = []
+        for page in self.list_pages(**kwargs):
+            return_lists.extend(page)
+        return return_lists
+
+    def list_pages(self, dir='/', **kwargs):
+        """
+        分页获取文件列表，每读取到一页就返回一页
+
+        第一页读满时说明是大目录，之后会同时请求多页（最多 LIST_FANOUT 页），
+        直到某一页不满为止，各页仍按顺序返回
+
+        :param dir: 目录路径
+        :param kwargs: 其他 list 接口参数
+        :return: 生成器，每次返回一页 list[EasyDict(Item)]
+        """
+        page = self._list_page(dir=dir, start=0, limit=LIST_LIMIT, **kwargs)
+        yield page
+        if len(page) < LIST_LIMIT:
+            return
+
+        start = LIST_LIMIT
+        futures = deque()
+        try:
+            while True:
+                while len(futures) < LIST_FANOUT:
+                    futures.append(self.list_pool.submit(self._list_page, dir=dir, start=start, limit=LIST_LIMIT,
+                                                         **kwargs))
+                    start += LIST_LIMIT
+                page = futures.popleft().result()
+                if page:
+                    yield page
+                if len(page) < LIST_LIMIT:
+                    return
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _list_page(self, **kwargs):
+        """
+        获取一页文件列表
+
         :param kwargs:
         :return:
         """
         data = self.api.list(**kwargs)
         if 'list' not in data:
             return []
-        file_lists = data.list
+        return self._to_items(data.list)
+
+    def listall_pages(self, path='/'):
+        """
+        递归获取目录下的所有文件，每次返回一页（最多 1000 项）
 
+        用于一次性导入整个目录树，请求数与文件总数成正比，而不是与目录数成正比
+
+        :param path: 目录路径
+        :return: 生成器，每次返回一页 list[EasyDict(Item)]
+        """
+        start = 0
+        while True:
+            data = self.api.listall(path=path, recursion=1, start=start, limit=LIST_LIMIT)
+            if 'list' not in data:
+                return
+            yield self._to_items(data.list)
+            if not data.get('has_more'):
+                return
+            start = data.cursor
+
+    def changes(self, cursor):
+        """
+        获取自 cursor 之后网盘中发生的变化
+
+        :param cursor: 上一次返回的 cursor，第一次查询时为 None
+        :return: EasyDict({"changes": changes, "cursor": cursor, "has_more": bool, "reset": bool})
+        """
+        if not self.use_diff:
+            raise NotImplementedError('diff is disabled, set use_diff in the driver config to enable it')
+        data = self.api.diff(cursor)
+        if data.get('errno', 0) != 0 or 'cursor' not in data:  # 接口不可用
+            raise NotImplementedError(f'diff is not available: {data.get("errno")}')
+
+        entries = list((data.get('entries') or {}).values())
+        changes = [EasyDict({'path': item.path, 'deleted': True}) for item in entries if item.get('isdelete')]
+        updated = []
+        for item in entries:
+            if item.get('isdelete'):
+                continue
+            # diff 返回的字段与 list 接口不完全一致
+            item.setdefault('server_filename', os.path.basename(item.path))
+            item.setdefault('server_mtime', item.get('mtime', 0))
+            item.setdefault('size', 0)
+            updated.append(item)
+        for item in self._to_items(updated):
+            item.deleted = False
+            changes.append(item)
+
+        return EasyDict({
+            'changes': changes,
+            'cursor': data.cursor,
+            'has_more': bool(data.get('has_more')),
+            'reset': bool(data.get('reset')),
+        })
+
+    def _to_items(self, file_lists):
+        """
+        将接口返回的文件列表转换为 Item
+
+        :param file_lists:
+        :return: list[EasyDict(Item)]
+        """
         return_lists = []
 
         for item in file_lists:
@@ -41,11 +165,28 @@ class Driver:
                     'isdir': item.isdir,
                     'size': item.size,
                     'mtime': item.server_mtime,
-                    'ctime': item.server_mtime
+                    'ctime': item.server_mtime,
+                    'fs_id': item.fs_id,  # 记录在 inode 表中，下载时无需再调用 search 接口
+                    'md5': item.get('md5'),
+                    'category': item.get('category'),
                 }
             }))
         return return_lists
 
+    @staticmethod
+    def _succeeded(action, result):
+        """
+        filemanager 接口 errno 为 0 表示成功
+
+        :param action: 操作名称，用于记录日志
+        :param result: 接口返回的结果
+        :return: bool
+        """
+        if result.get('errno') != 0:
+            logging.info(f"[baidu_netdisk] {action} failed: {result}")
+            return False
+        return True
+
     def copy(self, filePath, destPath):
         """
         复制文件
@@ -54,7 +195,7 @@ class Driver:
         :param destPath:
         :return:
         """
-        return self.api.copy(filePath, destPath)
+        return self._succeeded('copy', self.api.copy(filePath, destPath))
 
     def move(self, filePath, destPath):
         """
@@ -64,7 +205,7 @@ class Driver:
         :param destPath:
         :return:
         """
-        return self.api.move(filePath, destPath)
+        return self._succeeded('move', self.api.move(filePath, destPath))
 
     def rename(self, filePath, newName):
         """
@@ -74,7 +215,7 @@ class Driver:
         :param newName:
         :return:
         """
-        return self.api.rename(filePath, newName)
+        return self._succeeded('rename', self.api.rename(filePath, newName))
 
     def delete(self, filePath):
         """
@@ -83,4 +224,21 @@ class Driver:
         :param filePath:
         :return:
         """
-        return self.api.delete(filePath)
+        return self._succeeded('delete', self.api.delete(filePath))
+
+    def download(self, filePath, start, end, extra=None):
+        """
+        按字节范围下载文件
+
+        fs_id 优先使用目录列表时记录在 inode 表中的值，没有记录时才调用 search 接口
+
+        :param filePath:
+        :param start: 起始字节位置(包含)
+        :param end: 结束字节位置(不包含)
+        :param extra: list 时 info 中附加的字段
+        :return: bytes
+        """
+        fsid = extra.get('fs_id') if extra else None
+        if fsid is None:
+            fsid = self.api.path_to_fsid(filePath)
+        return self.api.download(fsid, start, end)
@@ -0,0 +1,114 @@
+import threading
+import logging
+from concurrent.futures import Future
+
+FILEMETAS_LIMIT = 100  # filemetas 接口一次最多查询的 fsid 数量
+BATCH_WINDOW = 0.02  # 已有请求在进行时，合并之后的查询的等待窗口(秒)
+
+
+class BatchResolver:
+    """
+    合并查询 fs_id
+
+    没有请求在进行时立即发送，单独的查询不需要等待；
+    已有请求在进行时，之后的查询在等待窗口内合并为一次 filemetas 请求（每次最多 100 个 fsid），
+    请求返回后再按 fs_id 分发给各个调用者
+    已经在请求中的 fsid 直接共享这次请求的结果
+    """
+
+    def __init__(self, fetch, window=BATCH_WINDOW, limit=FILEMETAS_LIMIT):
+        """
+        :param fetch: 批量查询函数，传入 fsid 列表，返回 {fs_id: 信息}
+        :param window: 已有请求在进行时合并查询的等待窗口(秒)
+        :param limit: 一次请求最多包含的 fsid 数量
+        """
+        self.fetch = fetch
+        self.window = window
+        self.limit = limit
+
+        self.pending = {}  # 等待发送的 fsid -> Future
+        self.inflight = {}  # 已经发送、还没有返回的 fsid -> Future
+        self.sending = 0  # 正在进行的请求数
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def submit(self, fsid) -> Future:
+        """
+        提交一个查询，同一个 fsid 的重复查询共享同一个结果
+
+        :param fsid:
+        :return: Future
+        """
+        batch = None
+        with self.lock:
+            future = self.inflight.get(fsid) or self.pending.get(fsid)
+            if future is None:
+                future = Future()
+                self.pending[fsid] = future
+                if not self.sending or len(self.pending) >= self.limit:  # 没有请求在进行或者凑满一批时立即发送
+                    batch = self._take()
+                elif self.timer is None:
+                    self.timer = threading.Timer(self.window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        if batch:
+            self._resolve(batch)
+        return future
+
+    def get(self, fsid, timeout=None):
+        """
+        查询一个 fsid 的信息
+
+        :param fsid:
+        :param timeout: 超时时间(秒)
+        :return: 对应的信息
+        """
+        return self.submit(fsid).result(timeout)
+
+    def flush(self):
+        """
+        立即发送所有等待中的查询
+        """
+        with self.lock:
+            batch = self._take()
+        if batch:
+            self._resolve(batch)
+
+    def _take(self):
+        """
+        取出等待中的查询并登记为正在请求，需要在持有 self.lock 的情况下调用
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch = self.pending
+        self.pending = {}
+        if batch:
+            self.inflight.update(batch)
+            self.sending += 1
+        return batch
+
+    def _resolve(self, batch):
+        try:
+            fsids = list(batch)
+            for i in range(0, len(fsids), self.limit):
+                chunk = fsids[i:i + self.limit]
+                try:
+                    result = self.fetch(chunk)
+                except Exception as e:
+                    logging.info(f"[baidu_netdisk] filemetas {len(chunk)} fsids failed: {e}")
+                    result = e
+
+                with self.lock:
+                    for fsid in chunk:
+                        self.inflight.pop(fsid, None)
+                for fsid in chunk:
+                    if isinstance(result, Exception):
+                        batch[fsid].set_exception(result)
+                    elif fsid in result:
+                        batch[fsid].set_result(result[fsid])
+                    else:
+                        batch[fsid].set_exception(KeyError(f'fsid {fsid} not found'))
+        finally:
+            with self.lock:
+                self.sending -= 1
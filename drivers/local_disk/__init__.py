@@ -0,0 +1 @@
+from .driver import Driver
\ No newline at end of file
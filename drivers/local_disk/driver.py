@@ -0,0 +1,200 @@
+import itertools
+import os
+import shutil
+import threading
+
+from easydict import EasyDict
+
+LIST_LIMIT = 1000  # 每页的最大数量，与百度网盘保持一致
+
+
+class Driver:
+    """
+    本地目录驱动
+
+    把本地的一个目录当作网盘使用，不需要网络和账号，
+    用来在测试中代替真实的网盘接口
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.root = os.path.abspath(config.root_path)
+
+        self.snapshots = {}  # cursor -> 当时的目录树快照 {path: (isdir, size, mtime)}
+        self.cursor_counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _local_path(self, path):
+        """
+        网盘路径转换为本地路径
+        """
+        return os.path.join(self.root, path.lstrip('/'))
+
+    @staticmethod
+    def _to_item(path, stat, isdir):
+        return EasyDict({
+            'name': os.path.basename(path),
+            'path': path,
+            'info': {
+                'isdir': isdir,
+                'size': 0 if isdir else stat.st_size,
+                'mtime': int(stat.st_mtime),
+                'ctime': int(stat.st_ctime),
+            }
+        })
+
+    def quota(self):
+        """
+        获取容量信息
+
+        :return:  EasyDict({"total": total, "used": used})
+        """
+        usage = shutil.disk_usage(self.root)
+        return EasyDict({"total": usage.total, "used": usage.used})
+
+    def list(self, dir='/', **kwargs):
+        """
+        获取文件列表
+
+        :param dir: 目录路径
+        :return:
+        """
+        return_lists = []
+        with os.scandir(self._local_path(dir)) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                path = dir.rstrip('/') + '/' + entry.name
+                return_lists.append(self._to_item(path, entry.stat(), entry.is_dir()))
+        return return_lists
+
+    def listall_pages(self, path='/'):
+        """
+        递归获取目录下的所有文件，每次返回一页
+
+        :param path: 目录路径
+        :return: 生成器，每次返回一页 list[EasyDict(Item)]
+        """
+        page = []
+        for dir, dirs, files in os.walk(self._local_path(path)):
+            dirs.sort()
+            rel = os.path.relpath(dir, self.root).replace(os.sep, '/')
+            rel = '' if rel == '.' else '/' + rel
+            for names, isdir in ((dirs, True), (sorted(files), False)):
+                for name in names:
+                    page.append(self._to_item(f'{rel}/{name}', os.stat(os.path.join(dir, name)), isdir))
+                    if len(page) >= LIST_LIMIT:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    def _snapshot(self):
+        """
+        记录整个目录树的状态
+        """
+        snapshot = {}
+        for page in self.listall_pages('/'):
+            for item in page:
+                snapshot[item.path] = (item.info['isdir'], item.info['size'], item.info['mtime'])
+        return snapshot
+
+    def changes(self, cursor):
+        """
+        获取自 cursor 之后目录中发生的变化
+
+        本地目录没有变化记录，通过对比前后两次的快照得到变化，cursor 即快照的编号
+
+        :param cursor: 上一次返回的 cursor，第一次查询时为 None
+        :return: EasyDict({"changes": changes, "cursor": cursor, "has_more": bool, "reset": bool})
+        """
+        current = self._snapshot()
+        with self.lock:
+            previous = self.snapshots.pop(cursor, None)
+            new_cursor = next(self.cursor_counter)
+            self.snapshots[new_cursor] = current
+
+        changes = []
+        if previous is not None:
+            for path in previous.keys() - current.keys():
+                changes.append(EasyDict({'path': path, 'deleted': True}))
+            for path, state in current.items():
+                if previous.get(path) != state:
+                    try:
+                        item = self._to_item(path, os.stat(self._local_path(path)), state[0])
+                    except FileNotFoundError:  # 快照之后又被删除，下次查询时作为删除处理
+                        continue
+                    item.deleted = False
+                    changes.append(item)
+
+        return EasyDict({
+            'changes': changes,
+            'cursor': new_cursor,
+            'has_more': False,
+            'reset': previous is None,
+        })
+
+    def copy(self, filePath, destPath):
+        """
+        复制文件到目标目录
+
+        :param filePath:
+        :param destPath: 目标目录
+        :return:
+        """
+        src = self._local_path(filePath)
+        dest = os.path.join(self._local_path(destPath), os.path.basename(filePath))
+        if os.path.isdir(src):
+            shutil.copytree(src, dest)
+        else:
+            shutil.copy2(src, dest)
+        return True
+
+    def move(self, filePath, destPath):
+        """
+        移动文件到目标目录
+
+        :param filePath:
+        :param destPath: 目标目录
+        :return:
+        """
+        shutil.move(self._local_path(filePath), self._local_path(destPath))
+        return True
+
+    def rename(self, filePath, newName):
+        """
+        重命名文件
+
+        :param filePath:
+        :param newName:
+        :return:
+        """
+        src = self._local_path(filePath)
+        os.rename(src, os.path.join(os.path.dirname(src), newName))
+        return True
+
+    def delete(self, filePath):
+        """
+        删除文件
+
+        :param filePath:
+        :return:
+        """
+        local = self._local_path(filePath)
+        if os.path.isdir(local):
+            shutil.rmtree(local)
+        else:
+            os.remove(local)
+        return True
+
+    def download(self, filePath, start, end, extra=None):
+        """
+        按字节范围读取文件
+
+        :param filePath:
+        :param start: 起始字节位置(包含)
+        :param end: 结束字节位置(不包含)
+        :param extra: 未使用
+        :return: bytes
+        """
+        with open(self._local_path(filePath), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
@@ -0,0 +1,21 @@
+import typing
+
+meta = {
+    'name': '本地目录',
+    'package_name': 'local_disk',
+    'doc_link': '',
+    'config': {
+        'LocalRootPath': {
+            'name': 'root_path',
+            'desc': '作为网盘使用的本地目录，主要用于测试',
+            'type': str,
+            'required': True,
+        },
+        'LocalMountPath': {
+            'name': 'mount',
+            'desc': '本地目录',
+            'type': str,
+            'required': True,
+        },
+    },
+}
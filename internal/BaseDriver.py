@@ -17,6 +17,7 @@ class Info(TypedDict):
     size: int  # 文件大小(字节)
     mtime: int  # 修改时间(时间戳)，不确定的可以使用time.time()获取当前时间戳来代替
     ctime: int  # 创建时间(时间戳)，不确定的可以使用time.time()获取当前时间戳来代替
+    # 除此之外驱动可以附加自己的字段，例如百度网盘的 fs_id、md5、category
 
 
 class Item(TypedDict):
@@ -57,6 +58,48 @@ class BaseDriver(ABC):
         """
         pass
 
+    def list_pages(self, path: str):
+        """
+        分页获取文件列表
+
+        大目录可以实现这个方法，每读取到一页就返回一页，目录缓存会先发布已经读取到的部分
+        默认实现直接返回 list 的结果作为唯一的一页
+
+        :param path: 需要获取文件列表的目录路径，相对于网盘根目录，以 / 开头，例如: /path/to/dir
+        :return: 生成器，每次返回一页 list[EasyDict(Item)]
+        """
+        yield self.list(path)
+
+    def listall_pages(self, path: str):
+        """
+        递归获取目录下的所有文件
+
+        网盘提供递归列表接口时可以实现这个方法，挂载时会用它批量导入整个目录树，
+        未实现时会退回到逐个目录读取
+
+        :param path: 目录路径，相对于网盘根目录，以 / 开头，例如: /path/to/dir
+        :return: 生成器，每次返回一页 list[EasyDict(Item)]，包含所有层级的子项
+        """
+        raise NotImplementedError
+
+    def changes(self, cursor):
+        """
+        获取自 cursor 之后网盘中发生的变化
+
+        网盘提供增量变化接口时可以实现这个方法，挂载后会定期轮询并把变化应用到目录缓存，
+        不再需要定期重新读取所有目录；未实现时仍然按超时时间重新读取目录
+
+        返回内容为 EasyDict 对象，包含:
+            changes:  list[EasyDict(Item)]，每项额外包含 deleted 字段，被删除的项只需要 path
+            cursor:   下一次查询使用的 cursor
+            has_more: 是否还有更多变化，为 True 时使用新的 cursor 立即继续查询
+            reset:    cursor 失效或者是第一次查询，之前的缓存需要重新读取
+
+        :param cursor: 上一次返回的 cursor，第一次查询时为 None
+        :return: EasyDict({"changes": changes, "cursor": cursor, "has_more": bool, "reset": bool})
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def copy(self, src_path: str, dest_path: str) -> bool:
         """
@@ -99,3 +142,18 @@ class BaseDriver(ABC):
         :return: bool
         """
         pass
+
+    def download(self, path: str, start: int, end: int, extra: dict = None) -> bytes:
+        """
+        按字节范围下载文件内容
+
+        用于按块读取，只会请求需要的部分，而不是整个文件
+        没有实现的驱动读取文件时返回错误
+
+        :param path: 文件路径，相对于网盘根目录，以 / 开头，例如: /path/to/file.txt
+        :param start: 起始字节位置(包含)
+        :param end: 结束字节位置(不包含)
+        :param extra: list 时 info 中附加的字段（例如百度网盘的 fs_id），随 inode 表持久化；没有记录时为 None
+        :return: bytes，长度为 end - start
+        """
+        raise NotImplementedError
@@ -0,0 +1,400 @@
+import os
+import threading
+from collections import OrderedDict
+
+from config import config
+from internal.log import get_logger
+from internal.driver import drivers_obj
+from internal.inode import inodeTable
+from internal.temp_fs import tempFs
+from internal.single_flight import singleFlight, Flight
+
+if os.name == 'nt':
+    import msvcrt
+    import win32file
+    import winioctlcon
+
+logger = get_logger(__name__)
+
+DEFAULT_BLOCK_SIZE = 262144  # 默认块大小 256KB
+BYPASS_CHUNK = 1048576  # 不缓存的文件按这个大小对齐分段下载(字节)
+BYPASS_BUFFERS = 32  # 不缓存的文件最多保留在内存中的段数
+DEFAULT_WAIT_TIMEOUT = 120  # 默认等待其他线程下载块的最长时间(秒)
+
+
+def create_sparse(file_path: str, size: int):
+    """
+    创建一个 size 字节的稀疏文件，只占位，不实际写入数据
+
+    NTFS 上需要先设置稀疏标志，否则扩展文件大小时会分配并清零整个文件
+    """
+    with open(file_path, 'wb') as f:
+        if os.name == 'nt':
+            win32file.DeviceIoControl(msvcrt.get_osfhandle(f.fileno()), winioctlcon.FSCTL_SET_SPARSE, None, None)
+        f.truncate(size)
+
+
+class BlockBitmap:
+    """ 记录一个缓存文件中哪些块已经下载 """
+    __slots__ = ('count', 'bits', 'filled')
+
+    def __init__(self, count: int, bits=None):
+        self.count = count  # 块总数
+        if bits is None:
+            self.bits = bytearray((count + 7) // 8)
+            self.filled = 0  # 已下载的块数
+        else:
+            self.bits = bytearray(bits)
+            self.filled = bin(int.from_bytes(self.bits, 'little')).count('1')
+
+    @classmethod
+    def full_of(cls, count: int):
+        """ 创建一个所有块都已下载的位图 """
+        bitmap = cls(count)
+        bitmap.bits[:count // 8] = b'\xff' * (count // 8)
+        bitmap.filled = count // 8 * 8
+        for index in range(count // 8 * 8, count):
+            bitmap.set(index)
+        return bitmap
+
+    def has(self, index: int) -> bool:
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def set(self, index: int):
+        if not self.has(index):
+            self.bits[index >> 3] |= 1 << (index & 7)
+            self.filled += 1
+
+    def full(self) -> bool:
+        return self.filled >= self.count
+
+    def missing(self, first: int, last: int):
+        """
+        获取 [first, last] 中缺失的块，相邻的缺失块会合并为一段
+
+        :return: [(起始块, 结束块(不包含)), ...]
+        """
+        runs = []
+        run_start = None
+        for index in range(first, last + 1):
+            if self.has(index):
+                if run_start is not None:
+                    runs.append((run_start, index))
+                    run_start = None
+            elif run_start is None:
+                run_start = index
+        if run_start is not None:
+            runs.append((run_start, last + 1))
+        return runs
+
+
+class CacheEntry:
+    """ 一个正在按块读取的缓存文件 """
+    __slots__ = ('file_path', 'bitmap')
+
+    def __init__(self, file_path: str, bitmap: BlockBitmap):
+        self.file_path = file_path  # 缓存文件路径
+        self.bitmap = bitmap  # 已下载的块，由该文件的 Flight.lock 保护
+
+
+class BlockReader:
+    """
+    按块读取云端文件
+
+    未命中缓存时只通过 HTTP Range 下载请求范围所在的块，写入稀疏的缓存文件，并在位图中记录已下载的块
+    位图保存在 tempFs 的元信息中，重启或断网后只需下载缺失的块
+    同一个文件的不同范围可以并发下载，同一个块只会被下载一次，其他读取者通过 singleFlight 等待它完成
+    没有通过 tempFs 准入的文件不写入缓存，直接从云端读取
+    缓存文件和下载按 inode 表中的文件标识登记，文件移动、重命名后仍然使用同一个缓存文件
+    """
+
+    def __init__(self, temp_fs=tempFs, inodes=inodeTable):
+        """
+        :param temp_fs: 缓存文件的分配和淘汰
+        :param inodes: inode 表，用于获取文件标识
+        """
+        self.temp_fs = temp_fs
+        self.inodes = inodes
+        self.block_size = config.temp.file.get('BLOCK_SIZE', DEFAULT_BLOCK_SIZE)  # 块大小
+        self.wait_timeout = config.temp.file.get('WAIT_TIMEOUT', DEFAULT_WAIT_TIMEOUT)  # 等待其他线程下载的最长时间
+
+        self.entries = {}  # 缓存文件的按块读取状态，key 与 tempFs 一致
+        self.bypass = OrderedDict()  # 不缓存的文件最近下载的段 (key, 段序号) -> 数据
+        self.lock = threading.Lock()
+        self.temp_fs.on_drop.append(self._on_drop)  # 缓存文件被淘汰或移除后丢弃读取状态
+
+    def file_id(self, name, path: str) -> str:
+        """
+        获取文件在 tempFs 和 singleFlight 中使用的标识
+
+        :raise FileNotFoundError: 文件不在 inode 表中
+        """
+        node = self.inodes.lookup(name, path)
+        if node is None:
+            raise FileNotFoundError(path)
+        return self.inodes.file_id(node)
+
+    def _open_entry(self, name, path: str, uid: str, file_size: int, flight: Flight):
+        """
+        获取文件对应的按块读取状态，缓存文件不存在的话会分配一个稀疏的缓存文件
+
+        分配在该文件的 flight.lock 中进行，不阻塞其他文件的读取
+        缓存文件已经被移除的话丢弃原来的状态重新分配
+
+        :return: CacheEntry，文件没有通过准入、不缓存时返回 None
+        """
+        key = self.temp_fs.generate_key(name, uid)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and self.temp_fs.has(name, uid):
+            return entry
+
+        count = (file_size + self.block_size - 1) // self.block_size
+        with flight.lock:
+            file_path = self.temp_fs.peek(name, uid)  # 访问已经在打开时记录，读取不再计入淘汰策略
+            if file_path is not None:
+                with self.lock:
+                    entry = self.entries.get(key)
+                if entry is not None:  # 其他线程已经分配
+                    return entry
+            elif not self.temp_fs.admit(name, uid, file_size):
+                return None
+            else:
+                # 占用大小随下载的块增加
+                file_path = self.temp_fs.allocate(name, uid, file_size, suffix=os.path.splitext(path)[1], used=0)
+                create_sparse(file_path, file_size)
+                self.temp_fs.set_blocks(name, uid, self.block_size, BlockBitmap(count).bits)
+
+            entry = CacheEntry(file_path, self._load_bitmap(name, uid, count))
+            with self.lock:
+                self.entries[key] = entry
+                for chunk_key in [chunk_key for chunk_key in self.bypass if chunk_key[0] == key]:
+                    del self.bypass[chunk_key]
+            return entry
+
+    def forget(self, name, uid: str):
+        """
+        丢弃文件的按块读取状态，缓存文件被移除后调用
+
+        :param name: 对应驱动的名称
+        :param uid: 文件的标识，同 file_id
+        """
+        with self.lock:
+            self.entries.pop(self.temp_fs.generate_key(name, uid), None)
+
+    def _on_drop(self, keys):
+        """
+        缓存文件被淘汰或移除后丢弃对应的按块读取状态
+        """
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def _load_bitmap(self, name, uid: str, count: int) -> BlockBitmap:
+        """
+        从 tempFs 的元信息中恢复块位图
+        """
+        blocks = self.temp_fs.get_blocks(name, uid)
+        if blocks is None:  # 没有位图的缓存文件是完整的
+            return BlockBitmap.full_of(count)
+
+        block_size, bits = blocks
+        if block_size != self.block_size or len(bits) != (count + 7) // 8:  # 块大小配置变化，只能重新下载
+            bits = None
+        return BlockBitmap(count, bits)
+
+    def _download(self, name, path: str, start: int, end: int) -> bytes:
+        """
+        从驱动下载一段内容，同时传入 inode 表中记录的驱动附加字段，驱动不需要自己按路径查找
+        """
+        return drivers_obj[name].download(path, start, end, self.inodes.get_extra(name, path))
+
+    def _download_run(self, name, path: str, uid: str, file_size: int, entry: CacheEntry, flight: Flight,
+                      run_start: int, run_end: int):
+        """
+        下载认领到的一段块并写入缓存文件
+
+        :return: 是否写入，缓存中的其他文件都在读取中、腾不出空间时不下载，返回 False
+        """
+        byte_start = run_start * self.block_size
+        byte_end = min(run_end * self.block_size, file_size)
+        if not self.temp_fs.reserve(byte_end - byte_start):
+            return False
+        data = self._download(name, path, byte_start, byte_end)
+        if len(data) != byte_end - byte_start:
+            raise IOError(f'{path} [{byte_start}-{byte_end}] 下载不完整: {len(data)}')
+
+        with open(entry.file_path, 'r+b') as f:
+            f.seek(byte_start)
+            f.write(data)
+        with flight.lock:
+            for index in range(run_start, run_end):
+                entry.bitmap.set(index)
+            # 持久化位图，文件完整后不再需要位图
+            self.temp_fs.set_blocks(name, uid, self.block_size, None if entry.bitmap.full() else entry.bitmap.bits)
+        logger.debug(f'fetch {path} [{byte_start}-{byte_end}]')
+        return True
+
+    def fetch(self, name, path: str, file_size: int, start: int, end: int) -> str:
+        """
+        确保 [start, end) 范围所在的块都已下载到缓存文件
+
+        :param name: 对应驱动的名称
+        :param path: 文件路径，相对于网盘根目录，以 / 开头
+        :param file_size: 文件大小
+        :param start: 起始字节位置(包含)
+        :param end: 结束字节位置(不包含)
+        :return: 缓存文件路径，文件没有通过准入、不缓存或者缓存腾不出空间时返回 None
+        """
+        uid = self.file_id(name, path)
+        flight = singleFlight.acquire(name, uid)
+        self.temp_fs.pin(name, uid)  # 下载过程中不淘汰
+        try:
+            entry = self._open_entry(name, path, uid, file_size, flight)
+            if entry is None:
+                return None
+            first = start // self.block_size
+            last = (end - 1) // self.block_size
+
+            while True:
+                with flight.lock:
+                    claimed, waiting = flight.claim(entry.bitmap, first, last)
+                if not claimed and not waiting:
+                    return entry.file_path
+
+                try:
+                    for run_start, run_end, event in claimed:
+                        if not self._download_run(name, path, uid, file_size, entry, flight, run_start, run_end):
+                            return None  # 由调用者直接从云端读取
+                        flight.release(run_start, run_end, event)
+                finally:
+                    # 下载失败时释放剩余认领的块，避免其他线程一直等待
+                    for run_start, run_end, event in claimed:
+                        flight.release(run_start, run_end, event)
+                # 其他线程下载失败的块会在下一轮由自己认领
+                for event in waiting:
+                    if not event.wait(self.wait_timeout):
+                        raise TimeoutError(f'{path} [{start}-{end}] 等待下载超时')
+        finally:
+            self.temp_fs.unpin(name, uid)
+            singleFlight.release(flight)
+
+    def prefetch(self, name, path: str, file_size: int, start: int, end: int) -> bool:
+        """
+        预读 [start, end)，缓存的文件下载到缓存文件，不缓存的文件下载到内存中的段，之后的读取直接使用
+
+        :param name: 对应驱动的名称
+        :param path: 文件路径，相对于网盘根目录，以 / 开头
+        :param file_size: 文件大小
+        :param start: 起始字节位置(包含)
+        :param end: 结束字节位置(不包含)
+        :return: 是否写入缓存文件，False 表示文件不缓存
+        """
+        if self.fetch(name, path, file_size, start, end) is not None:
+            return True
+        self._bypass_chunks(name, path, self.file_id(name, path), file_size, start, end)
+        return False
+
+    def read(self, name, path: str, file_size: int, size: int, offset: int) -> bytes:
+        """
+        读取云端文件的一部分，未缓存的块会先按需下载
+
+        :param name: 对应驱动的名称
+        :param path: 文件路径，相对于网盘根目录，以 / 开头
+        :param file_size: 文件大小
+        :param size: 读取长度
+        :param offset: 读取位置
+        :return: bytes
+        """
+        if offset >= file_size or size <= 0:
+            return b''
+        end = min(offset + size, file_size)
+
+        uid = self.file_id(name, path)
+        key = self.temp_fs.generate_key(name, uid)
+        first = offset // BYPASS_CHUNK
+        last = (end - 1) // BYPASS_CHUNK
+        with self.lock:  # 已经在内存中的不缓存文件直接读取，不需要再判断准入
+            chunks = [self.bypass.get((key, chunk)) for chunk in range(first, last + 1)]
+            if None not in chunks:
+                for chunk in range(first, last + 1):
+                    self.bypass.move_to_end((key, chunk))
+        if None not in chunks:
+            return b''.join(chunks)[offset - first * BYPASS_CHUNK:end - first * BYPASS_CHUNK]
+
+        self.temp_fs.pin(name, uid)  # 下载完成到读取之间不淘汰
+        try:
+            file_path = self.fetch(name, path, file_size, offset, end)
+            if file_path is None:
+                return self._read_bypass(name, path, uid, file_size, offset, end)
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                return f.read(end - offset)
+        finally:
+            self.temp_fs.unpin(name, uid)
+
+    def _read_bypass(self, name, path: str, uid: str, file_size: int, offset: int, end: int) -> bytes:
+        """
+        不经过缓存文件直接从云端读取 [offset, end)
+
+        按 BYPASS_CHUNK 对齐分段下载，保留在内存中，顺序读取时之后的读取直接使用这些段
+        同一段只下载一次，并发读取同一段的线程通过 singleFlight 等待它完成
+        """
+        first = offset // BYPASS_CHUNK
+        data = b''.join(self._bypass_chunks(name, path, uid, file_size, offset, end))
+        return data[offset - first * BYPASS_CHUNK:end - first * BYPASS_CHUNK]
+
+    def _bypass_chunks(self, name, path: str, uid: str, file_size: int, offset: int, end: int) -> list:
+        """
+        获取不缓存的文件 [offset, end) 所在的各段
+        """
+        key = self.temp_fs.generate_key(name, uid)
+        flight = singleFlight.acquire(name, uid)
+        try:
+            return [self._bypass_chunk(name, path, key, file_size, flight, chunk)
+                    for chunk in range(offset // BYPASS_CHUNK, (end - 1) // BYPASS_CHUNK + 1)]
+        finally:
+            singleFlight.release(flight)
+
+    def _bypass_chunk(self, name, path: str, key: str, file_size: int, flight: Flight, chunk: int) -> bytes:
+        """
+        获取不缓存的文件的一段，内存中没有的话下载，其他线程正在下载的话等待它完成
+        """
+        while True:
+            with self.lock:
+                data = self.bypass.get((key, chunk))
+                if data is not None:
+                    self.bypass.move_to_end((key, chunk))
+                    return data
+
+            with flight.lock:
+                event = flight.bypass.get(chunk)
+                claimed = event is None
+                if claimed:
+                    event = flight.bypass[chunk] = threading.Event()
+            if not claimed:
+                # 下载失败的段会在下一轮由自己认领
+                if not event.wait(self.wait_timeout):
+                    raise TimeoutError(f'{path} [{chunk * BYPASS_CHUNK}] 等待下载超时')
+                continue
+
+            try:
+                start = chunk * BYPASS_CHUNK
+                stop = min(start + BYPASS_CHUNK, file_size)
+                data = self._download(name, path, start, stop)
+                if len(data) != stop - start:
+                    raise IOError(f'{path} [{start}-{stop}] 下载不完整: {len(data)}')
+                logger.debug(f'bypass {path} [{start}-{stop}]')
+
+                with self.lock:
+                    self.bypass[(key, chunk)] = data
+                    while len(self.bypass) > BYPASS_BUFFERS:
+                        self.bypass.popitem(last=False)
+                return data
+            finally:
+                with flight.lock:
+                    del flight.bypass[chunk]
+                event.set()
+
+
+blockReader = BlockReader()
@@ -0,0 +1,476 @@
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+
+class CachePolicy:
+    """
+    缓存文件的淘汰策略
+
+    只记录 key 和淘汰需要的信息，不负责删除文件和统计占用大小，
+    由 TempFs 在访问时调用 touch，需要腾出空间时调用 pop_entry 取出要淘汰的 key，不能淘汰的用 unpop 放回
+    """
+
+    sized = False  # 是否需要文件大小，不需要时重建时不读取每个文件的元信息
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: 缓存的最大大小，单位为字节
+        """
+        self.capacity = capacity
+
+    def touch(self, key, size=None):
+        """
+        记录一次访问，不存在的 key 会加入
+
+        :param key: 缓存文件的 key
+        :param size: 文件大小，None 表示沿用已经记录的大小
+        """
+        raise NotImplementedError
+
+    def resize(self, key, size: int):
+        """
+        更新文件大小，不计为一次访问，不存在的 key 不会加入
+
+        不需要文件大小的策略什么也不做
+        """
+
+    def remove(self, key):
+        """
+        移除 key，不存在时什么也不做
+        """
+        raise NotImplementedError
+
+    def pop(self):
+        """
+        取出并移除下一个要淘汰的 key，没有可以淘汰的 key 时抛出 KeyError
+        """
+        return self.pop_entry()[0]
+
+    def pop_entry(self):
+        """
+        同 pop，同时返回放回原来位置需要的状态，配合 unpop 使用
+
+        :return: (key, 状态)
+        """
+        raise NotImplementedError
+
+    def unpop(self, key, state):
+        """
+        把 pop_entry 取出、最终没有淘汰的 key（例如正在读取的文件）放回原来的位置，不计为一次访问
+
+        取出多个 key 时按取出的相反顺序放回
+        """
+        raise NotImplementedError
+
+    def victim(self):
+        """
+        下一个要淘汰的 key，不取出，没有时返回 None
+        """
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        """
+        按淘汰顺序遍历 key，先淘汰的在前，用于压缩访问日志
+        """
+        raise NotImplementedError
+
+
+class LRUPolicy(CachePolicy):
+    """
+    最近最少使用，淘汰最久没有访问的文件
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.order = OrderedDict()  # key -> None，越靠后越是最近使用
+
+    def touch(self, key, size=None):
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def remove(self, key):
+        self.order.pop(key, None)
+
+    def pop_entry(self):
+        return self.order.popitem(last=False)[0], None
+
+    def unpop(self, key, state):
+        self.order[key] = None
+        self.order.move_to_end(key, last=False)
+
+    def victim(self):
+        return next(iter(self.order), None)
+
+    def __contains__(self, key):
+        return key in self.order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return iter(list(self.order))
+
+
+class LFUPolicy(CachePolicy):
+    """
+    最不经常使用，淘汰访问次数最少的文件，次数相同时淘汰最久没有访问的
+    按访问次数分桶，访问和淘汰都是 O(1)
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.freq = {}  # key -> 访问次数
+        self.buckets = {}  # 访问次数 -> OrderedDict(key -> None)
+        self.min_freq = 0
+
+    def touch(self, key, size=None):
+        freq = self.freq.get(key, 0)
+        if freq:
+            bucket = self.buckets[freq]
+            del bucket[key]
+            if not bucket:
+                del self.buckets[freq]
+                if self.min_freq == freq:
+                    self.min_freq = freq + 1
+        else:
+            self.min_freq = 1
+        self.freq[key] = freq + 1
+        self.buckets.setdefault(freq + 1, OrderedDict())[key] = None
+
+    def remove(self, key):
+        freq = self.freq.pop(key, None)
+        if freq is None:
+            return
+        bucket = self.buckets[freq]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[freq]  # min_freq 在 pop 时再向上查找
+
+    def pop_entry(self):
+        if not self.freq:
+            raise KeyError('pop from an empty policy')
+        while self.min_freq not in self.buckets:
+            self.min_freq += 1
+        bucket = self.buckets[self.min_freq]
+        key, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self.buckets[self.min_freq]
+        return key, self.freq.pop(key)
+
+    def unpop(self, key, state):
+        self.freq[key] = state
+        bucket = self.buckets.setdefault(state, OrderedDict())
+        bucket[key] = None
+        bucket.move_to_end(key, last=False)
+        self.min_freq = min(self.min_freq, state)
+
+    def victim(self):
+        if not self.freq:
+            return None
+        while self.min_freq not in self.buckets:
+            self.min_freq += 1
+        return next(iter(self.buckets[self.min_freq]))
+
+    def __contains__(self, key):
+        return key in self.freq
+
+    def __len__(self):
+        return len(self.freq)
+
+    def __iter__(self):
+        return iter([key for freq in sorted(self.buckets) for key in self.buckets[freq]])
+
+
+class ARCPolicy(CachePolicy):
+    """
+    自适应替换缓存（ARC），按字节计算
+
+    T1 记录只访问过一次的文件，T2 记录访问过多次的文件，B1、B2 分别记录最近从 T1、T2 淘汰的 key，
+    命中 B1 说明 T1 太小，命中 B2 说明 T2 太小，据此调整 T1 的目标大小 p
+    一次性扫描大量文件只会进入 T1，不会冲掉 T2 中经常访问的文件
+    """
+
+    sized = True
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.t1 = OrderedDict()  # key -> 大小，越靠后越是最近使用
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()  # 已经淘汰的 key -> 大小
+        self.b2 = OrderedDict()
+        self.t1_size = self.t2_size = self.b1_size = self.b2_size = 0
+        self.p = 0  # T1 的目标大小(字节)
+
+    def touch(self, key, size=None):
+        if key in self.t1:
+            old = self.t1.pop(key)
+            self.t1_size -= old
+            self._add_t2(key, old if size is None else size)
+        elif key in self.t2:
+            old = self.t2.pop(key)
+            self.t2_size -= old
+            self._add_t2(key, old if size is None else size)
+        elif key in self.b1:
+            old = self.b1.pop(key)
+            self.b1_size -= old
+            size = old if size is None else size
+            self.p = min(self.capacity, self.p + max(self.b2_size / max(self.b1_size, 1), 1) * max(size, 1))
+            self._add_t2(key, size)
+        elif key in self.b2:
+            old = self.b2.pop(key)
+            self.b2_size -= old
+            size = old if size is None else size
+            self.p = max(0, self.p - max(self.b1_size / max(self.b2_size, 1), 1) * max(size, 1))
+            self._add_t2(key, size)
+        else:
+            size = size or 0
+            self.t1[key] = size
+            self.t1_size += size
+
+    def _add_t2(self, key, size):
+        self.t2[key] = size
+        self.t2_size += size
+
+    def resize(self, key, size: int):
+        for lst, attr in ((self.t1, 't1_size'), (self.t2, 't2_size'), (self.b1, 'b1_size'), (self.b2, 'b2_size')):
+            if key in lst:
+                setattr(self, attr, getattr(self, attr) - lst[key] + size)
+                lst[key] = size  # 已经存在的 key 位置不变
+                return
+
+    def remove(self, key):
+        for lst, attr in ((self.t1, 't1_size'), (self.t2, 't2_size'), (self.b1, 'b1_size'), (self.b2, 'b2_size')):
+            if key in lst:
+                setattr(self, attr, getattr(self, attr) - lst.pop(key))
+                return
+
+    def pop_entry(self):
+        if self.t1 and (self.t1_size > self.p or not self.t2):
+            key, size = self.t1.popitem(last=False)
+            self.t1_size -= size
+            self.b1[key] = size
+            self.b1_size += size
+            state = (1, size)
+        elif self.t2:
+            key, size = self.t2.popitem(last=False)
+            self.t2_size -= size
+            self.b2[key] = size
+            self.b2_size += size
+            state = (2, size)
+        else:
+            raise KeyError('pop from an empty policy')
+
+        # 记录的淘汰历史不超过缓存大小：T1 + B1 <= c，总计 <= 2c
+        while self.b1 and self.t1_size + self.b1_size > self.capacity:
+            self.b1_size -= self.b1.popitem(last=False)[1]
+        while self.b2 and self.t1_size + self.t2_size + self.b1_size + self.b2_size > 2 * self.capacity:
+            self.b2_size -= self.b2.popitem(last=False)[1]
+        return key, state
+
+    def unpop(self, key, state):
+        self.remove(key)  # 从淘汰历史中移除，放回时不算命中 B1、B2
+        lst, size = state
+        if lst == 1:
+            self.t1[key] = size
+            self.t1.move_to_end(key, last=False)
+            self.t1_size += size
+        else:
+            self.t2[key] = size
+            self.t2.move_to_end(key, last=False)
+            self.t2_size += size
+
+    def victim(self):
+        if self.t1 and (self.t1_size > self.p or not self.t2):
+            return next(iter(self.t1))
+        return next(iter(self.t2), None)
+
+    def __contains__(self, key):
+        return key in self.t1 or key in self.t2
+
+    def __len__(self):
+        return len(self.t1) + len(self.t2)
+
+    def __iter__(self):
+        return iter(list(self.t1) + list(self.t2))
+
+
+class GDSFPolicy(CachePolicy):
+    """
+    GreedyDual-Size-Frequency，按 L + 访问次数 / 大小 计算优先级，淘汰优先级最低的文件
+
+    同样的访问次数下大文件优先被淘汰，缓存更多经常访问的小文件；
+    L 为最近一次淘汰的优先级，后加入的文件优先级更高，很久没有访问的文件最终也会被淘汰
+    """
+
+    sized = True
+
+    def __init__(self, capacity: int):
+        super().__init__(capacity)
+        self.entries = {}  # key -> [优先级, 访问次数, 大小]
+        self.heap = []  # (优先级, 序号, key)，更新优先级后旧的条目留在堆中，取出时跳过
+        self.counter = itertools.count()
+        self.clock = 0.0  # L
+
+    def touch(self, key, size=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [0.0, 0, size or 0]
+        elif size is not None:
+            entry[2] = size
+        entry[1] += 1
+        entry[0] = self.clock + entry[1] / max(entry[2], 1)
+        heapq.heappush(self.heap, (entry[0], next(self.counter), key))
+        if len(self.heap) > 2 * len(self.entries) + 1000:
+            self._rebuild()
+
+    def resize(self, key, size: int):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        clock = entry[0] - entry[1] / max(entry[2], 1)  # 最近一次访问时的 L
+        entry[2] = size
+        entry[0] = clock + entry[1] / max(size, 1)
+        heapq.heappush(self.heap, (entry[0], next(self.counter), key))
+
+    def _rebuild(self):
+        self.heap = [(entry[0], next(self.counter), key) for key, entry in self.entries.items()]
+        heapq.heapify(self.heap)
+
+    def remove(self, key):
+        self.entries.pop(key, None)
+
+    def pop_entry(self):
+        while self.heap:
+            priority, seq, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == priority:
+                del self.entries[key]
+                self.clock = priority
+                return key, (entry, seq)
+        raise KeyError('pop from an empty policy')
+
+    def unpop(self, key, state):
+        # 优先级、访问次数和同优先级中的先后顺序不变，L 已经随之后的淘汰前进，不需要恢复
+        entry, seq = state
+        self.entries[key] = entry
+        heapq.heappush(self.heap, (entry[0], seq, key))
+
+    def victim(self):
+        while self.heap:
+            priority, _, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == priority:
+                return key
+            heapq.heappop(self.heap)  # 更新优先级之前留下的旧条目
+        return None
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(sorted(self.entries, key=lambda k: self.entries[k][0]))
+
+
+class CountMinSketch:
+    """
+    Count-Min Sketch，用固定大小的计数器估计每个 key 出现的次数
+
+    每行用 key 的哈希定位一个计数器，估计值取各行的最小值，只会高估不会低估
+    计数器到 15 后不再增加，累计增加 10 * width 次后全部减半，较早的访问逐渐失去影响
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        """
+        :param width: 每行的计数器数量，向上取整为 2 的幂
+        :param depth: 行数
+        """
+        self.width = 1 << max(width - 1, 1).bit_length()
+        self.mask = self.width - 1
+        self.rows = [bytearray(self.width) for _ in range(depth)]
+        self.sample = 10 * self.width
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        for i in range(len(self.rows)):
+            h = (h * 0x9E3779B97F4A7C15 + i) & 0xFFFFFFFFFFFFFFFF
+            yield (h >> 32) & self.mask
+
+    def add(self, key):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample:
+            self.rows = [bytearray(count >> 1 for count in row) for row in self.rows]
+            self.additions //= 2
+
+    def estimate(self, key) -> int:
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class TinyLFU:
+    """
+    TinyLFU 准入策略
+
+    记录最近打开文件的次数，只占用 depth * width 字节，不需要保存每个文件的历史
+    缓存已满时，新文件最近打开的次数要多于淘汰策略下一个要淘汰的文件才会缓存，
+    索引、杀毒软件这类只打开一次的扫描不会挤掉经常使用的缓存文件
+    """
+
+    def __init__(self, width: int = 4096):
+        """
+        :param width: Count-Min Sketch 每行的计数器数量
+        """
+        self.sketch = CountMinSketch(width)
+        self.lock = threading.Lock()
+
+    def record(self, key):
+        """
+        记录一次打开
+        """
+        with self.lock:
+            self.sketch.add(key)
+
+    def admit(self, key, victim) -> bool:
+        """
+        是否接受 key 进入缓存，代替将被淘汰的 victim
+
+        :param key: 还没有缓存的文件
+        :param victim: 淘汰策略下一个要淘汰的文件，None 表示没有可以淘汰的文件
+        """
+        if victim is None:
+            return True
+        return self.sketch.estimate(key) > self.sketch.estimate(victim)
+
+
+POLICIES = {
+    'lru': LRUPolicy,
+    'lfu': LFUPolicy,
+    'arc': ARCPolicy,
+    'gdsf': GDSFPolicy,
+}
+
+
+def get_policy(name: str):
+    """
+    根据名称获取淘汰策略的类
+
+    :param name: lru / lfu / arc / gdsf
+    :return: CachePolicy 的子类
+    """
+    try:
+        return POLICIES[name.lower()]
+    except KeyError:
+        raise ValueError(f'unknown eviction policy {name}, expected one of {", ".join(POLICIES)}') from None
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import errno
+import itertools
 import os
 import json
 import time
@@ -15,6 +16,11 @@ from internal.log import get_logger, funcLog
 from internal.dir_info import dirInfoManager
 from internal.driver import drivers_obj
 from internal.temp_fs import tempFs
+from internal.block_reader import blockReader
+from internal.read_ahead import readAhead
+from internal.negative_cache import negativeCache
+from internal.sync import syncEngine
+from internal.scheduler import FOREGROUND, PARENT
 
 encrpted_length = 512
 
@@ -29,9 +35,11 @@ class CloudFS(Operations):
 
     def __init__(self, name, *args, **kw):
         self.name = name
+        self.fh_counter = itertools.count(1)  # 文件句柄计数器
         logger.info("- fuse 4 cloud driver -")
         self.avail, self.total_size, self.used = self.init_disk_quota()  # 初始化磁盘空间大小
-        dirInfoManager.readDirAsync(self.name, "/", PRELOAD_LEVEL)  # 预读根目录(默认深度为2)
+        dirInfoManager.importTreeAsync(self.name, "/", PRELOAD_LEVEL)  # 批量导入目录树，不支持时按深度预读根目录
+        syncEngine.start(self.name)  # 驱动支持增量变化时定期同步，不支持时什么也不做
 
     def init_disk_quota(self):
         """
@@ -55,8 +63,9 @@ class CloudFS(Operations):
 
     def _getRootAttr(self):
         path = "/"
-        if f'{self.name}@@{path}' in dirInfoManager.buffer:
-            return dirInfoManager.buffer[f'{self.name}@@{path}']
+        attr = dirInfoManager.get_attr(self.name, path)
+        if attr is not None:
+            return attr
 
         file_info = {
             'st_ino': 0,
@@ -70,6 +79,7 @@ class CloudFS(Operations):
             'st_mtime': time.time(),
             'st_ctime': time.time()
         }
+        dirInfoManager.inodes.set_attr(self.name, path, file_info)  # 分配根目录的 inode 编号
         return file_info
 
     @funcLog
@@ -96,21 +106,30 @@ class CloudFS(Operations):
         if path == "/":
             attr = self._getRootAttr()
 
-        # 父目录没有缓存的话先缓存父目录
+        if attr is None:
+            attr = dirInfoManager.get_attr(self.name, path)  # 直接从内存中的 inode 表读取
+
+        if attr is None and path.endswith('.lnk'):
+            # 如果是快捷方式文件，需要尝试读取原文件信息
+            attr = dirInfoManager.get_attr(self.name, path[:-4])
+
         parentDir = os.path.dirname(path)
-        if f'{self.name}@@{parentDir}' not in dirInfoManager.dir_buffer:
-            dirInfoManager.readDirAsync(self.name, parentDir, 1)
+        parent = dirInfoManager.inodes.lookup(self.name, parentDir)
+        complete = parent is not None and parent.complete
+        if attr is None and complete:
+            # 已知不存在的路径直接返回，父目录的子项没有变化前不再触发读取
+            # 父目录没有完整读取过时，名称可能在还没有读取到的分页中，不记录
+            generation = parent.generation
+            if negativeCache.has(self.name, path, generation):
+                raise FuseOSError(errno.ENOENT)
+            negativeCache.add(self.name, path, generation)
 
-        if f'{self.name}@@{path}' in dirInfoManager.buffer:
-            attr = dirInfoManager.buffer[f'{self.name}@@{path}']
+        # 父目录没有完整读取过的话先读取父目录，只检查是否读取过，不生成子项列表
+        if not complete:
+            dirInfoManager.readDirAsync(self.name, parentDir, 1, PARENT)
 
         if attr is None:
-            if (f'{self.name}@@{path}'.endswith('.lnk')) and (f'{self.name}@@{path}'[:-4] in dirInfoManager.buffer):
-                # 如果是快捷方式文件，需要尝试读取原文件信息
-                original_path = f'{self.name}@@{path}'[:-4]
-                attr = dirInfoManager.buffer[original_path]
-            else:
-                raise FuseOSError(errno.ENOENT)
+            raise FuseOSError(errno.ENOENT)
 
         return attr
 
@@ -138,19 +157,20 @@ class CloudFS(Operations):
         :param offset:
         :return:
         """
-        dirInfoManager.readDirAsync(self.name, path, PRELOAD_LEVEL)  # 异步读取目录
+        dirInfoManager.readDirAsync(self.name, path, PRELOAD_LEVEL, FOREGROUND)  # 异步读取目录，优先于预加载
 
         # with open('log.txt', 'w+', encoding='utf-8') as f:
-        #     for k in dirInfoManager.dir_buffer.iterkeys():
-        #         f.write(f'{k}: {dirInfoManager.dir_buffer[k]}\n')
-
-        if f'{self.name}@@{path}' in dirInfoManager.dir_buffer:  # 在缓存中的话就读取对应缓存内容
-            for r in dirInfoManager.dir_buffer[f'{self.name}@@{path}']:
-                yield r.strip('/')
-        else:  # 不在缓存中的话就返回基本的.和..
-            files = ['.', '..']
-            for r in files:
-                yield r
+        #     for k in dirInfoManager.inodes.roots:
+        #         f.write(f'{k}: {dirInfoManager.list_dir(k, "/")}\n')
+
+        yield '.'  # 基本子项，当前目录和上级目录
+        yield '..'
+        # 有缓存时直接返回缓存内容，没有缓存时边读取边返回，超时后只返回已经读取到的部分
+        # 同时返回子项的属性（readdirplus），系统不需要再逐个调用 getattr
+        for entry, attr in dirInfoManager.streamDir(self.name, path, with_attr=True):
+            if entry.endswith('.lnk'):  # 批量导入的文件在目录显示时才生成快捷方式
+                attr = dirInfoManager.ensure_shortcut(self.name, f"{path.rstrip('/')}/{entry}") or attr
+            yield entry, attr, 0
 
     def updateCache(self, path, newValue):
         '''
@@ -167,56 +187,56 @@ class CloudFS(Operations):
         add/update updateCacheKeyOnly(old,new)
         '''
         try:
-            old_parent_dir = os.path.dirname(old)
-            old_name = os.path.basename(old)
             if not new:
-                oldCache = dirInfoManager.dir_buffer.get(old_parent_dir)
-                # remove
-                if oldCache:
-                    if old_name in oldCache:
-                        oldCache.remove(old_name)
-                        dirInfoManager.dir_buffer[old_parent_dir] = oldCache
-                    if old in dirInfoManager.buffer:
-                        dirInfoManager.buffer.pop(old)
-                else:
-                    pass
+                # 移除整个目录树，文件的快捷方式一并移除
+                dirInfoManager.remove_tree(self.name, old)
+                dirInfoManager.remove_tree(self.name, old + '.lnk')
             else:
-                # print("updateCache", old, new)
-                oldCache = dirInfoManager.dir_buffer[old_parent_dir]
-                new_parent_dir = os.path.dirname(new)
-                if old_name in oldCache:
-                    # dir old remove
-                    oldCache.remove(old_name)
-                    dirInfoManager.dir_buffer[old_parent_dir] = oldCache
-                    # dir new add
-                    newfilename = new[new.rfind("/") + 1:]
-                    newCache = dirInfoManager.dir_buffer.get(new_parent_dir, [])
-                    newCache.append(newfilename)
-                    dirInfoManager.dir_buffer[new_parent_dir] = newCache
-
-                if old in dirInfoManager.buffer:
-                    old_info = dirInfoManager.buffer.pop(old)
-                    dirInfoManager.buffer[new] = old_info
+                # 移动整个目录树，已经读取过的子项不需要重新从云端读取
+                dirInfoManager.move_tree(self.name, old, new)
+                dirInfoManager.move_tree(self.name, old + '.lnk', new + '.lnk')
         except Exception as e:
             logger.info(e)
 
+    def _cloud_path(self, path):
+        '''
+        获取网盘中的路径，显示为快捷方式的文件对应去掉 .lnk 后的原文件
+        '''
+        if path.endswith('.lnk'):
+            node = dirInfoManager.inodes.lookup(self.name, path[:-4])
+            if node is not None and node.attr is not None and not node.shown:
+                return path[:-4]
+        return path
+
+    def _manage(self, action, *args) -> bool:
+        '''
+        调用驱动的文件管理接口（move、rename、delete），返回 False 或者抛出异常时视为失败
+        '''
+        try:
+            ok = getattr(drivers_obj[self.name], action)(*args)
+        except Exception as e:
+            logger.exception(e)
+            return False
+        if not ok:
+            logger.info(f'{action} {args} failed')
+        return bool(ok)
+
     def unlink(self, path):
         '''
-        删除文件
+        删除文件，云端删除成功后才更新缓存
         '''
         # print("unlink .....................")
-        driver_path, driver = dirInfoManager.get_driver(path)
-        if driver:
-            driver.delete(driver_path)  # 删除文件
-        self.updateCacheKeyOnly(path, None)
+        driver_path = self._cloud_path(path)
+        if not self._manage('delete', driver_path):  # 删除文件
+            raise FuseOSError(errno.EIO)
+        self.updateCacheKeyOnly(driver_path, None)
 
     def rmdir(self, path):
         '''
         will only delete directory
         '''
-        driver_path, driver = dirInfoManager.get_driver(path)
-        if driver:
-            driver.delete(driver_path)  # 删除文件夹
+        if not self._manage('delete', path):  # 删除文件夹
+            raise FuseOSError(errno.EIO)
         self.updateCacheKeyOnly(path, None)
 
     def access(self, path, amode):
@@ -237,60 +257,88 @@ class CloudFS(Operations):
         will effect dir and file
         '''
         logger.info(f'rename {old}, {new}')
-        driver_path, driver = dirInfoManager.get_driver(old)
-
-        if driver:
-            driver.rename(driver_path, new)  # Todo
-
-        self.updateCacheKeyOnly(old, new)
+        old_path = self._cloud_path(old)
+        new_path = new[:-4] if old_path != old and new.endswith('.lnk') else new
+
+        # 移动和重命名是两次请求，每次都检查结果，全部成功后才更新缓存
+        driver_path = old_path
+        if os.path.dirname(old_path) != os.path.dirname(new_path):
+            if not self._manage('move', old_path, os.path.dirname(new_path)):  # 移动到新目录，名称不变
+                raise FuseOSError(errno.EIO)
+            driver_path = f"{os.path.dirname(new_path).rstrip('/')}/{os.path.basename(old_path)}"
+        if os.path.basename(old_path) != os.path.basename(new_path):
+            if not self._manage('rename', driver_path, os.path.basename(new_path)):
+                # 重命名失败时撤销已经完成的移动，撤销也失败时缓存按云端的实际位置更新
+                if driver_path != old_path and not self._manage('move', driver_path, os.path.dirname(old_path)):
+                    self.updateCacheKeyOnly(old_path, driver_path)
+                raise FuseOSError(errno.EIO)
+
+        self.updateCacheKeyOnly(old_path, new_path)
 
     @funcLog
     def mkdir(self, path, mode):
         # TODO: 完善接口的上传等相关功能
         logger.info(f'making dir {path}')
 
-        driver_path, driver = dirInfoManager.get_driver(path)
-        if driver:
-            driver.delete(path)  # 删除文件夹
+        driver = drivers_obj[self.name]
+        if not hasattr(driver, 'mkdir'):
+            raise FuseOSError(errno.ENOSYS)
 
-        r = json.loads(driver.mkdir(driver_path))  # Todo
+        r = json.loads(driver.mkdir(path))  # Todo
 
         if 'error_code' in r:
             logger.info(f'{r}')
             # logger.info(f'{error_map[str(r["error_code"])]} args: {path}, response:{r}')
             return
 
-        directory = path[:path.rfind("/")]
-        filename = path[path.rfind("/") + 1:]
-
-        cache = None
-        if directory in dirInfoManager.dir_buffer:
-            cache = dirInfoManager.dir_buffer[directory]
-            cache.append(filename)
-        dirInfoManager.dir_buffer[directory] = cache
+        negativeCache.discard(self.name, path)  # 新建的文件夹不再视为不存在
+        dirInfoManager.add_file_attr(self.name, path, r, shown=True)
 
-        dirInfoManager.add_file_attr(path, r)
+    @staticmethod
+    def _fh(fh):
+        """
+        获取文件句柄
 
-    def open(self, path, flags):
+        挂载时使用了 raw_fi，传入的是 fuse_file_info 结构体
+        """
+        return getattr(fh, 'fh', fh)
+
+    def open(self, path, fi):
+        # raw_fi 模式下由这里分配文件句柄，用于区分同一文件的不同打开者
+        if hasattr(fi, 'fh'):
+            fi.fh = next(self.fh_counter)
+        uid = dirInfoManager.cache_id(self.name, path)
+        if uid is not None:
+            tempFs.record(self.name, uid)  # 记录打开次数，缓存已满时只缓存经常打开的文件
         return 0
 
     def read(self, path, size, offset, fh):
-        if tempFs.has(self.name, path):
-            file_path = tempFs.get(self.name, path)
-        elif tempFs.has(self.name, path + ".lnk"):
-            file_path = tempFs.get(self.name, path + ".lnk")
-        else:
-            raise FuseOSError(errno.ENOENT)
-        with open(file_path, 'rb') as f:
-            f.seek(offset)
-            return f.read(size)
+        # 本地生成的快捷方式直接读取缓存文件
+        if path.endswith('.lnk'):
+            dirInfoManager.ensure_shortcut(self.name, path)  # 还没有生成的快捷方式先生成
+            uid = dirInfoManager.cache_id(self.name, path)
+            file_path = tempFs.peek(self.name, uid) if uid is not None else None
+            if file_path is not None:
+                with open(file_path, 'rb') as f:
+                    f.seek(offset)
+                    return f.read(size)
+
+        # 云端文件按块读取，未缓存的部分只下载请求范围所在的块
+        attr = self.getattr(path)
+        try:
+            readAhead.on_read(self._fh(fh), self.name, path, attr['st_size'], offset, size)  # 顺序读取时提交预读
+            return blockReader.read(self.name, path, attr['st_size'], size, offset)
+        except Exception as e:
+            logger.exception(e)
+            raise FuseOSError(errno.EIO)
 
     def release(self, path, fh):
+        readAhead.release(self._fh(fh))
         return 0
 
     @funcLog
     def create(self, path, mode, fh=None):
-        pass
+        negativeCache.discard(self.name, path)  # 新建的文件不再视为不存在
         # Todo
         # logger.debug(f'create {path}')
         # with self.createLock:
@@ -1,5 +1,8 @@
 import math
 import os
+import threading
+import time
+from concurrent.futures import CancelledError, TimeoutError
 import winreg
 
 import pythoncom
@@ -8,26 +11,41 @@ import win32com.client
 from internal.log import get_logger
 from internal.driver import drivers_obj
 from internal.temp_fs import tempFs
-from internal.system_res import dir_info_pool, dir_info_buffer, dir_info_dir_buffer, \
-    dir_info_traversed_folder, stop_event
+from internal.block_reader import blockReader
+from config import config
+from internal.inode import inodeTable, STALE
+from internal.scheduler import FOREGROUND, SPECULATIVE
+from internal.system_res import dir_info_pool, dir_info_buffer, stop_event
 
 logger = get_logger(__name__)
 
 CACHE_TIMEOUT = 60
+INFO_FIELDS = {'isdir', 'size', 'mtime', 'ctime', 'atime', 'local_mtime', 'local_ctime'}  # 生成文件属性用到的 info 字段
 
 
 class DirInfoManager:
     """ 映射资源路径 """
     current_path = os.path.abspath(os.path.dirname(__file__))
 
-    def __init__(self):
-        self.pool = dir_info_pool  # 线程池，用于异步遍历目录
-
-        self.buffer = dir_info_buffer  # 缓存文件属性
-        self.dir_buffer = dir_info_dir_buffer  # 缓存目录结构
-        self.traversed_folder = dir_info_traversed_folder  # 缓存已经遍历的目录
+    def __init__(self, inodes=inodeTable, buffer=dir_info_buffer):
+        """
+        :param inodes: 内存中的 inode 表
+        :param buffer: inode 表的持久化
+        """
+        self.pool = dir_info_pool  # 按优先级执行的线程池，用于异步遍历目录
+        self.inflight = {}  # (驱动名称, 路径) -> Future，排队中或正在读取的目录，同一个目录同时只读取一次
+        self.inflight_lock = threading.RLock()
+        self.progress = threading.Condition()  # 目录读取到新的一页或读取结束时通知等待中的 readdir
+        self.wait_timeout = config.temp.dir.get('READDIR_TIMEOUT', 5)  # readdir 等待没有缓存的目录的最长时间(秒)
+
+        self.inodes = inodes  # 内存中的目录树和文件属性，getattr、readdir 直接从这里读取
+        self.buffer = buffer  # 目录树的持久化，重启后从这里恢复
+        self.inodes.load(self.buffer)
+        self.timeout = config.temp.dir.get('CACHE_TIMEOUT', CACHE_TIMEOUT)  # 目录读取后保持 FRESH 的时间(秒)
+        self.synced = set()  # 由同步引擎应用变化的驱动，目录读取后一直保持 FRESH
 
         self.file_icon = {}  # 文件图标缓存
+        self.shortcut_lock = threading.Lock()  # 生成快捷方式时使用，同一个文件只生成一次
 
     @staticmethod
     def expand_icon_path(icon_path):
@@ -154,12 +172,42 @@ class DirInfoManager:
 
         return f"{s} {size_name[i]}"
 
-    def add_file_attr(self, path: str, info):
+    @staticmethod
+    def _file_attr(info) -> dict:
+        """
+        根据驱动返回的信息生成文件属性
+        """
+        return {
+            'st_ino': 0,
+            'st_dev': 0,
+            'st_mode': 16877 if info['isdir'] else 36279,
+            'st_nlink': 2 if info['isdir'] else 1,
+            'st_uid': 0,
+            'st_gid': 0,
+            'st_size': int(info['size']) if 'size' in info else 0,
+            'st_atime': 0,
+            'st_mtime': info['local_mtime'] if 'local_mtime' in info else info['mtime'],
+            'st_ctime': info['local_ctime'] if 'local_ctime' in info else info['ctime']
+        }
+
+    @staticmethod
+    def _extra(info):
+        """
+        取出驱动在 info 中附加的字段，例如百度网盘的 fs_id、md5、category
+
+        :return: 字典，没有附加字段时返回 None
+        """
+        extra = {k: v for k, v in info.items() if k not in INFO_FIELDS}
+        return extra or None
+
+    def add_file_attr(self, name, path: str, info, shown=None):
         """
         创建属性
 
+        :param name: 对应驱动的名称
         :param path: 路径
         :param info: 信息列表
+        :param shown: 是否出现在父目录的 readdir 结果中，None 表示不修改
 
         需要的info信息有
             info={
@@ -171,22 +219,256 @@ class DirInfoManager:
             }
         :return:
         """
-        fileAttr = {
-            'st_ino': 0,
-            'st_dev': 0,
-            'st_mode': 16877 if info['isdir'] else 36279,
-            'st_nlink': 2 if info['isdir'] else 1,
-            'st_uid': 0,
-            'st_gid': 0,
-            'st_size': int(info['size']) if 'size' in info else 0,
-            'st_atime': 0,
-            'st_mtime': info['local_mtime'] if 'local_mtime' in info else info['mtime'],
-            'st_ctime': info['local_ctime'] if 'local_ctime' in info else info['ctime']
-        }
+        fileAttr = self._file_attr(info)
+
+        self.inodes.set_attr(name, path, fileAttr, shown, self._extra(info))
 
-        self.buffer[path] = fileAttr
+    def get_attr(self, name, path: str):
+        """
+        获取文件属性
 
-    def readDir(self, name, path: str, depth: int):
+        :param name: 对应驱动的名称
+        :param path: 路径
+        :return: 属性字典或 None
+        """
+        return self.inodes.get_attr(name, path)
+
+    def list_dir(self, name, path: str, with_attr=False):
+        """
+        获取目录的子项名称
+
+        :param name: 对应驱动的名称
+        :param path: 路径
+        :param with_attr: 是否同时返回子项的属性
+        :return: 名称列表，with_attr 时为 (名称, 属性) 列表，目录还没有读取过时返回 None
+        """
+        return self.inodes.entries(name, path, with_attr)
+
+    def cache_id(self, name, path: str, create=False):
+        """
+        获取文件在 tempFs 中的标识，由 inode 编号生成，移动、重命名后不变
+
+        :param name: 对应驱动的名称
+        :param path: 路径
+        :param create: 路径不在目录树中时是否创建节点
+        :return: 标识，路径不在目录树中并且不创建时返回 None
+        """
+        node = self.inodes.ensure(name, path) if create else self.inodes.lookup(name, path)
+        return None if node is None else self.inodes.file_id(node)
+
+    def move_tree(self, name, old: str, new: str):
+        """
+        移动目录树（移动、重命名之后调用）
+
+        内存中的目录树只移动一个节点，目录的新鲜度随节点一起移动，移动后不需要重新从云端读取；
+        缓存文件按 inode 编号记录，inode 编号随节点一起移动，已经缓存的文件不需要改写
+
+        :param name: 对应驱动的名称
+        :param old: 原路径
+        :param new: 新路径
+        :return:
+        """
+        self.inodes.move(name, old, new)
+
+    def remove_tree(self, name, path: str):
+        """
+        移除目录树（删除之后调用），同时移除已经缓存的文件
+
+        :param name: 对应驱动的名称
+        :param path: 路径
+        :return:
+        """
+        with self.inodes.lock:
+            node = self.inodes.lookup(name, path)
+            if node is None:
+                return
+            uids = [self.inodes.file_id(sub_node) for _, sub_node in self.inodes.walk(node, path)]
+            self.inodes.remove(name, path)
+
+        for uid in uids:
+            blockReader.forget(name, uid)
+            if tempFs.has(name, uid):
+                tempFs.remove(name, uid)
+
+    def _timeout(self, name):
+        """
+        目录读取后保持 FRESH 的时间，有同步引擎的驱动不需要按时间重新读取
+        """
+        return math.inf if name in self.synced else self.timeout
+
+    def apply_change(self, name, change):
+        """
+        应用同步引擎获取到的一项变化
+
+        只更新已经在目录树中的目录，还没有读取过的目录之后读取时自然是最新的
+
+        :param name: 对应驱动的名称
+        :param change: 驱动 changes 方法返回的一项，deleted 为 True 表示被删除
+        :return:
+        """
+        if change.deleted:
+            self.remove_tree(name, change.path)
+            self.remove_tree(name, change.path + '.lnk')
+            return
+
+        parent = self.inodes.lookup(name, os.path.dirname(change.path))
+        if parent is None or not parent.listed:
+            return
+        self._sync_item(name, change)
+
+    def mark_stale(self, name):
+        """
+        把驱动的所有目录标记为 STALE，同步的 cursor 失效时调用，之后访问时重新读取
+        """
+        root = self.inodes.roots.get(name)
+        if root is None:
+            return
+        with self.inodes.lock:
+            for _, node in self.inodes.walk(root, '/'):
+                if node.listed:
+                    self.inodes.end_revalidate(node, False)
+
+    def _sync_item(self, name, item, shortcut=True):
+        """
+        与已有的子项比较后加入缓存
+
+        属性和显示方式（文件本身或快捷方式）都没有变化的子项直接跳过，
+        不会重新生成快捷方式，也不会重新写入磁盘缓存
+
+        :param name: 对应驱动的名称
+        :param item: 驱动返回的文件、文件夹信息
+        :param shortcut: 是否立即生成快捷方式，False 时只记录属性，目录显示时再生成
+        :return: 在目录中显示的名称，隐藏文件不加入，返回 None
+        """
+        if item['name'].startswith("."):  # 隐藏文件不显示
+            return None
+
+        node = self.inodes.lookup(name, item['path'])
+        if node is not None and node.attr is not None:
+            attr = self._file_attr(item.info)
+            self.inodes.set_extra(node, self._extra(item.info))
+            uid = self.inodes.file_id(node)
+            cached = not item.info.isdir and tempFs.has(name, uid)
+            if all(node.attr[k] == attr[k] for k in ('st_mode', 'st_size', 'st_mtime', 'st_ctime')):
+                if item.info.isdir or cached:
+                    if node.shown:
+                        return item['name']
+                elif not node.shown:
+                    # 快捷方式可能已经被淘汰，需要生成快捷方式时还要检查它是否仍然存在
+                    lnk = self.inodes.lookup(name, item['path'] + '.lnk')
+                    if lnk is not None and lnk.shown and (
+                            not shortcut or tempFs.has(name, self.inodes.file_id(lnk))):
+                        return f"{item['name']}.lnk"
+            elif cached:
+                # 云端的文件已经修改，丢弃旧的缓存内容
+                blockReader.forget(name, uid)
+                tempFs.remove(name, uid)
+
+        return self._add_item(name, item, shortcut)
+
+    def _add_item(self, name, item, shortcut=True):
+        """
+        将目录列表中的一项加入缓存
+
+        :param name: 对应驱动的名称
+        :param item: 驱动返回的文件、文件夹信息
+        :param shortcut: 是否立即生成快捷方式，False 时只记录属性，目录显示时再生成
+        :return: 在目录中显示的名称，隐藏文件不加入，返回 None
+        """
+        if item['name'].startswith("."):  # 隐藏文件不显示
+            return None
+
+        shown = item['name']
+        uid = self.cache_id(name, item['path'])
+        if not item.info.isdir and (uid is None or not tempFs.has(name, uid)):
+            # 缓存文件里没有这个文件，显示为快捷方式
+            shown = f"{item['name']}.lnk"
+            # 快捷方式单独记录属性，原文件保留真实大小，按块读取时需要用到；还没有生成的快捷方式大小为 0
+            lnk_size = self._make_shortcut(name, item['path'], item.info.size) if shortcut else 0
+            lnk_info = dict(item.info, size=lnk_size)
+            self.inodes.set_attr(name, f"{item['path']}.lnk", self._file_attr(lnk_info), shown=True)
+
+        # 将文件属性加入缓存，显示为快捷方式的文件本身不出现在目录中
+        self.add_file_attr(name, item['path'], item.info, shown=shown == item['name'])
+        return shown
+
+    def ensure_shortcut(self, name, path: str):
+        """
+        确保显示为快捷方式的文件已经生成快捷方式
+
+        批量导入目录树时只记录属性，目录显示或者读取快捷方式时才生成；
+        被淘汰的快捷方式也在这里重新生成
+
+        :param name: 对应驱动的名称
+        :param path: 快捷方式的路径，以 .lnk 结尾
+        :return: 新生成的快捷方式的属性，不需要生成时返回 None
+        """
+        node = self.inodes.lookup(name, path[:-4])
+        if node is None or node.attr is None or node.shown:
+            return None
+        if tempFs.has(name, self.cache_id(name, path, True)):
+            return None
+        attr = node.attr
+        lnk_size = self._make_shortcut(name, path[:-4], attr['st_size'])
+        lnk_info = {'isdir': False, 'size': lnk_size, 'mtime': attr['st_mtime'], 'ctime': attr['st_ctime']}
+        return self.inodes.set_attr(name, path, self._file_attr(lnk_info), shown=True).attr
+
+    def _make_shortcut(self, name, path: str, size: int) -> int:
+        """
+        为没有缓存的文件生成快捷方式，保存为缓存中的 path.lnk
+
+        :param name: 对应驱动的名称
+        :param path: 原文件路径
+        :param size: 原文件大小，显示在快捷方式的提示信息中
+        :return: 快捷方式文件的大小
+        """
+        uid = self.cache_id(name, path + '.lnk', True)
+        with self.shortcut_lock:
+            temp_path = tempFs.peek(name, uid)
+            if temp_path is None:
+                temp_path = tempFs.allocate(name, uid, 0, suffix=".lnk")
+            # 获取文件后缀
+            suffix = os.path.splitext(path)[1]
+            # 获取文件类型描述
+            description = self.get_file_type_description(suffix)
+            # 获取文件图标
+            if suffix in self.file_icon:
+                icon_path, icon_index = self.file_icon[suffix]
+            else:
+                default_icon = self.get_default_icon(suffix)
+                if default_icon:
+                    icon_path, icon_index = default_icon
+                else:
+                    icon_path, icon_index = "", 0
+                self.file_icon[suffix] = (icon_path, icon_index)
+            self.create_shortcut(
+                target_path="",
+                shortcut_path=temp_path,
+                description=f"类型:{description}\n大小:{self.format_size(size)}\n提示:双击可自动下载并打开",
+                working_dir=os.path.dirname(path),
+                arguments="",
+                icon_location=icon_path,
+                icon_index=icon_index
+            )
+
+            lnk_size = os.path.getsize(temp_path)
+            tempFs.update(name, uid, size=lnk_size)
+            return lnk_size
+
+    @staticmethod
+    def list_pages(driver, path: str):
+        """
+        分页读取目录，驱动不支持分页时整个目录作为一页
+
+        :param driver: 驱动对象
+        :param path: 目录路径
+        :return: 可迭代对象，每次返回一页
+        """
+        if hasattr(driver, 'list_pages'):
+            return driver.list_pages(path)
+        return [driver.list(dir=path)]
+
+    def readDir(self, name, path: str, depth: int, group=None):
         """
         读取目录
 
@@ -196,96 +478,265 @@ class DirInfoManager:
         :param name: 对应驱动的名称
         :param path: 要读取的路径，相对于网盘根目录，以 / 开头
         :param depth: 读取深度
+        :param group: 递归读取时最初打开的目录，子目录的预加载归属于这个目录
         :return:
         """
         if stop_event.is_set():
             return
 
         driver = drivers_obj[name]
-        if f'{name}@@{path}' not in self.traversed_folder:
-            self.traversed_folder.set(f'{name}@@{path}', b'1', expire=CACHE_TIMEOUT)
-            try:
-                item_list = driver.list(dir=path)
-
-                items = ['.', '..']  # 基本子项，当前目录和上级目录
+        node = self.inodes.ensure(name, path)
+        if not self.inodes.begin_revalidate(node, self._timeout(name)):  # 只有 STALE 的目录需要重新读取
+            return
 
-                depth -= 1
-                for item in item_list:  # 遍历返回的文件、文件夹列表
-                    if item['name'].startswith("."):  # 隐藏文件不显示
+        ok = False
+        try:
+            before = self.inodes.children_names(node)  # 读取前已有的子项
+            seen = set()  # 本次读取到的子项，读取完成后移除云端已经不存在的子项
+
+            depth -= 1
+            for page in self.list_pages(driver, path):
+                for item in page:  # 遍历返回的文件、文件夹列表
+                    shown = self._sync_item(name, item)
+                    if shown is None:
                         continue
-
-                    if item.info.isdir:
-                        items.append(item['name'])  # 文件夹直接添加
-                    else:
-                        # # 缓存文件里有这个文件，直接添加文件本身
-                        if tempFs.has(name, item.path):
-                            items.append(item['name'])
-                        else:
-                            # pass
-                            # 缓存文件中有这个文件的快捷方式
-                            if tempFs.has(name, item.path+'.lnk'):
-                                temp_path = tempFs.get(name, item.path + '.lnk')
-                            else:
-                                temp_path = tempFs.allocate(name, item.path+'.lnk', 0, suffix=".lnk")
-                                # 获取文件后缀
-                            suffix = os.path.splitext(item['path'])[1]
-                            # 获取文件类型描述
-                            description = self.get_file_type_description(suffix)
-                            # 获取文件图标
-                            if suffix in self.file_icon:
-                                icon_path, icon_index = self.file_icon[suffix]
-                            else:
-                                default_icon = self.get_default_icon(suffix)
-                                if default_icon:
-                                    icon_path, icon_index = default_icon
-                                else:
-                                    icon_path, icon_index = "", 0
-                                self.file_icon[suffix] = (icon_path, icon_index)
-                            self.create_shortcut(
-                                target_path="",
-                                shortcut_path=temp_path,
-                                description=f"类型:{description}\n大小:{self.format_size(item.info.size)}\n提示:双击可自动下载并打开",
-                                working_dir=os.path.dirname(item['path']),
-                                arguments="",
-                                icon_location=icon_path,
-                                icon_index=icon_index
-                            )
-
-                            tempFs.update(name, item.path+'.lnk', size=os.path.getsize(temp_path))
-                            # 添加文件的快捷方式
-                            items.append(f"{item['name']}.lnk")
-                            # 更新文件的大小属性
-                            item.info.size = os.path.getsize(temp_path)
-
-                    self.add_file_attr(f"{name}@@{item['path']}", item.info)  # 将文件属性加入缓存
+                    seen.add(item['name'])
+                    seen.add(shown)
 
                     # 如果还有剩余允许深度，且遇到目录则继续遍历
                     if depth > 0:
                         if item.info.isdir:
-                            self.readDirAsync(name, item['path'], depth)
+                            self.readDirAsync(name, item['path'], depth, SPECULATIVE, group or path)
+
+                # 子项加入后立即可见，没有读取过的目录读取到第一页就可以显示
+                self.inodes.set_listed(node)
+                self._notify()
+
+            self.inodes.set_listed(node, complete=True)
+            self.inodes.prune(node, seen, before)
+            ok = True
+
+        except Exception as s:
+            logger.exception(s)
+        finally:
+            self.inodes.end_revalidate(node, ok)
+
+    def importTree(self, name, path: str, depth: int):
+        """
+        批量导入目录树
+
+        使用驱动的递归列表接口（listall_pages）一次导入 path 下的整个目录树，
+        每页最多包含 1000 项，请求数不再与目录数量成正比
+        导入期间不占用目录的读取状态，目录只在导入完成后标记为已读取，
+        期间打开的目录照常读取，不会只显示导入到一半的子项；
+        没有缓存的文件只记录属性，快捷方式在目录显示时才生成
+        驱动不支持递归列表时退回到按 depth 逐个目录读取
+
+        :param name: 对应驱动的名称
+        :param path: 要导入的路径，相对于网盘根目录，以 / 开头
+        :param depth: 不支持批量导入时的读取深度
+        :return:
+        """
+        if stop_event.is_set():
+            return
+
+        driver = drivers_obj[name]
+        if not hasattr(driver, 'listall_pages'):
+            self.readDirAsync(name, path, depth)
+            return
+
+        seen = {}  # 目录 -> 本次读取到的子项，导入完成后移除云端已经不存在的子项
+        before = {}  # 目录 -> 读取前已有的子项
+
+        def dir_seen(dir_path):
+            names = seen.get(dir_path)
+            if names is None:
+                names = seen[dir_path] = set()
+                before[dir_path] = self.inodes.children_names(self.inodes.ensure(name, dir_path))
+            return names
+
+        dir_seen(path)
+        try:
+            for page in driver.listall_pages(path):
+                if stop_event.is_set():
+                    return
+                for item in page:
+                    names = dir_seen(os.path.dirname(item['path']))
+                    shown = self._sync_item(name, item, shortcut=False)
+                    if shown is None:
+                        continue
+                    if item.info.isdir:
+                        dir_seen(item['path'])
+                    names.update((item['name'], shown))
+        except NotImplementedError:
+            self.readDirAsync(name, path, depth)  # 驱动不支持递归列表，按目录读取
+            return
+        except Exception as s:
+            logger.exception(s)
+            return
+
+        for dir_path, names in seen.items():
+            node = self.inodes.ensure(name, dir_path)
+            if not self.inodes.begin_revalidate(node, 0):  # 正在单独读取的目录以那次读取的结果为准
+                continue
+            self.inodes.set_listed(node, complete=True)
+            self.inodes.prune(node, names, before[dir_path])
+            self.inodes.end_revalidate(node, True)
+        self._notify()
+        logger.info(f'import {name}@@{path}: {len(seen)} dirs')
+
+    def importTreeAsync(self, name, path: str, depth: int):
+        """
+        异步批量导入目录树，参数同 importTree
+
+        导入不登记为目录的读取，readdir 不会等待整个导入完成
+        """
+        if stop_event.is_set():
+            return
+
+        return self.pool.submit(('importTree', name, path), SPECULATIVE, self.importTree, name, path, depth)
+
+    def _track(self, name, path: str, submit):
+        """
+        提交任务并登记为正在读取，任务结束（包括被取消）后自动移除
+
+        :return: Future
+        """
+        with self.inflight_lock:
+            future = self.inflight.get((name, path))
+            if future is not None:
+                return future
+            future = self.inflight[(name, path)] = submit()
+
+        def done(f):
+            with self.inflight_lock:
+                if self.inflight.get((name, path)) is f:
+                    del self.inflight[(name, path)]
+            self._notify()
+
+        future.add_done_callback(done)
+        return future
+
+    def _notify(self):
+        with self.progress:
+            self.progress.notify_all()
+
+    def streamDir(self, name, path: str, timeout=None, with_attr=False):
+        """
+        获取目录的子项名称，没有缓存的目录边读取边返回
+
+        完整读取过的目录（包括正在后台重新读取的）直接返回缓存内容；
+        没有完整读取过的目录（包括第一次读取只读到了前几页的）等待正在进行的读取，
+        每读取到一页就返回新增的子项，直到读取结束，超过 timeout 后只返回已经读取到的部分
 
-                self.dir_buffer[f"{name}@@{path}"] = items
+        :param name: 对应驱动的名称
+        :param path: 目录路径
+        :param timeout: 最长等待时间(秒)，默认为配置的 READDIR_TIMEOUT
+        :param with_attr: 是否同时返回子项的属性
+        :return: 生成器，每次返回一个子项名称，with_attr 时为 (名称, 属性)
+        """
+        if self.inodes.is_complete(name, path):  # 完整读取过的目录不等待，过期的内容由后台重新读取
+            yield from self.list_dir(name, path, with_attr) or ()
+            return
 
-            except Exception as s:
-                logger.exception(s)
+        deadline = time.monotonic() + (self.wait_timeout if timeout is None else timeout)
+        sent = set()
+        while True:
+            future = self.inflight.get((name, path))
+            finished = future is None or future.done()  # 先判断是否结束，结束后再取一次完整的子项
+
+            for entry in self.list_dir(name, path, with_attr) or ():
+                key = entry[0] if with_attr else entry
+                if key not in sent:
+                    sent.add(key)
+                    yield entry
+
+            remaining = deadline - time.monotonic()
+            if finished or remaining <= 0:
+                return
+            with self.progress:
+                # 通知可能在取子项和等待之间发出，等待时间不超过 0.1 秒以免错过
+                self.progress.wait(min(remaining, 0.1))
+
+    def waitDir(self, name, path: str, timeout=None) -> bool:
+        """
+        等待目录读取完成
+
+        :param name: 对应驱动的名称
+        :param path: 目录路径
+        :param timeout: 超时时间(秒)
+        :return: 是否已经读取完成，超时返回 False；没有正在读取或者读取失败时直接返回 True
+        """
+        future = self.inflight.get((name, path))
+        if future is None:
+            return True
+        try:
+            future.result(timeout)
+        except TimeoutError:
+            return False
+        except CancelledError:
+            pass
+        except Exception as e:  # 读取失败，等待者照常返回已有的内容
+            logger.info(f'read {name}@@{path} failed: {e}')
+        return True
+
+    @staticmethod
+    def _related(a: str, b: str) -> bool:
+        """
+        两个路径是否相同或者互为上下级
+        """
+        a, b = a.rstrip('/') + '/', b.rstrip('/') + '/'
+        return a.startswith(b) or b.startswith(a)
 
-    def readDirAsync(self, name, path: str, depth: int):
+    def readDirAsync(self, name, path: str, depth: int, priority=SPECULATIVE, group=None):
         """
         异步读取目录
 
         会将遍历指定目录，并将结果录入缓存
         注意为了分别不同的存储对象缓存内容的key为 f'{name}@@{path}'
+        同一个目录排队中只保留一个任务；用户打开目录（FOREGROUND）时，
+        取消排队中的、由其他不相关目录发起的预加载
 
         :param name: 对应驱动的名称
         :param path: 要读取的路径，相对于网盘根目录，以 / 开头
         :param depth: 读取深度
-        :return:
+        :param priority: 优先级 FOREGROUND / PARENT / SPECULATIVE
+        :param group: 预加载所属的目录，用户离开该目录后可以取消
+        :return: Future，可以用来等待读取完成；目录已经是 FRESH 时返回 None
         """
 
         if stop_event.is_set():
             return
 
-        self.pool.submit(self.readDir, name, path, depth)
+        if priority == FOREGROUND:
+            self.pool.cancel_speculative(lambda g: g[0] != name or self._related(g[1], path))
+
+        # 排队中或正在读取的目录直接返回同一个 Future，排队中的提升优先级并合并读取深度
+        future = self.inflight.get((name, path))
+        if future is not None:
+            self.pool.promote(('readDir', name, path), priority, (name, path, depth, group), self._merge_read)
+            return future
+
+        # FRESH 的目录不需要再提交
+        node = self.inodes.lookup(name, path)
+        if node is not None and self.inodes.freshness(node, self._timeout(name)) != STALE:
+            return None
+
+        return self._track(name, path,
+                           lambda: self.pool.submit(('readDir', name, path), priority, self.readDir,
+                                                    name, path, depth, group,
+                                                    group=None if group is None else (name, group),
+                                                    merge=self._merge_read))
+
+    @staticmethod
+    def _merge_read(queued, new):
+        """
+        合并同一目录排队中的 readDir 参数 (name, path, depth, group)
+
+        保留更大的读取深度，例如排队中的深度 1 预加载被用户打开（深度 PRELOAD_LEVEL）时不会丢失更深的预读；
+        子目录的预加载归属于深度更大的请求
+        """
+        return new if new[2] >= queued[2] else queued
 
 
 dirInfoManager = DirInfoManager()
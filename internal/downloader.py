@@ -0,0 +1,137 @@
+import threading
+from collections import deque
+
+from config import config
+from internal.log import get_logger
+from internal.block_reader import blockReader
+from internal.single_flight import singleFlight
+from internal.system_res import download_pool, stop_event
+
+logger = get_logger(__name__)
+
+DEFAULT_SEGMENT_SIZE = 8388608  # 默认最小分段大小 8MB
+DEFAULT_SEGMENT_COUNT = 1024  # 默认单个文件最多分段数
+DEFAULT_FILE_CONNECTIONS = 4  # 默认单个文件的并发连接数
+
+
+class DownloadTask:
+    """ 一个文件的分段下载任务 """
+
+    def __init__(self, name, path: str, file_size: int, segments: deque, workers: int):
+        self.name = name  # 对应驱动的名称
+        self.path = path  # 文件路径
+        self.file_size = file_size  # 文件大小
+        self.segments = segments  # 待下载的分段 [(起始位置, 结束位置(不包含)), ...]
+        self.workers = workers  # 仍在工作的连接数
+        self.error = None  # 下载过程中出现的异常
+        self.done = threading.Event()  # 下载完成事件
+        self.lock = threading.Lock()
+
+    def next_segment(self):
+        with self.lock:
+            if self.error is None and self.segments:
+                return self.segments.popleft()
+            return None
+
+    def wait(self, timeout=None) -> bool:
+        """
+        等待下载完成
+
+        :param timeout: 超时时间(秒)，None 表示一直等待
+        :return: 是否已完成
+        """
+        return self.done.wait(timeout)
+
+
+class Downloader:
+    """
+    多连接分段下载
+
+    将大文件切分为若干分段，使用多个连接并发下载，分段直接写入 tempFs 分配的缓存文件
+    下载通过 blockReader 进行，已下载的块不会重复下载，同时下载期间的读取也能立即用上已完成的分段
+    下载任务登记在 singleFlight 中，同一个文件重复发起的下载会加入已有的任务
+    """
+
+    def __init__(self, reader=blockReader, pool=download_pool):
+        """
+        :param reader: 按块读取，分段通过它下载
+        :param pool: 下载线程池，线程数即为全局最大连接数
+        """
+        self.reader = reader
+        self.segment_size = config.temp.file.get('SEGMENT_SIZE', DEFAULT_SEGMENT_SIZE)  # 最小分段大小
+        self.segment_count = config.temp.file.get('SEGMENT_COUNT', DEFAULT_SEGMENT_COUNT)  # 单个文件最多分段数
+        self.file_connections = config.temp.file.get('FILE_CONNECTIONS', DEFAULT_FILE_CONNECTIONS)  # 单文件连接数
+
+        self.pool = pool
+
+    def _split(self, file_size: int, offset: int) -> deque:
+        """
+        切分文件，从 offset 所在的分段开始排列，之前的分段放到最后
+
+        :return: deque[(起始位置, 结束位置(不包含))]
+        """
+        block_size = self.reader.block_size
+        segment_size = max(self.segment_size, -(-file_size // self.segment_count))
+        segment_size = -(-segment_size // block_size) * block_size  # 按块对齐
+
+        segments = [(start, min(start + segment_size, file_size)) for start in range(0, file_size, segment_size)]
+        first = min(offset // segment_size, max(len(segments) - 1, 0))
+        return deque(segments[first:] + segments[:first])
+
+    def download(self, name, path: str, file_size: int, offset: int = 0) -> DownloadTask:
+        """
+        开始分段下载一个文件，同一个文件已经在下载的话返回已有的任务
+
+        :param name: 对应驱动的名称
+        :param path: 文件路径，相对于网盘根目录，以 / 开头
+        :param file_size: 文件大小
+        :param offset: 优先下载的位置，通常是当前读取的位置
+        :return: DownloadTask
+        """
+        flight = singleFlight.acquire(name, self.reader.file_id(name, path))
+        with flight.lock:
+            task = flight.task
+            created = task is None
+            if created:
+                segments = self._split(file_size, offset)
+                task = DownloadTask(name, path, file_size, segments, min(self.file_connections, len(segments)))
+                if task.workers > 0:
+                    flight.task = task
+                else:
+                    task.done.set()
+
+        if not created or task.done.is_set():  # 加入已有的下载，或者没有需要下载的内容
+            singleFlight.release(flight)
+            return task
+
+        logger.info(f'download {path}, {len(task.segments)} segments, {task.workers} connections')
+        for _ in range(task.workers):
+            self.pool.submit(self._worker, flight, task)
+        return task
+
+    def _worker(self, flight, task: DownloadTask):
+        """
+        下载一个分段后重新提交自己，让出线程，使多个文件之间轮流使用全局的连接
+        """
+        segment = None if stop_event.is_set() else task.next_segment()
+        if segment is None:
+            with task.lock:
+                task.workers -= 1
+                finished = task.workers == 0
+            if finished:
+                with flight.lock:
+                    flight.task = None
+                singleFlight.release(flight)
+                task.done.set()
+            return
+
+        try:
+            self.reader.fetch(task.name, task.path, task.file_size, *segment)
+        except Exception as e:
+            logger.exception(e)
+            with task.lock:
+                task.error = e
+        self.pool.submit(self._worker, flight, task)
+
+
+downloader = Downloader()
@@ -0,0 +1,401 @@
+import itertools
+import sys
+import threading
+import time
+import uuid
+
+from internal.log import get_logger
+from internal.system_res import dir_info_buffer_writer
+
+logger = get_logger(__name__)
+
+# 目录的新鲜度
+STALE = 0  # 需要重新读取，读取期间仍然返回已有的子项
+FRESH = 1  # 最近读取过
+REVALIDATING = 2  # 正在后台重新读取
+
+
+class Node:
+    """ 一个文件或文件夹 """
+    __slots__ = ('ino', 'name', 'parent', 'attr', 'extra', 'children', 'shown', 'listed', 'complete', 'generation',
+                 'state', 'checked')
+
+    def __init__(self, ino: int, name: str, parent):
+        self.ino = ino  # inode 编号
+        self.name = name  # 文件名，已驻留(intern)；根节点为驱动名称，移除后为 None
+        self.parent = parent  # 父节点
+        self.attr = None  # 文件属性，同 getattr 的返回值，None 表示尚未获取
+        self.extra = None  # 驱动在 info 中附加的字段，例如百度网盘的 fs_id，下载时交给驱动
+        self.children = None  # 子节点 name -> Node，只有出现过子项时才创建
+        self.shown = False  # 是否出现在父目录的 readdir 结果中
+        self.listed = False  # 文件夹的子项是否已经读取过，读取到第一页就标记，之后的页可能还在读取
+        self.complete = False  # 文件夹是否完整读取过至少一次，只有完整读取过的目录 readdir 不需要等待
+        self.generation = 0  # 子项的版本号，子项增加、移除、显示状态变化时加一，不持久化
+        self.state = STALE  # 目录的新鲜度，不持久化，重启后已有的目录先显示再重新读取
+        self.checked = 0  # 最近一次读取完成的时间(time.monotonic)
+
+    def record(self):
+        """
+        持久化的内容，子节点只记录父节点的编号，移动目录时只需要改写一条记录
+
+        :return: (父节点编号, 名称, 属性, shown, listed, extra, complete)，已移除的节点返回 None
+        """
+        if self.name is None:
+            return None
+        return (self.parent.ino if self.parent else 0, self.name, self.attr, self.shown, self.listed, self.extra,
+                self.complete)
+
+
+class InodeTable:
+    """
+    内存中的 inode 表
+
+    每个驱动一棵树，按驻留后的路径分量逐级查找，getattr 和 readdir 直接从内存返回
+    节点按 inode 编号持久化（父节点编号 -> 子节点），插入、删除、移动都只改写一条记录，
+    inode 编号随记录保存，重启后保持不变
+    """
+
+    def __init__(self, writer=None):
+        """
+        :param writer: 持久化节点的 WriteBehind，key 为 inode 编号，值为 Node
+        """
+        self.writer = writer
+        self.roots = {}  # 驱动名称 -> 根节点
+        self.counter = itertools.count(1)  # inode 编号
+        self.epoch = uuid.uuid4().hex[:8]  # inode 表的随机标识，随表一起持久化，表被清空后重新生成
+        self.lock = threading.RLock()  # 修改树结构时使用，查找不加锁
+
+    @staticmethod
+    def split(path: str):
+        """
+        拆分路径，各分量驻留以减少内存并加快比较
+        """
+        return [sys.intern(part) for part in path.split('/') if part]
+
+    def load(self, cache):
+        """
+        从磁盘缓存恢复整棵树，父节点已经不存在的记录（被删除目录的子项）一并清理
+
+        :param cache: 保存节点记录的 diskcache
+        :return:
+        """
+        with self.lock:
+            epoch = cache.get('epoch')
+            if epoch is None:
+                cache['epoch'] = self.epoch
+            else:
+                self.epoch = epoch
+
+            nodes = {}
+            records = {}
+            for ino in cache:
+                if ino == 'epoch':
+                    continue
+                parent_ino, name, attr, shown, listed, *rest = cache[ino]  # 旧版本的记录没有 extra、complete
+                node = nodes[ino] = Node(ino, sys.intern(name), None)
+                node.attr, node.shown, node.listed = attr, shown, listed
+                node.extra = rest[0] if rest else None
+                node.complete = rest[1] if len(rest) > 1 else listed
+                records[ino] = parent_ino
+
+            for ino, parent_ino in records.items():
+                node = nodes[ino]
+                if parent_ino == 0:
+                    self.roots[node.name] = node
+                    continue
+                parent = nodes.get(parent_ino)
+                if parent is not None:
+                    node.parent = parent
+                    if parent.children is None:
+                        parent.children = {}
+                    parent.children[node.name] = node
+
+            reachable = set()
+            queue = list(self.roots.values())
+            while queue:
+                node = queue.pop()
+                reachable.add(node.ino)
+                if node.children:
+                    queue.extend(node.children.values())
+            stale = [ino for ino in nodes if ino not in reachable]
+
+            if stale:
+                with cache.transact():
+                    for key in stale:
+                        cache.pop(key, None)
+            self.counter = itertools.count(max(nodes, default=0) + 1)
+            logger.info(f'inode table loaded: {len(reachable)} nodes, {len(stale)} stale records dropped')
+
+    def file_id(self, node: Node) -> str:
+        """
+        获取文件在 tempFs 和 singleFlight 中使用的标识
+
+        标识由 inode 编号生成，文件或上级目录移动、重命名后不变，已经缓存的内容不需要随路径改写；
+        带有 inode 表的随机标识，inode 表被清空、重新编号后不会用到之前文件的缓存
+        """
+        return f'{self.epoch}:{node.ino}'
+
+    def _persist(self, node: Node):
+        if self.writer is not None:
+            self.writer.set(node.ino, node)
+
+    def lookup(self, name, path: str):
+        """
+        查找节点
+
+        :param name: 对应驱动的名称
+        :param path: 路径，相对于网盘根目录，以 / 开头
+        :return: Node 或 None
+        """
+        node = self.roots.get(name)
+        for part in self.split(path):
+            if node is None or node.children is None:
+                return None
+            node = node.children.get(part)
+        return node
+
+    def ensure(self, name, path: str) -> Node:
+        """
+        查找节点，不存在的话创建（包括中间的目录）
+
+        :param name: 对应驱动的名称
+        :param path: 路径，相对于网盘根目录，以 / 开头
+        :return: Node
+        """
+        with self.lock:
+            node = self.roots.get(name)
+            if node is None:
+                node = self.roots[name] = Node(next(self.counter), sys.intern(name), None)
+                self._persist(node)
+
+            for part in self.split(path):
+                if node.children is None:
+                    node.children = {}
+                child = node.children.get(part)
+                if child is None:
+                    child = node.children[part] = Node(next(self.counter), part, node)
+                    node.generation += 1
+                    self._persist(child)
+                node = child
+            return node
+
+    @staticmethod
+    def walk(node: Node, path: str):
+        """
+        遍历节点及其所有子节点
+
+        :param node: 起始节点
+        :param path: 起始节点的路径
+        :return: 生成器，每次返回 (路径, Node)
+        """
+        stack = [(path, node)]
+        while stack:
+            path, node = stack.pop()
+            yield path, node
+            if node.children:
+                prefix = path.rstrip('/')
+                stack.extend((f'{prefix}/{child.name}', child) for child in list(node.children.values()))
+
+    def generation(self, name, path: str):
+        """
+        获取目录的版本号
+
+        :return: 版本号，目录不存在时返回 None
+        """
+        node = self.lookup(name, path)
+        return None if node is None else node.generation
+
+    def get_attr(self, name, path: str):
+        """
+        获取文件属性
+
+        :return: 属性字典或 None
+        """
+        node = self.lookup(name, path)
+        return None if node is None else node.attr
+
+    def set_attr(self, name, path: str, attr: dict, shown=None, extra=None) -> Node:
+        """
+        设置文件属性，属性中的 st_ino 会被替换为节点的 inode 编号
+
+        :param shown: 是否出现在父目录的 readdir 结果中，None 表示不修改
+        :param extra: 驱动附加的字段，None 表示不修改
+        :return: Node
+        """
+        with self.lock:
+            node = self.ensure(name, path)
+            attr['st_ino'] = node.ino
+            node.attr = attr
+            if extra is not None:
+                node.extra = extra
+            if shown is not None and node.shown != shown:
+                node.shown = shown
+                if node.parent is not None:
+                    node.parent.generation += 1
+            self._persist(node)
+            return node
+
+    def set_extra(self, node: Node, extra):
+        """
+        更新驱动附加的字段，没有变化时不写入磁盘
+        """
+        if extra is not None and node.extra != extra:
+            node.extra = extra
+            self._persist(node)
+
+    def get_extra(self, name, path: str):
+        """
+        获取驱动附加的字段，随节点移动，移除节点时一起移除
+
+        :return: 字典，没有记录时返回 None
+        """
+        node = self.lookup(name, path)
+        return None if node is None else node.extra
+
+    def set_listed(self, node: Node, complete=False):
+        """
+        标记文件夹的子项已经读取过
+
+        :param complete: 是否已经读取完所有分页，读取到一部分时为 False
+        """
+        if not node.listed or (complete and not node.complete):
+            node.listed = True
+            node.complete = node.complete or complete
+            self._persist(node)
+
+    def is_complete(self, name, path: str) -> bool:
+        """
+        文件夹是否完整读取过至少一次
+        """
+        node = self.lookup(name, path)
+        return node is not None and node.complete
+
+    def entries(self, name, path: str, with_attr=False):
+        """
+        获取目录的子项名称
+
+        :param with_attr: 是否同时返回子项的属性
+        :return: 名称列表，with_attr 时为 (名称, 属性) 列表，目录还没有读取过时返回 None
+        """
+        node = self.lookup(name, path)
+        if node is None or not node.listed:
+            return None
+        children = node.children
+        if not children:
+            return []
+        if with_attr:
+            return [(child.name, child.attr) for child in list(children.values()) if child.shown]
+        return [child.name for child in list(children.values()) if child.shown]
+
+    def prune(self, node: Node, keep, candidates=None):
+        """
+        移除目录下不在 keep 中的子项（云端已经不存在的文件）
+
+        :param node: 目录节点
+        :param keep: 需要保留的子项名称集合
+        :param candidates: 只移除这些名称，通常是开始读取前已有的子项，读取期间本地新增的子项不会被移除
+        :return:
+        """
+        with self.lock:
+            if not node.children:
+                return
+            for child in [child for child in node.children.values()
+                          if child.name not in keep and (candidates is None or child.name in candidates)]:
+                self._detach(child)
+                child.name = None
+                if self.writer is not None:
+                    self.writer.delete(child.ino)
+
+    def freshness(self, node: Node, timeout) -> int:
+        """
+        获取目录的新鲜度，读取完成超过 timeout 秒的目录变为 STALE
+
+        :param node: 目录节点
+        :param timeout: 有效时间(秒)
+        :return: STALE / FRESH / REVALIDATING
+        """
+        if node.state == FRESH and time.monotonic() - node.checked > timeout:
+            node.state = STALE
+        return node.state
+
+    def begin_revalidate(self, node: Node, timeout) -> bool:
+        """
+        开始重新读取目录，只有 STALE 的目录可以开始
+
+        :return: 是否开始，已经是 FRESH 或者正在读取时返回 False
+        """
+        with self.lock:
+            if self.freshness(node, timeout) != STALE:
+                return False
+            node.state = REVALIDATING
+            return True
+
+    def end_revalidate(self, node: Node, ok: bool):
+        """
+        重新读取目录结束
+
+        :param ok: 是否成功，失败的目录保持 STALE，下次访问时重试
+        """
+        with self.lock:
+            node.state = FRESH if ok else STALE
+            if ok:
+                node.checked = time.monotonic()
+
+    def children_names(self, node: Node):
+        """
+        获取目录当前所有子项的名称（包括不显示的子项）
+        """
+        with self.lock:
+            return set(node.children) if node.children else set()
+
+    def _detach(self, node: Node):
+        node.parent.children.pop(node.name, None)
+        node.parent.generation += 1
+        node.parent = None
+
+    def remove(self, name, path: str):
+        """
+        移除节点及其所有子节点
+
+        只删除该节点自己的记录，子节点的记录在下次加载时作为孤立记录清理
+
+        :return: 被移除的节点或 None
+        """
+        with self.lock:
+            node = self.lookup(name, path)
+            if node is None or node.parent is None:
+                return None
+            self._detach(node)
+            node.name = None
+            if self.writer is not None:
+                self.writer.delete(node.ino)
+            return node
+
+    def move(self, name, old: str, new: str):
+        """
+        移动节点，子树随节点一起移动，inode 编号不变
+
+        目标位置已经存在的节点会被替换
+
+        :return: 被移动的节点或 None
+        """
+        with self.lock:
+            node = self.lookup(name, old)
+            if node is None or node.parent is None or old == new:
+                return node
+            new_parent_path, new_name = new.rsplit('/', 1)
+            self.remove(name, new)
+            self._detach(node)
+
+            parent = self.ensure(name, new_parent_path or '/')
+            if parent.children is None:
+                parent.children = {}
+            node.name = sys.intern(new_name)
+            node.parent = parent
+            parent.children[node.name] = node
+            parent.generation += 1
+            self._persist(node)
+            return node
+
+
+inodeTable = InodeTable(dir_info_buffer_writer)
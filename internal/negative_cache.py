@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+from config import config
+
+NEGATIVE_MAX = 10000  # 最多记录的不存在路径数量
+
+
+class NegativeCache:
+    """
+    不存在路径的缓存
+
+    资源管理器、IDE 会反复探测 desktop.ini、thumbs.db 这类不存在的路径，
+    记录下来后重复的查询只需要一次哈希查找，不会再触发后台读取目录
+    每条记录保存了当时父目录的版本号，父目录的子项发生变化（新建、移入）后自动失效
+    """
+
+    def __init__(self):
+        self.timeout = config.temp.dir.get('NEGATIVE_TIMEOUT', 30)  # 记录的有效时间(秒)
+        self.entries = OrderedDict()  # (驱动名称, 路径) -> (父目录版本号, 过期时间)
+        self.lock = threading.Lock()
+
+    def has(self, name, path: str, generation) -> bool:
+        """
+        判断路径是否已知不存在
+
+        :param name: 对应驱动的名称
+        :param path: 路径
+        :param generation: 父目录当前的版本号
+        :return:
+        """
+        entry = self.entries.get((name, path))
+        if entry is None:
+            return False
+        if entry[0] != generation or entry[1] < time.monotonic():
+            with self.lock:
+                self.entries.pop((name, path), None)
+            return False
+        return True
+
+    def add(self, name, path: str, generation):
+        """
+        记录不存在的路径
+
+        :param name: 对应驱动的名称
+        :param path: 路径
+        :param generation: 父目录当前的版本号
+        :return:
+        """
+        with self.lock:
+            self.entries[(name, path)] = (generation, time.monotonic() + self.timeout)
+            self.entries.move_to_end((name, path))
+            while len(self.entries) > NEGATIVE_MAX:
+                self.entries.popitem(last=False)
+
+    def discard(self, name, path: str):
+        """
+        移除记录
+        """
+        with self.lock:
+            self.entries.pop((name, path), None)
+
+
+negativeCache = NegativeCache()
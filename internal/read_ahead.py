@@ -0,0 +1,131 @@
+import threading
+
+from config import config
+from internal.log import get_logger
+from internal.block_reader import blockReader
+from internal.downloader import downloader
+from internal.system_res import read_ahead_pool, stop_event
+
+logger = get_logger(__name__)
+
+DEFAULT_MAX_WINDOW = 8388608  # 默认最大预读窗口 8MB
+DEFAULT_MAX_INFLIGHT = 4  # 默认每个文件同时进行的预读请求数
+
+
+class ReadAheadState:
+    """ 单个打开文件的预读状态 """
+    __slots__ = ('prev_end', 'window', 'ahead_end', 'inflight', 'bypass')
+
+    def __init__(self):
+        self.prev_end = 0  # 上一次读取的结束位置
+        self.window = 0  # 当前预读窗口大小，0 表示没有检测到顺序读取
+        self.ahead_end = 0  # 已提交预读的结束位置
+        self.inflight = 0  # 正在进行的预读请求数
+        self.bypass = False  # 文件没有缓存，预读到内存中，不整文件分段下载
+
+
+class ReadAhead:
+    """
+    顺序读取检测和自适应预读
+
+    参考 Linux 页缓存的预读策略：
+        连续的读取会让预读窗口成倍增长，直到最大值
+        随机读取会让预读窗口归零
+    预读的范围会被拆分成多段并发下载，使同一个文件始终有若干个请求在进行
+    窗口达到最大值后仍在顺序读取的大文件会交给 downloader 多连接分段下载
+    没有通过准入、不缓存的文件同样预读，下载到 reader 内存中的段
+    """
+
+    def __init__(self, reader=blockReader, downloader=downloader, pool=read_ahead_pool):
+        """
+        :param reader: 按块读取，预读的范围通过它下载
+        :param downloader: 整文件分段下载
+        :param pool: 执行预读的线程池
+        """
+        self.reader = reader
+        self.downloader = downloader
+        self.block_size = reader.block_size
+        self.max_window = config.temp.file.get('READ_AHEAD_MAX', DEFAULT_MAX_WINDOW)  # 最大预读窗口
+        self.max_inflight = config.temp.file.get('READ_AHEAD_INFLIGHT', DEFAULT_MAX_INFLIGHT)  # 最大并发预读数
+
+        self.pool = pool
+        self.states = {}  # 文件句柄 -> 预读状态
+        self.lock = threading.Lock()
+
+    def _align(self, size: int) -> int:
+        """ 向上对齐到块大小 """
+        return (size + self.block_size - 1) // self.block_size * self.block_size
+
+    def release(self, fh):
+        """
+        文件关闭时清理预读状态
+
+        :param fh: 文件句柄
+        """
+        with self.lock:
+            self.states.pop(fh, None)
+
+    def on_read(self, fh, name, path: str, file_size: int, offset: int, size: int):
+        """
+        记录一次读取，检测到顺序读取时提交预读
+
+        :param fh: 文件句柄
+        :param name: 对应驱动的名称
+        :param path: 文件路径，相对于网盘根目录，以 / 开头
+        :param file_size: 文件大小
+        :param offset: 读取位置
+        :param size: 读取长度
+        """
+        end = min(offset + size, file_size)
+        ranges = []
+        full_download = False
+
+        with self.lock:
+            state = self.states.get(fh)
+            if state is None:
+                state = ReadAheadState()
+                self.states[fh] = state
+
+            if offset != state.prev_end:  # 随机读取，关闭预读
+                state.window = 0
+                state.ahead_end = 0
+            else:
+                ahead_start = max(state.ahead_end, end)
+                # 已预读的部分消耗过半后才提交新的预读，并扩大窗口
+                if state.ahead_end - end < state.window // 2:
+                    if state.window == 0:
+                        state.window = min(self._align(max(size * 4, self.block_size * 2)), self.max_window)
+                    else:
+                        state.window = min(state.window * 2, self.max_window)
+
+                    ahead_end = min(end + state.window, file_size)
+                    piece = self._align(max(state.window // self.max_inflight, 1))
+                    while ahead_start < ahead_end and state.inflight < self.max_inflight:
+                        piece_end = min(ahead_start + piece, ahead_end)
+                        ranges.append((ahead_start, piece_end))
+                        state.inflight += 1
+                        ahead_start = piece_end
+                    state.ahead_end = max(state.ahead_end, ahead_start)
+                    # 持续的顺序读取，剩余部分足够大时改为分段下载整个文件
+                    full_download = (state.window >= self.max_window and file_size - end > self.max_window * 2
+                                     and not state.bypass)
+            state.prev_end = end
+
+        if full_download:
+            self.downloader.download(name, path, file_size, end)
+
+        for start, stop in ranges:
+            self.pool.submit(self._prefetch, state, name, path, file_size, start, stop)
+
+    def _prefetch(self, state: ReadAheadState, name, path: str, file_size: int, start: int, end: int):
+        try:
+            if not stop_event.is_set() and not self.reader.prefetch(name, path, file_size, start, end):
+                state.bypass = True
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            with self.lock:
+                state.inflight -= 1
+
+
+readAhead = ReadAhead()
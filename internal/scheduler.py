@@ -0,0 +1,165 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+# 优先级，数值越小越先执行
+FOREGROUND = 0  # 用户正在打开的目录(readdir)
+PARENT = 1  # getattr 时补充读取父目录
+SPECULATIVE = 2  # 预加载，包括按深度递归读取和导入目录树
+
+
+class Task:
+    __slots__ = ('key', 'priority', 'group', 'fn', 'args', 'future')
+
+    def __init__(self, key, priority, group, fn, args):
+        self.key = key  # 去重的 key，同一个 key 排队中只保留一个任务
+        self.priority = priority
+        self.group = group  # 预加载任务所属的目录，用户离开该目录后可以取消
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+
+
+class PriorityScheduler:
+    """
+    按优先级执行的线程池
+
+    与 ThreadPoolExecutor 不同，排队中的任务按优先级而不是提交顺序执行，
+    大量预加载任务排队时用户打开的目录仍然可以立即执行
+    同一个 key 排队中只保留一个任务，再次提交时返回同一个 Future，优先级更高时提升优先级，
+    传入 merge 时新提交的参数与排队中的参数合并，不会丢失新的请求
+    """
+
+    def __init__(self, workers: int):
+        self.queue = []  # 堆 (优先级, 序号, Task)，提升优先级后旧的条目留在堆中，取出时跳过
+        self.pending = {}  # 排队中的任务 key -> Task
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, key, priority: int, fn, *args, group=None, merge=None) -> Future:
+        """
+        提交任务
+
+        :param key: 去重的 key
+        :param priority: 优先级 FOREGROUND / PARENT / SPECULATIVE
+        :param fn: 执行的函数
+        :param args: 函数的参数
+        :param group: 预加载任务所属的目录，配合 cancel_speculative 使用
+        :param merge: 同一个 key 已经在排队时合并参数的函数，传入 (排队中的参数, 新的参数)，返回合并后的参数；
+                      None 时保留排队中的参数
+        :return: Future
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('cannot schedule new tasks after shutdown')
+
+            task = self.pending.get(key)
+            if task is not None:
+                self._merge(task, args, merge)
+                self._promote(task, priority)
+                return task.future
+
+            task = self.pending[key] = Task(key, priority, group if priority == SPECULATIVE else None, fn, args)
+            heapq.heappush(self.queue, (priority, next(self.counter), task))
+            self.condition.notify()
+            return task.future
+
+    def promote(self, key, priority: int, args=(), merge=None) -> bool:
+        """
+        提升排队中任务的优先级，任务已经开始执行或不存在时什么也不做
+
+        :param args: 新请求的参数，与 merge 一起使用
+        :param merge: 合并参数的函数，同 submit
+        :return: 任务是否仍在排队
+        """
+        with self.condition:
+            task = self.pending.get(key)
+            if task is None:
+                return False
+            self._merge(task, args, merge)
+            self._promote(task, priority)
+            return True
+
+    @staticmethod
+    def _merge(task: Task, args, merge):
+        """
+        合并排队中任务的参数，需要在持有 self.condition 的情况下调用
+        """
+        if merge is not None:
+            task.args = tuple(merge(task.args, args))
+
+    def _promote(self, task: Task, priority: int):
+        """
+        提升任务的优先级，需要在持有 self.condition 的情况下调用
+        """
+        if priority < task.priority:  # 不再是预加载，也就不再属于任何预加载分组
+            task.priority = priority
+            task.group = None
+            heapq.heappush(self.queue, (priority, next(self.counter), task))
+            self.condition.notify()
+
+    def cancel_speculative(self, keep):
+        """
+        取消排队中的预加载任务
+
+        :param keep: 判断函数，传入任务的 group，返回 True 的任务保留
+        :return: 取消的任务数量
+        """
+        with self.condition:
+            cancelled = [task for task in self.pending.values()
+                         if task.priority == SPECULATIVE and task.group is not None and not keep(task.group)]
+            for task in cancelled:
+                del self.pending[task.key]
+                task.future.cancel()
+            return len(cancelled)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        停止接收新任务
+
+        :param wait: 是否等待正在执行的任务结束
+        :param cancel_futures: 是否取消排队中的任务，不取消时会执行完排队中的任务
+        """
+        with self.condition:
+            self.closed = True
+            if cancel_futures:
+                for task in self.pending.values():
+                    task.future.cancel()
+                self.pending.clear()
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+    def _take(self):
+        """
+        取出优先级最高的任务，队列为空且已经停止时返回 None
+        """
+        with self.condition:
+            while True:
+                while self.queue:
+                    priority, _, task = heapq.heappop(self.queue)
+                    if self.pending.get(task.key) is task and task.priority == priority:
+                        del self.pending[task.key]
+                        return task
+                if self.closed:
+                    return None
+                self.condition.wait()
+
+    def _run(self):
+        while True:
+            task = self._take()
+            if task is None:
+                return
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            try:
+                task.future.set_result(task.fn(*task.args))
+            except BaseException as e:
+                task.future.set_exception(e)
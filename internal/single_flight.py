@@ -0,0 +1,111 @@
+import threading
+
+from internal.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class Flight:
+    """
+    一个文件上正在进行的下载
+
+    同一个文件的所有读取者共享同一个 Flight：
+        pending 记录正在下载的块，读取到这些块的线程等待对应的事件，而不是重复下载
+        task 记录正在进行的整文件分段下载，重复发起的下载直接加入它
+        bypass 记录不缓存的文件正在下载的段，读取到这些段的线程等待对应的事件
+    """
+    __slots__ = ('key', 'lock', 'pending', 'task', 'bypass', 'refs')
+
+    def __init__(self, key):
+        self.key = key  # (driver_name, uid)
+        self.lock = threading.Lock()  # 保护 pending 和该文件的块位图
+        self.pending = {}  # 正在下载的块 -> 下载完成事件
+        self.task = None  # 正在进行的整文件下载任务
+        self.bypass = {}  # 不缓存的文件正在下载的段序号 -> 下载完成事件
+        self.refs = 0  # 正在使用的线程数
+
+    def claim(self, bitmap, first: int, last: int):
+        """
+        认领 [first, last] 中缺失且没有其他线程在下载的块
+
+        需要在持有 self.lock 的情况下调用
+
+        :param bitmap: 文件的块位图
+        :return: (认领到的块段 [(起始块, 结束块(不包含), 完成事件), ...], 需要等待的事件集合)
+        """
+        claimed = []
+        waiting = set()
+        for run_start, run_end in bitmap.missing(first, last):
+            sub_start = None
+            for index in range(run_start, run_end):
+                event = self.pending.get(index)
+                if event is not None:
+                    waiting.add(event)
+                    if sub_start is not None:
+                        claimed.append((sub_start, index))
+                        sub_start = None
+                elif sub_start is None:
+                    sub_start = index
+            if sub_start is not None:
+                claimed.append((sub_start, run_end))
+
+        runs = []
+        for run_start, run_end in claimed:
+            event = threading.Event()
+            for index in range(run_start, run_end):
+                self.pending[index] = event
+            runs.append((run_start, run_end, event))
+        return runs, waiting
+
+    def release(self, run_start: int, run_end: int, event: threading.Event):
+        """
+        释放认领的块并唤醒等待者，已经被释放过的块不会受影响
+        """
+        with self.lock:
+            for index in range(run_start, run_end):
+                if self.pending.get(index) is event:
+                    del self.pending[index]
+        event.set()
+
+
+class SingleFlight:
+    """
+    按 (driver_name, uid) 登记正在进行的下载，uid 与缓存文件在 tempFs 中的标识相同，
+    文件移动、重命名后仍然加入同一个下载
+
+    并发打开同一个文件的多个程序（资源管理器、杀毒软件、缩略图生成等）会加入同一个下载，
+    不会各自重复下载，避免浪费带宽和触发网盘的频率限制
+    """
+
+    def __init__(self):
+        self.flights = {}  # (driver_name, uid) -> Flight
+        self.lock = threading.Lock()
+
+    def acquire(self, driver_name, uid: str) -> Flight:
+        """
+        加入文件上正在进行的下载，没有的话创建一个，使用完后需要调用 release
+
+        :param driver_name: 存储方案的名称
+        :param uid: 文件的标识，同 BlockReader.file_id
+        :return: Flight
+        """
+        key = (driver_name, uid)
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = Flight(key)
+                self.flights[key] = flight
+            flight.refs += 1
+            return flight
+
+    def release(self, flight: Flight):
+        """
+        离开下载，没有线程使用且没有进行中的下载时移除登记
+        """
+        with self.lock:
+            flight.refs -= 1
+            if flight.refs <= 0 and not flight.pending and not flight.bypass and flight.task is None:
+                self.flights.pop(flight.key, None)
+
+
+singleFlight = SingleFlight()
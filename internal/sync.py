@@ -0,0 +1,96 @@
+import threading
+
+from config import config
+from internal.log import get_logger
+from internal.driver import drivers_obj
+from internal.dir_info import dirInfoManager
+from internal.system_res import sync_cursor_cache, stop_event
+
+logger = get_logger(__name__)
+
+MAX_FAILURES = 5  # 连续失败这么多次后视为驱动不支持增量变化，不再轮询
+
+
+class SyncEngine:
+    """
+    同步引擎
+
+    定期轮询驱动的增量变化接口（changes），把变化应用到目录缓存，
+    每次轮询的开销与变化的数量成正比，而不是与目录树的大小成正比
+    驱动不支持增量变化时不启动，目录仍然按超时时间重新读取
+    """
+
+    def __init__(self):
+        self.interval = config.temp.dir.get('SYNC_INTERVAL', 30)  # 轮询间隔(秒)
+        self.cursors = sync_cursor_cache  # 驱动名称 -> cursor，重启后继续从上次的位置同步
+        self.threads = {}  # 驱动名称 -> 轮询线程
+        self.lock = threading.Lock()
+
+    def start(self, name):
+        """
+        开始同步驱动，每个驱动只会启动一个轮询线程
+
+        :param name: 对应驱动的名称
+        :return:
+        """
+        with self.lock:
+            if name in self.threads:
+                return
+            thread = self.threads[name] = threading.Thread(target=self._run, args=(name,), daemon=True)
+        thread.start()
+
+    def poll(self, name) -> int:
+        """
+        获取并应用一次变化
+
+        :param name: 对应驱动的名称
+        :return: 应用的变化数量
+        """
+        driver = drivers_obj[name]
+        cursor = self.cursors.get(name)
+        count = 0
+        while not stop_event.is_set():
+            result = driver.changes(cursor)
+            if result.reset:  # cursor 失效，不知道期间发生了哪些变化，已有的目录都需要重新读取
+                dirInfoManager.mark_stale(name)
+            for change in result.changes:
+                dirInfoManager.apply_change(name, change)
+            count += len(result.changes)
+
+            cursor = result.cursor
+            self.cursors[name] = cursor
+            if not result.has_more:
+                break
+
+        dirInfoManager.synced.add(name)  # 之后目录读取一次后一直保持 FRESH，由变化来更新
+        return count
+
+    def _run(self, name):
+        failures = 0  # 连续失败的次数
+        while True:
+            try:
+                count = self.poll(name)
+                failures = 0
+                if count:
+                    logger.info(f'sync {name}: {count} changes')
+            except NotImplementedError:
+                logger.info(f'sync {name}: driver has no change feed, fall back to periodic re-listing')
+                break
+            except Exception as e:
+                # 轮询失败期间目录恢复按超时时间重新读取
+                dirInfoManager.synced.discard(name)
+                failures += 1
+                if failures >= MAX_FAILURES:
+                    logger.warning(f'sync {name}: failed {failures} times in a row ({e}), '
+                                   f'fall back to periodic re-listing')
+                    break
+                logger.exception(e)
+
+            if stop_event.wait(self.interval):
+                break
+
+        with self.lock:
+            self.threads.pop(name, None)
+
+
+syncEngine = SyncEngine()
@@ -1,19 +1,34 @@
 # 集中定义一些退出程序前需要关闭的资源
 import os
+import shutil
 import threading
 from concurrent.futures import ThreadPoolExecutor as Pool
 from diskcache import Cache
 from collections import deque
 
+from config import config
+from internal.write_behind import WriteBehind
+from internal.scheduler import PriorityScheduler
+
 current_path = os.path.abspath(os.path.dirname(__file__))
 
+# 旧版本的目录缓存，已经由 inode-table 代替，格式不同无法迁移，直接删除后重新读取
+LEGACY_CACHES = ('buffer-batchmeta', 'dir_buffer-buffer-batchmeta', 'traversed-folder')
+for legacy in LEGACY_CACHES:
+    legacy_path = os.path.join(current_path, '../cache', legacy)
+    if os.path.isdir(legacy_path):
+        shutil.rmtree(legacy_path, ignore_errors=True)
+        print(f'legacy cache {legacy} removed')
+
 # 全局标志位，用于通知任务终止
 stop_event = threading.Event()
 
-dir_info_pool = Pool(10)
-dir_info_buffer = Cache(os.path.join(current_path, '../cache/buffer-batchmeta'))
-dir_info_dir_buffer = Cache(os.path.join(current_path, '../cache/dir_buffer-buffer-batchmeta'))
-dir_info_traversed_folder = Cache(os.path.join(current_path, '../cache/traversed-folder'))
+dir_info_pool = PriorityScheduler(10)  # 读取目录，用户打开的目录优先于预加载
+read_ahead_pool = Pool(8)  # 预读线程池
+download_pool = Pool(config.temp.file.get('MAX_CONNECTIONS', 16))  # 分段下载线程池，线程数即全局最大连接数
+dir_info_buffer = Cache(os.path.join(current_path, '../cache/inode-table'))  # inode 编号 -> 节点记录
+dir_info_buffer_writer = WriteBehind(dir_info_buffer, encode=lambda node: node.record())  # 以内存为准，延迟写入磁盘
+sync_cursor_cache = Cache(os.path.join(current_path, '../cache/sync-cursor'))  # 同步引擎的 cursor
 
 temp_fs_cache_path = os.path.join(current_path, '../cache/temp-fs')
 if os.path.exists(temp_fs_cache_path):
@@ -21,6 +36,8 @@ if os.path.exists(temp_fs_cache_path):
 else:
     temp_fs_cache = Cache(temp_fs_cache_path)
     temp_fs_cache['size'] = 0  # 当前缓存占用大小
+temp_fs_log = Cache(os.path.join(current_path, '../cache/temp-fs-log'))  # 缓存文件的访问日志 序号 -> (key, ...)
+temp_fs_log_writer = WriteBehind(temp_fs_log)  # 访问时只追加到内存，按批次写入磁盘
 
 
 mount_thread = {}
@@ -28,11 +45,18 @@ mount_thread = {}
 
 def close_system_res():
     stop_event.set()
+    # 先停止线程池，正在进行的任务结束后才不会再写入缓存
+    dir_info_pool.shutdown(wait=True, cancel_futures=True)
+    print('dir_info_pool closed')
+    read_ahead_pool.shutdown(wait=True, cancel_futures=True)
+    print('read_ahead_pool closed')
+    download_pool.shutdown(wait=True, cancel_futures=True)
+    print('download_pool closed')
+    dir_info_buffer_writer.close()
     dir_info_buffer.close()
-    dir_info_dir_buffer.close()
-    dir_info_traversed_folder.close()
+    sync_cursor_cache.close()
     temp_fs_cache.close()
+    temp_fs_log_writer.close()
+    temp_fs_log.close()
     print('system resources closed')
-    dir_info_pool.shutdown(wait=True)
-    print('dir_info_pool closed')
     # Todo 关闭挂载线程
@@ -1,30 +1,92 @@
+import itertools
 import queue
+import threading
 import time
-from collections import deque
 from hashlib import md5 as hashlib_md5
 import os
 
 from config import config
-from internal.system_res import temp_fs_cache
+from internal.cache_policy import get_policy, TinyLFU
+from internal.log import get_logger
+from internal.system_res import temp_fs_cache, temp_fs_log_writer, stop_event
+
+logger = get_logger(__name__)
 
 current_path = os.path.abspath(os.path.dirname(__file__))
 
+LOG_COMPACT_MIN = 10000  # 访问日志中的 key 数量超过这个数量并且超过缓存文件数量的两倍时压缩
+LOG_CHUNK = 10000  # 访问日志每条记录最多保存的 key 数量
+LOG_FLUSH_INTERVAL = 1  # 访问合并为一条记录写入访问日志的间隔(秒)
+EVICT_BATCH = 256  # 后台淘汰每批最多移除的文件数量，每批在一个事务中修改元信息
+EVICT_INTERVAL = 10  # 后台淘汰线程没有被唤醒时检查的间隔(秒)
+RECONCILE_INTERVAL = 600  # 校正缓存占用大小的间隔(秒)
+RECONCILE_BATCH = 1000  # 校正每批检查的文件数量，每批在一个事务中修改元信息
+
 
 class TempFs:
     """
-    用于缓存文件的目录映射和ALU更新
+    用于缓存文件的目录映射和淘汰，淘汰策略由配置的 EVICTION_POLICY 决定
     """
 
-    def __init__(self):
-        self.root = config.temp.file.ROOT  # 缓存根目录
-        self.max_size = config.temp.file.MAX_CACHE_SIZE  # 缓存占用最大大小
+    def __init__(self, root=None, max_size=None, meta=temp_fs_cache, log=temp_fs_log_writer):
+        """
+        :param root: 缓存根目录，None 表示使用配置
+        :param max_size: 缓存占用最大大小，None 表示使用配置
+        :param meta: 缓存文件元信息
+        :param log: 访问日志的延迟写入
+        """
+        self.root = root or config.temp.file.ROOT  # 缓存根目录
+        self.max_size = max_size or config.temp.file.MAX_CACHE_SIZE  # 缓存占用最大大小
         self.timeout = config.temp.file.CACHE_TIMEOUT  # 缓存超时时间
 
         if not os.path.exists(self.root):
             os.makedirs(self.root)
 
-        self.meta = temp_fs_cache  # 缓存文件元信息
-        self.weight = self.build_weight()  # 重建权重队列，用于淘汰策略
+        self.meta = meta  # 缓存文件元信息
+        self.meta.add('size', 0)  # 当前缓存占用大小
+        self.log = log  # 访问日志，按序号回放得到缓存文件的访问顺序
+        self.seq = itertools.count(self._last_seq() + 1)  # 访问日志的序号
+        self.log_records = 0  # 访问日志中的 key 数量，由后台线程在超过缓存文件数量较多时压缩
+        self.batch = {}  # 还没有写入访问日志的访问，同一个 key 只保留最后一次
+        self.batch_time = time.monotonic()  # 上一次写入访问日志的时间
+        self.lock = threading.RLock()
+        self.policy = get_policy(config.temp.file.get('EVICTION_POLICY', 'lru'))  # 淘汰策略的类
+        self._weight = None  # 淘汰策略，由后台线程启动后在锁外从访问日志重建
+        self.backlog = None  # 重建淘汰策略期间的访问和移除，重建完成后补上
+        self.build_lock = threading.Lock()  # 保证只重建一次
+
+        # 淘汰由后台线程完成：超过高水位后淘汰到低水位，读取和分配只有在超过 max_size 时才等待
+        self.high = self.max_size * config.temp.file.get('HIGH_WATERMARK', 0.9)
+        self.low = self.max_size * config.temp.file.get('LOW_WATERMARK', 0.8)
+        self.demand = 0  # 正在等待空间的分配大小之和
+        self.evict_passes = 0  # 已经开始的淘汰次数
+        self.exhausted = False  # 最近一次淘汰是否因为没有可以淘汰的文件（都在读取中）而没有达到目标
+        self.evict_event = threading.Event()  # 唤醒后台淘汰线程
+        self.freed = threading.Condition()  # 后台淘汰释放空间后通知等待的分配
+        self.orphans = set()  # 上一次校正时发现的没有元信息的缓存文件
+        self.broken = set()  # 上一次校正时发现的文件不存在或者大小不对的缓存 key
+        self.size_writes = 0  # 修改缓存占用大小的次数，校正期间有修改时不校正总的占用大小
+        self.pinned = {}  # 正在读取的缓存文件 key -> 读取者数量，不会被淘汰
+        self.on_drop = []  # 缓存文件被移除后调用，参数为移除的 key 列表
+        # 缓存已满时只接受最近比将被淘汰的文件打开更多次的文件，None 表示不限制
+        self.admission = (TinyLFU(config.temp.file.get('ADMISSION_SKETCH_WIDTH', 4096))
+                          if config.temp.file.get('ADMISSION', True) else None)
+        self.closed = False  # 调用 close 后后台线程退出
+        self.evictor = threading.Thread(target=self._run_evictor, daemon=True)
+        self.evictor.start()
+
+    def close(self):
+        """
+        停止后台淘汰线程并写入合并的访问
+
+        用于单独创建的 TempFs（测试、基准测试），全局的 tempFs 随 stop_event 停止
+        """
+        self.closed = True
+        self.evict_event.set()
+        self.evictor.join()
+        with self.lock:
+            self._write_batch()
+        self.log.flush()
 
     @staticmethod
     def generate_key(driver_name, uid):
@@ -32,32 +94,216 @@ class TempFs:
         return hashlib_md5(key.encode()).hexdigest()
 
     @staticmethod
-    async def remove_file_sync(file_path):
-        if os.path.exists(file_path):
+    def remove_file_sync(file_path):
+        try:
             os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:  # 文件正在被使用等，留给之后的校正作为没有元信息的文件清理
+            logger.warning(f'remove cache file {file_path} failed: {e}')
+
+    @staticmethod
+    def usage(data) -> int:
+        """
+        缓存文件实际占用的大小，只下载了一部分的文件按已下载的块计算
+
+        :param data: 缓存文件的元信息
+        """
+        if 'blocks' not in data:
+            return data['size']
+        filled = bin(int.from_bytes(data['blocks'], 'little')).count('1')
+        return min(filled * data['block_size'], data['size'])
+
+    def _last_seq(self):
+        """
+        访问日志中最大的序号
+
+        不能取最后写入的记录：压缩时写入的记录序号可能比压缩期间写入的访问小
+        压缩后的访问日志只有少量记录，启动时遍历一次序号的开销可以忽略
+        """
+        return max(self.log.cache, default=0)
+
+    @property
+    def weight(self):
+        """
+        淘汰策略，记录缓存文件的访问情况并决定淘汰顺序
+
+        还没有重建时在当前线程重建，不能在持有 self.lock 的情况下调用
+        """
+        if self._weight is None:
+            self._build()
+        return self._weight
+
+    def _build(self):
+        """
+        在锁外重建淘汰策略，重建期间的访问和移除先记录在 backlog 中，重建完成后补上
+        """
+        with self.build_lock:
+            if self._weight is not None:
+                return
+            with self.lock:
+                self._write_batch()
+                limit = next(self.seq)  # 只回放这之前的访问日志
+                written = self.log_records
+                self.backlog = []
+            try:
+                weight, records, missing = self.build_weight(limit)
+                with self.lock:
+                    for op, *args in self.backlog:
+                        getattr(weight, op)(*args)
+                    self.log_records = records + self.log_records - written
+                    self._weight = weight
+            finally:
+                with self.lock:
+                    self.backlog = None
+        if missing:
+            self.compact()  # 把没有访问记录的缓存文件写入访问日志
+
+    def build_weight(self, limit=None):
+        """
+        从访问日志重建淘汰策略
+
+        按序号回放访问日志，不需要读取每个缓存文件的元信息再排序，
+        需要文件大小的策略（ARC、GDSF）才读取元信息中的大小
+        没有访问记录的缓存文件（旧版本留下的）按元信息中的时间戳最先加入
+
+        :param limit: 只回放序号小于 limit 的记录，None 表示全部
+        :return: (淘汰策略, 回放的 key 数量, 是否有没有访问记录的缓存文件)
+        """
+        self.log.flush()
+        cache = self.log.cache
+        weight = self.policy(self.max_size)
+        live = {key for key in self.meta if key != 'size'}
+
+        sizes = {}
+
+        def size_of(key):
+            if not weight.sized:
+                return None
+            if key not in sizes:
+                sizes[key] = self.meta.get(key, {}).get('size', 0)
+            return sizes[key]
+
+        accesses = []
+        for seq in sorted(seq for seq in cache if limit is None or seq < limit):
+            accesses.extend(cache.get(seq, ()))
+
+        missing = live.difference(accesses)
+        for key in sorted(missing, key=lambda k: self.meta.get(k, {}).get('time', 0)):
+            weight.touch(key, size_of(key))
+        for key in accesses:
+            if key in live:  # 跳过已经移除的缓存文件
+                weight.touch(key, size_of(key))
+        return weight, len(accesses), bool(missing)
+
+    def compact(self):
+        """
+        把访问日志压缩为当前的淘汰顺序，只在取出淘汰顺序时持有 self.lock，写入在锁外进行
+        压缩后访问次数等信息不再保留，只保留先后顺序
+        """
+        with self.lock:
+            self._write_batch()
+            keys = list(self._weight)
+            seqs = [next(self.seq) for _ in range(0, len(keys), LOG_CHUNK)] or [next(self.seq)]
+            self.log_records = len(keys)
+
+        self.log.flush()  # 压缩前的访问都已经写入，之后的访问序号更大，不会被删除
+        cache = self.log.cache
+        with cache.transact():
+            for seq in [seq for seq in cache if seq < seqs[0]]:
+                cache.pop(seq, None)
+            for seq, i in zip(seqs, range(0, len(keys), LOG_CHUNK)):
+                cache[seq] = tuple(keys[i:i + LOG_CHUNK])
+
+    def _maybe_compact(self):
+        """
+        访问日志中的 key 比缓存文件多很多时压缩，由后台线程调用，与是否需要淘汰无关
+        """
+        if self._weight is not None and self.log_records > max(LOG_COMPACT_MIN, 2 * len(self._weight)):
+            self.compact()
 
-    def build_weight(self):
+    def _write_batch(self):
         """
-        重建权重队列
-        :return:
+        把合并后的访问作为一条记录写入访问日志，需要在持有 self.lock 的情况下调用
         """
-        weight = deque()
-        # 按时间戳升序排序并只保留键
-        # for key in self.meta:
-        #     print("输出：：", key)
-        #     print(key, self.meta[key]['time'], type(self.meta[key]['time']))
-        # print('meta::', self.meta)
-        sorted_keys = sorted(
-            (key for key in self.meta if key != 'size'),
-            key=lambda k: self.meta[k]['time']
-        )
-        # 创建队列，最新的时间戳在最左侧
-        for key in sorted_keys:
-            weight.appendleft(key)
+        if self.batch:
+            self.log.set(next(self.seq), tuple(self.batch))
+            self.log_records += len(self.batch)
+            self.batch = {}
+        self.batch_time = time.monotonic()
 
-        return weight
+    def _resize(self, key, size: int):
+        """
+        更新淘汰策略中的文件大小，不计为访问，也不写入访问日志
+
+        :param key: 缓存文件的 key
+        :param size: 文件大小
+        """
+        with self.lock:
+            if self._weight is not None:
+                self._weight.resize(key, size)
+            elif self.backlog is not None:
+                self.backlog.append(('resize', key, size))
+
+    def _touch(self, key, size=None):
+        """
+        记录一次访问，交给淘汰策略并合并到下一条访问日志
+
+        同一个 key 在一条记录中只保留最后一次，回放得到的先后顺序不变
+
+        :param key: 缓存文件的 key
+        :param size: 文件大小，None 表示没有变化
+        """
+        with self.lock:
+            if self._weight is not None:
+                self._weight.touch(key, size)
+            elif self.backlog is not None:
+                self.backlog.append(('touch', key, size))
+            self.batch.pop(key, None)
+            self.batch[key] = None
+            if len(self.batch) >= LOG_CHUNK or time.monotonic() - self.batch_time >= LOG_FLUSH_INTERVAL:
+                self._write_batch()
+
+    def record(self, driver_name: str, uid):
+        """
+        记录一次文件打开，用于判断是否缓存
+
+        已经缓存的文件同时计为淘汰策略的一次访问，之后的每次读取不再计入，
+        一次打开无论读取多少次都只算一次访问
 
-    def allocate(self, driver_name: str, uid, size: int, suffix: str = "", md5=None) -> str:
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        """
+        key = self.generate_key(driver_name, uid)
+        if self.admission is not None:
+            self.admission.record(key)
+        if key in self.meta:
+            self._touch(key)
+
+    def admit(self, driver_name: str, uid, size: int) -> bool:
+        """
+        判断是否为还没有缓存的文件分配缓存
+
+        加入后不超过高水位、不需要淘汰其他文件时直接接受；
+        否则只接受最近打开次数多于淘汰策略下一个要淘汰的文件的文件，比高水位还大的文件不缓存
+        淘汰策略还在重建时没有可以比较的文件，直接接受
+
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        :param size: 文件大小，单位为字节
+        :return: 是否缓存
+        """
+        if self.meta['size'] + size <= self.high:
+            return True
+        if size > self.high:
+            return False
+        if self.admission is None:
+            return True
+        with self.lock:
+            victim = self._weight.victim() if self._weight is not None else None
+        return self.admission.admit(self.generate_key(driver_name, uid), victim)
+
+    def allocate(self, driver_name: str, uid, size: int, suffix: str = "", md5=None, used=None) -> str:
         """
         为文件分配一个缓存路径，如果缓存空间不足会根据缓存文件的访问权重淘汰一部分文件
 
@@ -68,41 +314,40 @@ class TempFs:
         :param size: 文件大小，单位为字节
         :param suffix: 文件后缀,可选，如果传入会在返回的文件路径中添加后缀，方便后续直接查看缓存文件
         :param md5: 可以附加存储的md5，对于TempFs来说，这个参数没有意义，但是可以通过 get_md5 方法获取到
+        :param used: 分配时实际占用的大小，None 表示与 size 相同，按块下载的文件之后由 set_blocks 更新
         :return: 分配的文件路径
         """
-        # 验证剩余空间是否足够
-        if self.meta['size'] + size > self.max_size:
-            # 淘汰一部分文件
-            while self.meta['size'] + size > self.max_size:
-                self.pop()
-
         # 利用driver_name和uid生成一个唯一的key
         key = self.generate_key(driver_name, uid)
 
         if key in self.meta:
             raise KeyError(f'key {driver_name} and {uid} already exists')
 
+        used = size if used is None else used
+        # 验证剩余空间是否足够，不足时由后台淘汰一部分文件，腾不出空间时仍然分配
+        self.reserve(used)
+
         # 验证传入的后缀
         if suffix != "":
             if not suffix.startswith('.'):
                 suffix = '.' + suffix
 
-        # 添加到权重队列开头
-        if key not in self.weight:
-            self.weight.appendleft(key)
-
         # 生成一个文件路径
-        file_path = os.path.join(self.root, key[:2], key[2:4] + suffix)
+        file_path = os.path.join(self.root, key[:2], key[2:] + suffix)
         # 储存文件元信息
         data = {
             'path': file_path,
             'size': size,
+            'used': used,
             'time': time.time(),
         }
         if md5:
             data['md5'] = md5
-        self.meta[key] = data
-        self.meta['size'] += size
+        self.size_writes += 1
+        with self.meta.transact():
+            self.meta[key] = data
+            self.meta.incr('size', used)
+        self._touch(key, size)  # 加入淘汰策略，在写入元信息之后，重建淘汰策略时才不会漏掉
 
         # 创建文件夹
         file_dir = os.path.split(file_path)[0]
@@ -111,34 +356,218 @@ class TempFs:
 
         return file_path
 
+    def reserve(self, size: int):
+        """
+        为新增的 size 字节预留空间
+
+        超过高水位时唤醒后台淘汰后立即返回，只有超过 max_size 时才等待后台淘汰腾出空间
+        开始等待之后的一次淘汰已经没有可以淘汰的文件（剩下的都在读取中）时不再等待
+
+        :param size: 新增的大小，单位为字节
+        :return: 是否有足够的空间，腾不出空间时返回 False，由调用者决定是否仍然写入
+        """
+        if self.meta['size'] + size <= self.high:
+            return True
+        self.evict_event.set()
+        if self.meta['size'] + size <= self.max_size:
+            return True
+
+        with self.freed:
+            self.demand += size
+            passes = self.evict_passes  # 之前开始的淘汰没有算上这次的需求
+            try:
+                while self.meta['size'] + size > self.max_size and not stop_event.is_set():
+                    if self.evict_passes > passes and self.exhausted:
+                        logger.warning(f'no evictable cache file for {size} bytes')
+                        return False
+                    self.evict_event.set()
+                    self.freed.wait(1)
+            finally:
+                self.demand -= size
+        return self.meta['size'] + size <= self.max_size
+
+    def _drop(self, keys) -> int:
+        """
+        移除缓存文件的元信息并删除文件，调用前需要先从权重队列中移除
+        移除后通知 on_drop 中的回调，丢弃对应的读取状态
+
+        :param keys: 缓存文件的 key 列表
+        :return: 释放的大小
+        """
+        dropped = []
+        paths = []
+        freed = 0
+        self.size_writes += 1
+        with self.meta.transact():
+            for key in keys:
+                data = self.meta.pop(key, None)
+                if data is None:
+                    continue
+                freed += data.get('used', data['size'])
+                dropped.append(key)
+                paths.append(data['path'])
+            self.meta.incr('size', -freed)
+        for callback in self.on_drop:
+            callback(dropped)
+        for file_path in paths:
+            self.remove_file_sync(file_path)
+        return freed
+
     def pop(self):
         """
-        弹出一个缓存文件
+        按淘汰策略弹出一个缓存文件
+        """
+        weight = self.weight
+        with self.lock:
+            key = weight.pop()  # 淘汰策略选出的文件
+        self._drop([key])
 
-        :param key: 缓存文件的 key
-        :return: 缓存文件的路径
+    def evict(self, target: int) -> int:
         """
-        key = self.weight.pop()
+        按淘汰策略分批淘汰缓存文件，直到占用不超过 target
 
-        file_path = self.meta[key]['path']
-        self.remove_file_sync(file_path)
-        self.meta['size'] -= self.meta[key]['size']
-        del self.meta[key]
+        :param target: 目标占用大小，单位为字节
+        :return: 释放的大小
+        """
+        total = 0
+        weight = self.weight
+        self.exhausted = False
+        self.evict_passes += 1
+        while not stop_event.is_set():
+            excess = self.meta['size'] - target
+            if excess <= 0:
+                break
+
+            batch = []
+            skipped = []
+            with self.lock:
+                while weight and excess > 0 and len(batch) < EVICT_BATCH:
+                    key, state = weight.pop_entry()
+                    if key in self.pinned:
+                        skipped.append((key, state))
+                        continue
+                    batch.append(key)
+                    data = self.meta.get(key, {})
+                    excess -= data.get('used', data.get('size', 0))
+                # 正在读取的文件放回原来的位置，不算作一次访问
+                for key, state in reversed(skipped):
+                    weight.unpop(key, state)
+            if not batch:
+                self.exhausted = True
+                break
+
+            total += self._drop(batch)
+            with self.freed:
+                self.freed.notify_all()
+        return total
+
+    def reconcile(self):
+        """
+        校正记录的缓存占用大小，检查缓存文件是否还在磁盘上，并删除缓存目录中没有元信息的文件
 
-    def update_weight(self, key):
+        元信息按 RECONCILE_BATCH 分批检查，每批在一个短事务中按已下载的块校正每个文件的占用大小，
+        不会长时间阻塞读取和分配；校正期间没有其他修改时再校正总的占用大小
+
+        文件不存在或者大小与元信息不符的缓存要连续两次校正都是这样才移除，
+        没有元信息的文件同样要连续两次校正都没有元信息才删除，避免删除正在分配或重命名的文件
+        """
+        orphans = set()
+        for sub_dir in os.scandir(self.root):
+            if not sub_dir.is_dir() or len(sub_dir.name) != 2:
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.is_file() and sub_dir.name + entry.name.split('.', 1)[0] not in self.meta:
+                    orphans.add(entry.path)
+        for file_path in orphans & self.orphans:
+            self.remove_file_sync(file_path)
+        self.orphans = orphans - self.orphans
+
+        writes = self.size_writes
+        keys = [key for key in self.meta if key != 'size']
+        total = 0
+        broken = set()
+        for i in range(0, len(keys), RECONCILE_BATCH):
+            batch = keys[i:i + RECONCILE_BATCH]
+            sizes = {}  # 在事务外读取文件大小
+            for key in batch:
+                data = self.meta.get(key)
+                if data is None:
+                    continue
+                try:
+                    sizes[key] = os.stat(data['path']).st_size
+                except FileNotFoundError:
+                    sizes[key] = None
+
+            with self.meta.transact():
+                diff = 0
+                for key in batch:
+                    data = self.meta.get(key)
+                    if data is None:  # 已经被淘汰或移除
+                        continue
+                    if sizes.get(key) != data['size']:
+                        broken.add(key)
+                    used = self.usage(data)
+                    if data.get('used') != used:
+                        diff += used - data.get('used', data['size'])
+                        data['used'] = used
+                        self.meta[key] = data
+                    total += used
+                if diff:
+                    self.meta.incr('size', diff)
+
+        with self.meta.transact():
+            recorded = self.meta['size']
+            if self.size_writes == writes and total != recorded:
+                logger.info(f'cache size reconciled: {recorded} -> {total}')
+                self.meta['size'] = total
+
+        with self.lock:
+            broken = {key for key in broken if key not in self.pinned}
+        dropped = broken & self.broken
+        self.broken = broken - dropped
+        if dropped:
+            logger.warning(f'drop {len(dropped)} missing or damaged cache files')
+            self._discard(list(dropped))
+
+    def _run_evictor(self):
+        """
+        后台淘汰线程，启动后重建淘汰策略，占用超过高水位时淘汰到低水位，
+        定期写入合并的访问、压缩访问日志、校正缓存占用大小
+        """
+        try:
+            self._build()
+        except Exception as e:
+            logger.exception(e)
+        next_reconcile = time.monotonic()
+        while not stop_event.is_set():
+            self.evict_event.wait(EVICT_INTERVAL)
+            self.evict_event.clear()
+            if self.closed:
+                return
+            try:
+                with self.lock:
+                    self._write_batch()
+                self._maybe_compact()
+                if time.monotonic() >= next_reconcile:
+                    self.reconcile()
+                    next_reconcile = time.monotonic() + RECONCILE_INTERVAL
+                if self.meta['size'] > self.high or self.demand:
+                    # 有等待空间的分配时还要腾出足够它使用的空间
+                    self.evict(min(self.low, self.max_size - self.demand))
+            except Exception as e:
+                logger.exception(e)
+            with self.freed:
+                self.freed.notify_all()
+
+    def update_weight(self, key, size=None):
         """
         更新缓存文件的权重
 
         :param key: 缓存文件的 key
+        :param size: 文件大小，None 表示没有变化
         """
-        # 更新权重队列
-        self.weight.remove(key)
-        self.weight.appendleft(key)
-
-        # 更新时间戳
-        data = self.meta[key]
-        data['time'] = time.time()
-        self.meta[key] = data
+        # 访问顺序由访问日志记录，不再每次访问都改写元信息中的时间戳
+        self._touch(key, size)
 
     def update(self, driver_name: str, uid, size: int, md5=None):
         """
@@ -153,24 +582,25 @@ class TempFs:
             raise ValueError('size is too large')
 
         key = self.generate_key(driver_name, uid)
-        if key not in self.meta:
-            raise KeyError(f'key {driver_name} and {uid} not exists')
-        self.update_weight(key)  # 更新权重
-
-        data = self.meta[key]
-        data['size'] = size  # 更新文件元信息
-        if md5:
-            data['md5'] = md5
-        data['time'] = time.time()
-        self.meta[key] = data
-        old_size = self.meta[key]['size']
-        # 计算差值
-        diff = size - old_size
-        self.meta['size'] += diff  # 更新缓存占用大小
-        if self.meta['size'] > self.max_size:
-            # 淘汰一部分文件
-            while self.meta['size'] > self.max_size:
-                self.pop()
+        self.size_writes += 1
+        with self.meta.transact():
+            if key not in self.meta:
+                raise KeyError(f'key {driver_name} and {uid} not exists')
+
+            data = self.meta[key]
+            old = data.get('used', data['size'])
+            data['size'] = size  # 更新文件元信息
+            data['used'] = self.usage(data)
+            diff = data['used'] - old  # 计算差值
+            if md5:
+                data['md5'] = md5
+            data['time'] = time.time()
+            self.meta[key] = data
+            self.meta.incr('size', diff)  # 更新缓存占用大小
+        self._resize(key, size)  # 写入不算访问，只更新大小
+
+        if self.meta['size'] > self.high:
+            self.evict_event.set()  # 文件已经写入，由后台淘汰一部分文件，不在这里等待
 
     def remove(self, driver_name: str, uid):
         """
@@ -183,11 +613,19 @@ class TempFs:
 
         if key not in self.meta:
             raise KeyError(f'key {driver_name} and {uid} not exists')
+        self._discard([key])
 
-        self.remove_file_sync(self.meta[key]['path'])
-        self.meta['size'] -= self.meta[key]['size']
-        self.weight.remove(key)
-        del self.meta[key]
+    def _discard(self, keys):
+        """
+        从淘汰策略中移除缓存文件，然后移除元信息并删除文件
+        """
+        with self.lock:
+            for key in keys:
+                if self._weight is not None:
+                    self._weight.remove(key)
+                elif self.backlog is not None:
+                    self.backlog.append(('remove', key))
+        self._drop(keys)
 
     def get_md5(self, driver_name: str, uid):
         """
@@ -204,6 +642,76 @@ class TempFs:
             raise KeyError(f'key {driver_name} and {uid} not exists')
         return self.meta[key].get('md5', None)
 
+    def get_blocks(self, driver_name: str, uid):
+        """
+        获取缓存文件的块位图
+
+        只下载了一部分的缓存文件会记录已下载的块，没有记录位图的缓存文件视为已经完整
+
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        :return: (块大小, 位图) 或 None（文件完整）
+        """
+        key = self.generate_key(driver_name, uid)
+        if key not in self.meta:
+            raise KeyError(f'key {driver_name} and {uid} not exists')
+        data = self.meta[key]
+        if 'blocks' not in data:
+            return None
+        return data['block_size'], data['blocks']
+
+    def set_blocks(self, driver_name: str, uid, block_size: int, blocks):
+        """
+        保存缓存文件的块位图，用于重启或断网后从缺失的块继续下载，同时按已下载的块更新占用大小
+
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        :param block_size: 块大小
+        :param blocks: 位图，传入 None 表示文件已经完整
+        """
+        key = self.generate_key(driver_name, uid)
+        self.size_writes += 1
+        with self.meta.transact():
+            if key not in self.meta:
+                raise KeyError(f'key {driver_name} and {uid} not exists')
+            data = self.meta[key]
+            if blocks is None:
+                data.pop('blocks', None)
+                data.pop('block_size', None)
+            else:
+                data['blocks'] = bytes(blocks)
+                data['block_size'] = block_size
+            used = self.usage(data)
+            diff = used - data.get('used', data['size'])
+            data['used'] = used
+            self.meta[key] = data
+            if diff:
+                self.meta.incr('size', diff)
+
+    def pin(self, driver_name: str, uid):
+        """
+        标记缓存文件正在读取，调用 unpin 之前不会被淘汰
+
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        """
+        key = self.generate_key(driver_name, uid)
+        with self.lock:
+            self.pinned[key] = self.pinned.get(key, 0) + 1
+
+    def unpin(self, driver_name: str, uid):
+        """
+        取消一次 pin
+
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        """
+        key = self.generate_key(driver_name, uid)
+        with self.lock:
+            count = self.pinned.pop(key, 0) - 1
+            if count > 0:
+                self.pinned[key] = count
+
     def has(self, driver_name: str, uid):
         """
         判断是否存在缓存文件
@@ -229,6 +737,17 @@ class TempFs:
 
         self.update_weight(key)
 
+    def peek(self, driver_name: str, uid):
+        """
+        获取缓存文件的路径，不计为一次访问，用于打开之后的读取
+
+        :param driver_name: 存储方案的名称
+        :param uid: 对应的文件的唯一标识符，只要在当前存储方案中唯一即可，可以是文件的路径，或者是文件的 hash 值
+        :return: 缓存文件的路径，没有缓存时返回 None
+        """
+        data = self.meta.get(self.generate_key(driver_name, uid))
+        return None if data is None else data['path']
+
     def get(self, driver_name: str, uid):
         """
         获取缓存文件的路径
@@ -0,0 +1,74 @@
+import threading
+
+from internal.log import get_logger
+
+logger = get_logger(__name__)
+
+FLUSH_INTERVAL = 1  # 写入间隔(秒)
+
+
+class WriteBehind:
+    """
+    diskcache 的延迟写入
+
+    修改先记录在内存中，由后台线程按批次在一个事务中写入 diskcache，
+    同一个 key 在两次写入之间的多次修改只会写入最后一次
+    """
+
+    def __init__(self, cache, interval=FLUSH_INTERVAL, encode=None):
+        """
+        :param cache: diskcache
+        :param interval: 写入间隔(秒)
+        :param encode: 写入时把值转换为要保存的内容，返回 None 表示删除
+        """
+        self.cache = cache
+        self.interval = interval
+        self.encode = encode
+
+        self.pending = {}  # key -> 值，None 表示删除
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def set(self, key, value):
+        with self.lock:
+            self.pending[key] = value
+
+    def delete(self, key):
+        with self.lock:
+            self.pending[key] = None
+
+    def flush(self):
+        """
+        立即把所有修改写入 diskcache
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        if not pending:
+            return
+
+        with self.cache.transact():
+            for key, value in pending.items():
+                if value is not None and self.encode is not None:
+                    value = self.encode(value)
+                if value is None:
+                    self.cache.pop(key, None)
+                else:
+                    self.cache[key] = value
+
+    def close(self):
+        """
+        停止后台线程并写入剩余的修改
+        """
+        self.closed.set()
+        self.flush()
+
+    def _run(self):
+        while not self.closed.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
@@ -0,0 +1,89 @@
+"""
+淘汰策略基准测试
+
+回放文件访问记录，比较各个淘汰策略的命中率（按次数）和字节命中率（按大小）
+访问记录的每一行是一次文件打开，TempFs 每次打开只计一次访问，打开之后的读取不再计入淘汰策略
+默认生成一段模拟的访问记录：经常打开的小文档（按 Zipf 分布访问）中间穿插只播放一次的大视频
+也可以传入自己的访问记录文件，每行一个 "key,size"
+
+用法: python test/bench_cache_policy.py [访问记录文件] [缓存大小(MB)，默认 1024]
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from internal.cache_policy import POLICIES, TinyLFU
+
+MB = 1024 * 1024
+HIGH_WATERMARK = 0.9  # 与 TempFs 的默认配置相同
+LOW_WATERMARK = 0.8
+
+
+def synthetic_trace(seed=0):
+    """
+    2000 个 10KB~2MB 的文档按 Zipf 分布访问，每 500 次访问中间播放一个 300MB~1.5GB 的新视频
+    """
+    rnd = random.Random(seed)
+    docs = [(f'doc{i}', rnd.randint(10 * 1024, 2 * MB)) for i in range(2000)]
+    weights = [1 / (i + 1) for i in range(len(docs))]
+    trace = []
+    for i, doc in enumerate(rnd.choices(docs, weights, k=200_000)):
+        trace.append(doc)
+        if i % 500 == 0:
+            trace.append((f'video{i}', rnd.randint(300 * MB, 1536 * MB)))
+    return trace
+
+
+def load_trace(path):
+    with open(path, encoding='utf-8') as f:
+        return [(key, int(size)) for key, size in (line.strip().rsplit(',', 1) for line in f if line.strip())]
+
+
+def replay(policy_class, trace, capacity):
+    """
+    按 TempFs 的方式回放：
+        每次打开记录到 TinyLFU，已经缓存的文件 touch 一次（TempFs.record）
+        未命中时按 TempFs.admit 判断是否缓存，缓存后加入策略（TempFs.allocate）
+        超过高水位时由策略选出文件淘汰到低水位（后台淘汰线程）
+
+    :return: (命中率, 字节命中率)
+    """
+    policy = policy_class(capacity)
+    admission = TinyLFU()
+    high = capacity * HIGH_WATERMARK
+    low = capacity * LOW_WATERMARK
+    cached = {}  # key -> 大小
+    used = hits = hit_bytes = total_bytes = 0
+    for key, size in trace:
+        total_bytes += size
+        admission.record(key)
+        if key in cached:
+            hits += 1
+            hit_bytes += size
+            policy.touch(key)
+            continue
+        if used + size > high and (size > high or not admission.admit(key, policy.victim())):
+            continue
+        cached[key] = size
+        used += size
+        policy.touch(key, size)
+        if used > high:
+            while used > low:
+                used -= cached.pop(policy.pop())
+    return hits / len(trace), hit_bytes / total_bytes
+
+
+def main():
+    trace = load_trace(sys.argv[1]) if len(sys.argv) > 1 else synthetic_trace()
+    capacity = int(sys.argv[2]) * MB if len(sys.argv) > 2 else 1024 * MB
+    print(f'{len(trace)} requests, cache {capacity // MB} MB')
+    print(f'{"policy":>8s} {"hit ratio":>10s} {"byte hit ratio":>15s}')
+    for name, policy_class in POLICIES.items():
+        hit_ratio, byte_hit_ratio = replay(policy_class, trace, capacity)
+        print(f'{name:>8s} {hit_ratio:>10.2%} {byte_hit_ratio:>15.2%}')
+
+
+if __name__ == '__main__':
+    main()
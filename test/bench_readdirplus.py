@@ -0,0 +1,103 @@
+"""
+readdirplus 基准测试
+
+在本地磁盘驱动上创建一个有大量子项的目录，模拟系统打开目录时拿到所有子项属性的过程：
+    只返回名称（原来的 readdir）：readdir 之后每个子项都要再调用一次 getattr
+    readdirplus：直接使用 readdir 返回的属性，只有属性不完整的子项才调用 getattr
+readdirplus 返回的属性会和 getattr 的结果逐项比较（不计入耗时），不一致的子项计为错误
+
+使用临时目录中单独的 inode 表，不会写入 cache/inode-table
+
+用法: python test/bench_readdirplus.py [子项数量，默认 10000]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diskcache import Cache
+from easydict import EasyDict
+
+from internal import cloud_fs
+from internal.driver import drivers_obj
+from internal.dir_info import DirInfoManager
+from internal.inode import InodeTable
+from internal.cloud_fs import CloudFS
+from internal.scheduler import FOREGROUND
+from drivers.local_disk import Driver
+
+NAME = 'bench-readdirplus'
+PATH = '/big'
+STAT_KEYS = ('st_mode', 'st_nlink', 'st_size', 'st_mtime', 'st_ctime')  # 内核建立 inode 需要的属性
+
+
+def names_only(fs, path):
+    """
+    只使用 readdir 返回的名称，每个子项再调用 getattr
+
+    :return: {名称: 属性}
+    """
+    names = [item[0] if isinstance(item, tuple) else item for item in fs.readdir(path, 0)]
+    return {name: fs.getattr(f'{path}/{name}') for name in names if name not in ('.', '..')}
+
+
+def readdirplus(fs, path):
+    """
+    使用 readdir 返回的属性，属性缺失或不完整时再调用 getattr
+
+    :return: ({名称: 属性}, getattr 调用次数)
+    """
+    attrs = {}
+    calls = 0
+    for item in fs.readdir(path, 0):
+        name, attr, _ = item if isinstance(item, tuple) else (item, None, 0)
+        if name in ('.', '..'):
+            continue
+        if attr is None or any(key not in attr for key in STAT_KEYS):
+            attr = fs.getattr(f'{path}/{name}')
+            calls += 1
+        attrs[name] = attr
+    return attrs, calls
+
+
+def main(count):
+    root = tempfile.mkdtemp()
+    buffer = Cache(os.path.join(root, 'inode-table'))
+    try:
+        # 子项使用文件夹，文件会生成快捷方式，创建快捷方式的耗时与本测试无关
+        for i in range(count):
+            os.makedirs(os.path.join(root, 'disk', PATH.lstrip('/'), f'd{i:06d}'))
+
+        drivers_obj[NAME] = Driver(EasyDict(root_path=os.path.join(root, 'disk')))
+        manager = DirInfoManager(InodeTable(), buffer)
+        cloud_fs.dirInfoManager = manager  # CloudFS 使用单独的 inode 表
+        fs = CloudFS.__new__(CloudFS)  # 不导入目录树、不启动同步
+        fs.name = NAME
+
+        # 先完整读取一次目录，两种方式都在同样的缓存状态下比较
+        manager.readDirAsync(NAME, PATH, 1, FOREGROUND)
+        manager.waitDir(NAME, PATH)
+
+        start = time.perf_counter()
+        expected = names_only(fs, PATH)
+        elapsed = time.perf_counter() - start
+        print(f'{"names only":12s} entries={len(expected)} getattr={len(expected)} time={elapsed * 1000:.1f}ms')
+
+        start = time.perf_counter()
+        attrs, calls = readdirplus(fs, PATH)
+        elapsed = time.perf_counter() - start
+        wrong = sum(1 for name, attr in attrs.items()
+                    if any(attr[key] != expected[name][key] for key in STAT_KEYS))
+        print(f'{"readdirplus":12s} entries={len(attrs)} getattr={calls} time={elapsed * 1000:.1f}ms '
+              f'mismatched={wrong + len(expected.keys() ^ attrs.keys())}')
+    finally:
+        drivers_obj.pop(NAME, None)
+        buffer.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,94 @@
+"""
+TempFs 访问记录基准测试
+
+测量打开已缓存文件时 TempFs.record 的耗时（生成 key、准入统计、元信息查找、淘汰策略和访问日志），
+以及其中 _touch 本身（淘汰策略 + 合并访问日志）的耗时，另外测量重启时从访问日志回放重建淘汰策略的耗时
+元信息和访问日志使用临时目录中的 diskcache，与实际运行时相同
+
+用法: python test/bench_temp_fs_lru.py [淘汰策略，默认全部]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diskcache import Cache
+
+from internal.cache_policy import POLICIES
+from internal.temp_fs import TempFs, LOG_CHUNK
+from internal.write_behind import WriteBehind
+
+NAME = 'bench'
+SIZES = (1_000, 10_000, 100_000)
+ACCESSES = 20_000  # 每种数量下随机访问的次数
+
+
+def populate(root, size):
+    """
+    生成 size 个缓存文件的元信息，并按压缩后的格式写入访问日志
+    """
+    meta = Cache(os.path.join(root, 'meta'))
+    log = Cache(os.path.join(root, 'log'))
+    keys = [TempFs.generate_key(NAME, uid) for uid in range(size)]
+    with meta.transact():
+        for i, key in enumerate(keys):
+            meta[key] = {'path': os.path.join(root, key), 'size': 1024, 'used': 1024, 'time': i}
+        meta['size'] = 1024 * size
+    with log.transact():
+        for seq, i in enumerate(range(0, size, LOG_CHUNK), 1):
+            log[seq] = tuple(keys[i:i + LOG_CHUNK])
+    meta.close()
+    log.close()
+
+
+def open_temp_fs(root, policy):
+    temp_fs = TempFs(root=os.path.join(root, 'files'), max_size=1 << 40,
+                     meta=Cache(os.path.join(root, 'meta')), log=WriteBehind(Cache(os.path.join(root, 'log'))))
+    temp_fs.weight  # 等待后台线程按配置的策略重建完成
+    temp_fs.policy = policy
+    temp_fs._weight = None  # 按指定的策略重新回放
+    return temp_fs
+
+
+def bench(policy, size):
+    with tempfile.TemporaryDirectory() as root:
+        populate(root, size)
+        temp_fs = open_temp_fs(root, policy)
+
+        start = time.perf_counter()
+        temp_fs.weight  # 回放访问日志
+        replay = time.perf_counter() - start
+
+        uids = [random.randrange(size) for _ in range(ACCESSES)]
+        start = time.perf_counter()
+        for uid in uids:
+            temp_fs.record(NAME, uid)
+        record = time.perf_counter() - start
+
+        keys = [TempFs.generate_key(NAME, uid) for uid in uids]
+        start = time.perf_counter()
+        for key in keys:
+            temp_fs._touch(key)
+        touch = time.perf_counter() - start
+
+        temp_fs.close()
+        temp_fs.log.close()
+        temp_fs.log.cache.close()
+        temp_fs.meta.close()
+    return replay * 1e3, record / ACCESSES * 1e6, touch / ACCESSES * 1e6
+
+
+def main():
+    policies = [sys.argv[1].lower()] if len(sys.argv) > 1 else list(POLICIES)
+    print(f'{"policy":>6s} {"entries":>10s} {"replay ms":>10s} {"record us/op":>13s} {"touch us/op":>12s}')
+    for name in policies:
+        for size in SIZES:
+            replay, record, touch = bench(POLICIES[name], size)
+            print(f'{name:>6s} {size:>10d} {replay:>10.1f} {record:>13.2f} {touch:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
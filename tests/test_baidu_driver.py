@@ -0,0 +1,65 @@
+from easydict import EasyDict
+
+from drivers.baidu_netdisk import Driver
+
+
+class FakeApi:
+    """ 按 cursor 分页返回递归列表，记录每次请求的参数 """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+        self.searched = []
+
+    def listall(self, **kwargs):
+        self.calls.append(kwargs)
+        index = [page['cursor_in'] for page in self.pages].index(kwargs['start'])
+        page = self.pages[index]
+        return EasyDict({'list': page['list'], 'has_more': page['has_more'], 'cursor': page['cursor']})
+
+    def path_to_fsid(self, path):
+        self.searched.append(path)
+        return 99
+
+    def download(self, fsid, start, end):
+        return fsid, start, end
+
+
+def entry(path, isdir=0, fs_id=1):
+    return EasyDict({'server_filename': path.rsplit('/', 1)[1], 'path': path, 'isdir': isdir,
+                     'size': 0 if isdir else 10, 'server_mtime': 1, 'fs_id': fs_id})
+
+
+def make_driver(pages):
+    driver = Driver.__new__(Driver)
+    driver.api = FakeApi(pages)
+    return driver
+
+
+def test_listall_pages_follows_cursor():
+    driver = make_driver([
+        {'cursor_in': 0, 'list': [entry('/a', 1), entry('/a/x.txt')], 'has_more': 1, 'cursor': 1000},
+        {'cursor_in': 1000, 'list': [entry('/a/y.txt')], 'has_more': 1, 'cursor': 1500},
+        {'cursor_in': 1500, 'list': [entry('/b.txt')], 'has_more': 0, 'cursor': 1501},
+    ])
+    pages = list(driver.listall_pages('/'))
+
+    assert [[item.path for item in page] for page in pages] == [['/a', '/a/x.txt'], ['/a/y.txt'], ['/b.txt']]
+    assert [call['start'] for call in driver.api.calls] == [0, 1000, 1500]
+    assert all(call['recursion'] == 1 and call['path'] == '/' for call in driver.api.calls)
+    assert pages[0][0].info.isdir and not pages[0][1].info.isdir
+    assert [item.info.fs_id for page in pages for item in page] == [1, 1, 1, 1]
+
+
+def test_listall_pages_stops_without_list():
+    driver = make_driver([])
+    driver.api.listall = lambda **kwargs: EasyDict({'errno': 31066})
+    assert list(driver.listall_pages('/missing')) == []
+
+
+def test_download_uses_recorded_fs_id():
+    driver = make_driver([])
+    assert driver.download('/a.txt', 0, 10, {'fs_id': 5, 'md5': 'm'}) == (5, 0, 10)
+    assert driver.api.searched == []  # 目录列表记录过 fs_id 时不需要 search
+    assert driver.download('/b.txt', 0, 10) == (99, 0, 10)
+    assert driver.api.searched == ['/b.txt']
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from drivers.baidu_netdisk.resolver import BatchResolver
+
+
+class SlowFetch:
+    """ 记录每次请求的 fsid，第一次请求等待 release 后才返回 """
+
+    def __init__(self, missing=()):
+        self.calls = []
+        self.missing = set(missing)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, fsids):
+        self.calls.append(list(fsids))
+        if len(self.calls) == 1:
+            self.started.set()
+            self.release.wait(5)
+        return {fsid: {'fs_id': fsid} for fsid in fsids if fsid not in self.missing}
+
+
+def test_single_lookup_is_sent_immediately():
+    fetch = SlowFetch()
+    fetch.release.set()
+    resolver = BatchResolver(fetch, window=10)
+    start = time.monotonic()
+    assert resolver.get(1, timeout=1) == {'fs_id': 1}
+    assert time.monotonic() - start < 1
+    assert fetch.calls == [[1]]
+
+
+def test_lookups_during_a_request_are_batched():
+    fetch = SlowFetch()
+    resolver = BatchResolver(fetch, window=0.05)
+    first = threading.Thread(target=resolver.get, args=(1,))
+    first.start()
+    assert fetch.started.wait(1)
+
+    futures = {fsid: resolver.submit(fsid) for fsid in (2, 3, 4)}
+    fetch.release.set()
+    assert {fsid: future.result(1) for fsid, future in futures.items()} == {
+        2: {'fs_id': 2}, 3: {'fs_id': 3}, 4: {'fs_id': 4}}
+    first.join(1)
+    assert fetch.calls == [[1], [2, 3, 4]]
+
+
+def test_lookup_joins_inflight_request():
+    fetch = SlowFetch()
+    resolver = BatchResolver(fetch)
+    first = threading.Thread(target=resolver.get, args=(1,))
+    first.start()
+    assert fetch.started.wait(1)
+
+    joined = resolver.submit(1)
+    fetch.release.set()
+    assert joined.result(1) == {'fs_id': 1}
+    first.join(1)
+    assert fetch.calls == [[1]]
+
+
+def test_results_are_split_by_fs_id():
+    fetch = SlowFetch(missing={3})
+    resolver = BatchResolver(fetch, window=0.05, limit=2)
+    first = threading.Thread(target=resolver.get, args=(0,))
+    first.start()
+    assert fetch.started.wait(1)
+
+    futures = {fsid: resolver.submit(fsid) for fsid in (1, 2, 3)}
+    fetch.release.set()
+    assert futures[1].result(1) == {'fs_id': 1}
+    assert futures[2].result(1) == {'fs_id': 2}
+    with pytest.raises(KeyError):
+        futures[3].result(1)
+    first.join(1)
+    # 凑满 limit 的一批立即发送，剩下的在等待窗口后发送
+    assert fetch.calls == [[0], [1, 2], [3]]
+
+
+def test_failed_request_fails_every_caller():
+    def fetch(fsids):
+        raise IOError('boom')
+
+    resolver = BatchResolver(fetch)
+    with pytest.raises(IOError):
+        resolver.get(1, timeout=1)
+    assert not resolver.inflight and not resolver.sending
@@ -0,0 +1,214 @@
+import threading
+import time
+
+import pytest
+from diskcache import Cache
+from easydict import EasyDict
+
+from drivers.local_disk import Driver
+from internal import block_reader as block_reader_module
+from internal.block_reader import BlockBitmap, BlockReader
+from internal.driver import drivers_obj
+from internal.inode import InodeTable
+from internal.single_flight import Flight, singleFlight
+from internal.temp_fs import TempFs
+from internal.write_behind import WriteBehind
+
+NAME = 'test-block-reader'
+BLOCK = 4
+DATA = bytes(range(64))
+
+
+class CountingDriver(Driver):
+    """ 记录每次下载的范围，可以设置延迟和下载失败 """
+
+    def __init__(self, root):
+        super().__init__(EasyDict(root_path=root))
+        self.calls = []
+        self.lock = threading.Lock()
+        self.delay = 0
+        self.fail = False
+        self.extra = None
+
+    def download(self, path, start, end, extra=None):
+        with self.lock:
+            self.calls.append((start, end))
+            self.extra = extra
+        time.sleep(self.delay)
+        if self.fail:
+            raise IOError('download failed')
+        return super().download(path, start, end)
+
+    def blocks(self):
+        """ 每次下载覆盖的块 """
+        return [index for start, end in self.calls for index in range(start // BLOCK, (end + BLOCK - 1) // BLOCK)]
+
+
+@pytest.fixture
+def temp_fs(tmp_path):
+    temp_fs = TempFs(root=str(tmp_path / 'temp'), max_size=1 << 20,
+                     meta=Cache(str(tmp_path / 'meta')), log=WriteBehind(Cache(str(tmp_path / 'log'))))
+    yield temp_fs
+    temp_fs.close()
+    temp_fs.log.close()
+
+
+@pytest.fixture
+def driver(tmp_path):
+    (tmp_path / 'disk').mkdir()
+    (tmp_path / 'disk' / 'file.bin').write_bytes(DATA)
+    (tmp_path / 'disk' / 'short.bin').write_bytes(DATA[:10])
+    driver = drivers_obj[NAME] = CountingDriver(str(tmp_path / 'disk'))
+    yield driver
+    drivers_obj.pop(NAME, None)
+
+
+@pytest.fixture
+def inodes():
+    inodes = InodeTable()
+    for path, size in (('/file.bin', len(DATA)), ('/short.bin', 10)):
+        inodes.set_attr(NAME, path, {'st_size': size}, shown=True, extra={'fs_id': size})
+    return inodes
+
+
+@pytest.fixture
+def reader(temp_fs, inodes, driver):
+    reader = BlockReader(temp_fs, inodes)
+    reader.block_size = BLOCK
+    reader.wait_timeout = 5
+    return reader
+
+
+def test_bitmap_missing_runs():
+    bitmap = BlockBitmap(10)
+    for index in (2, 3, 7):
+        bitmap.set(index)
+    bitmap.set(7)
+    assert bitmap.filled == 3
+    assert bitmap.missing(0, 9) == [(0, 2), (4, 7), (8, 10)]
+    assert BlockBitmap(10, bitmap.bits).filled == 3
+    assert BlockBitmap.full_of(10).full() and BlockBitmap.full_of(10).missing(0, 9) == []
+
+
+def test_flight_claim_skips_pending_blocks():
+    flight = Flight((NAME, 'uid'))
+    bitmap = BlockBitmap(8)
+    bitmap.set(0)
+    with flight.lock:
+        first, waiting = flight.claim(bitmap, 0, 3)
+    assert [(start, end) for start, end, _ in first] == [(1, 4)] and not waiting
+
+    with flight.lock:
+        second, waiting = flight.claim(bitmap, 2, 6)
+    assert [(start, end) for start, end, _ in second] == [(4, 7)]
+    assert waiting == {first[0][2]}
+
+    flight.release(*first[0])
+    assert first[0][2].is_set()
+    assert sorted(flight.pending) == [4, 5, 6]
+
+
+def test_concurrent_overlapping_reads_download_each_block_once(reader, driver):
+    driver.delay = 0.05
+    results = {}
+
+    def read(offset):
+        results[offset] = reader.read(NAME, '/file.bin', len(DATA), 16, offset)
+
+    threads = [threading.Thread(target=read, args=(offset,)) for offset in range(0, 48, 6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {offset: DATA[offset:offset + 16] for offset in range(0, 48, 6)}
+    blocks = driver.blocks()
+    assert len(blocks) == len(set(blocks))
+    assert not singleFlight.flights
+
+
+def test_partial_block_at_end_of_file(reader, driver):
+    assert reader.read(NAME, '/short.bin', 10, 100, 9) == DATA[9:10]
+    assert driver.calls == [(8, 10)]
+    assert driver.extra == {'fs_id': 10}  # 驱动附加的字段从 inode 表传给驱动
+    assert reader.read(NAME, '/short.bin', 10, 4, 10) == b''
+    assert reader.read(NAME, '/short.bin', 10, 100, 0) == DATA[:10]
+    assert driver.calls == [(8, 10), (0, 8)]
+
+
+def test_bitmap_is_persisted_and_reloaded(reader, temp_fs, inodes, driver):
+    uid = reader.file_id(NAME, '/file.bin')
+    assert reader.read(NAME, '/file.bin', len(DATA), 4, 8) == DATA[8:12]
+    block_size, bits = temp_fs.get_blocks(NAME, uid)
+    assert block_size == BLOCK and BlockBitmap(16, bits).missing(0, 15) == [(0, 2), (3, 16)]
+
+    restarted = BlockReader(temp_fs, inodes)  # 新的读取状态从元信息恢复位图
+    restarted.block_size = BLOCK
+    assert restarted.read(NAME, '/file.bin', len(DATA), 4, 8) == DATA[8:12]
+    assert driver.calls == [(8, 12)]
+
+    assert restarted.read(NAME, '/file.bin', len(DATA), len(DATA), 0) == DATA
+    assert temp_fs.get_blocks(NAME, uid) is None  # 完整的文件不再保存位图
+    assert temp_fs.meta[temp_fs.generate_key(NAME, uid)]['used'] == len(DATA)
+
+
+def test_download_error_releases_claimed_runs(reader, driver):
+    driver.fail = True
+    with pytest.raises(IOError):
+        reader.read(NAME, '/file.bin', len(DATA), 8, 0)
+    assert not singleFlight.flights  # 认领的块已经释放
+
+    driver.fail = False
+    assert reader.read(NAME, '/file.bin', len(DATA), 8, 0) == DATA[:8]
+
+
+def test_dropped_file_forgets_entry(reader, temp_fs):
+    uid = reader.file_id(NAME, '/file.bin')
+    reader.read(NAME, '/file.bin', len(DATA), 4, 0)
+    assert reader.entries
+    temp_fs.remove(NAME, uid)
+    assert not reader.entries
+
+
+def test_bypass_downloads_each_chunk_once(reader, temp_fs, driver, monkeypatch):
+    monkeypatch.setattr(block_reader_module, 'BYPASS_CHUNK', 16)
+    monkeypatch.setattr(temp_fs, 'admit', lambda *args: False)
+    driver.delay = 0.05
+    results = {}
+
+    def read(offset):
+        results[offset] = reader.read(NAME, '/file.bin', len(DATA), 8, offset)
+
+    threads = [threading.Thread(target=read, args=(offset,)) for offset in range(4, 40, 4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {offset: DATA[offset:offset + 8] for offset in range(4, 40, 4)}
+    assert sorted(driver.calls) == [(0, 16), (16, 32), (32, 48)]
+    assert not temp_fs.has(NAME, reader.file_id(NAME, '/file.bin'))
+    assert not singleFlight.flights
+
+
+def test_full_cache_of_pinned_files_falls_back_to_bypass(reader, temp_fs, driver, monkeypatch):
+    monkeypatch.setattr(temp_fs, 'admit', lambda *args: True)
+    temp_fs.pin(NAME, 'other')  # 缓存已满，唯一的文件正在读取
+    temp_fs.allocate(NAME, 'other', 1 << 20)
+    assert reader.read(NAME, '/file.bin', len(DATA), 8, 4) == DATA[4:12]
+    assert reader.fetch(NAME, '/file.bin', len(DATA), 0, 8) is None
+    assert temp_fs.has(NAME, 'other')
+    assert not singleFlight.flights
+    temp_fs.unpin(NAME, 'other')
+
+
+def test_prefetch_bypassed_file_into_memory(reader, temp_fs, driver, monkeypatch):
+    monkeypatch.setattr(block_reader_module, 'BYPASS_CHUNK', 16)
+    monkeypatch.setattr(temp_fs, 'admit', lambda *args: False)
+    assert not reader.prefetch(NAME, '/file.bin', len(DATA), 4, 40)
+    assert sorted(driver.calls) == [(0, 16), (16, 32), (32, 48)]
+    assert reader.read(NAME, '/file.bin', len(DATA), 20, 10) == DATA[10:30]
+    assert len(driver.calls) == 3  # 读取直接使用预读的段
+
+    monkeypatch.setattr(temp_fs, 'admit', lambda *args: True)
+    assert reader.prefetch(NAME, '/short.bin', 10, 0, 10)
@@ -0,0 +1,187 @@
+import pytest
+
+from internal.cache_policy import (POLICIES, LRUPolicy, LFUPolicy, ARCPolicy, GDSFPolicy, CountMinSketch, TinyLFU,
+                                   get_policy)
+
+MB = 1024 * 1024
+
+
+def drain(policy):
+    """ 按淘汰顺序取出所有 key """
+    keys = []
+    while len(policy):
+        keys.append(policy.pop())
+    return keys
+
+
+@pytest.mark.parametrize('policy_class', POLICIES.values())
+def test_empty_pop_and_unknown_remove(policy_class):
+    policy = policy_class(100 * MB)
+    with pytest.raises(KeyError):
+        policy.pop()
+    policy.remove('missing')
+    policy.resize('missing', 10)
+    assert len(policy) == 0
+
+
+@pytest.mark.parametrize('policy_class', POLICIES.values())
+def test_removed_key_is_not_evicted(policy_class):
+    policy = policy_class(100 * MB)
+    for key in 'abc':
+        policy.touch(key, MB)
+    policy.remove('b')
+    assert sorted(drain(policy)) == ['a', 'c']
+
+
+@pytest.mark.parametrize('policy_class', POLICIES.values())
+def test_resize_is_not_an_access(policy_class):
+    policy = policy_class(100 * MB)
+    policy.touch('a', MB)
+    policy.touch('b', MB)
+    policy.resize('a', MB)
+    assert drain(policy) == ['a', 'b']
+
+
+@pytest.mark.parametrize('policy_class', POLICIES.values())
+def test_unpop_restores_position_without_access(policy_class):
+    def build():
+        policy = policy_class(100 * MB)
+        for key, size in (('a', MB), ('b', 2 * MB), ('c', MB), ('d', MB)):
+            policy.touch(key, size)
+        policy.touch('c')
+        return policy
+
+    expected = drain(build())
+    policy = build()
+    popped = [policy.pop_entry() for _ in range(2)]
+    assert [key for key, _ in popped] == expected[:2]
+    assert expected[0] not in policy
+    for key, state in reversed(popped):  # 例如正在读取的文件不淘汰
+        policy.unpop(key, state)
+    assert expected[0] in policy
+    assert drain(policy) == expected
+
+
+def test_lru_evicts_least_recently_used():
+    policy = LRUPolicy(100 * MB)
+    for key in 'abc':
+        policy.touch(key)
+    policy.touch('a')
+    assert list(policy) == ['b', 'c', 'a']
+    assert drain(policy) == ['b', 'c', 'a']
+
+
+def test_lfu_evicts_least_frequently_used_then_oldest():
+    policy = LFUPolicy(100 * MB)
+    for key in 'abcd':
+        policy.touch(key)
+    policy.touch('a')
+    policy.touch('a')
+    policy.touch('c')
+    assert drain(policy) == ['b', 'd', 'c', 'a']
+
+
+def test_arc_keeps_documents_during_video_scan():
+    policy = ARCPolicy(100 * MB)
+    for doc in ('doc1', 'doc2'):
+        policy.touch(doc, MB)
+        policy.touch(doc)  # 打开过两次的文档进入 T2
+    for i in range(3):
+        policy.touch(f'video{i}', 30 * MB)  # 只播放一次的视频留在 T1
+    assert [policy.pop() for _ in range(3)] == ['video0', 'video1', 'video2']
+    assert set(policy.t2) == {'doc1', 'doc2'}
+
+
+def test_arc_ghost_hit_grows_recency_target():
+    policy = ARCPolicy(100 * MB)
+    policy.touch('a', 10 * MB)
+    policy.touch('b', 10 * MB)
+    policy.touch('b')
+    assert policy.pop() == 'a'
+    assert 'a' in policy.b1 and policy.p == 0
+    policy.touch('a')  # 命中 B1，说明 T1 太小
+    assert policy.p > 0
+    assert policy.t2['a'] == 10 * MB
+
+
+def test_arc_resize_updates_list_size():
+    policy = ARCPolicy(100 * MB)
+    policy.touch('a', 0)
+    policy.resize('a', 5 * MB)
+    assert policy.t1_size == 5 * MB and 'a' in policy.t1
+
+
+def test_gdsf_evicts_large_files_first():
+    policy = GDSFPolicy(100 * MB)
+    policy.touch('video', 50 * MB)
+    policy.touch('doc', MB)
+    assert policy.pop() == 'video'
+
+
+def test_gdsf_frequency_outweighs_recency():
+    policy = GDSFPolicy(100 * MB)
+    policy.touch('a', MB)
+    policy.touch('a')
+    policy.touch('b', MB)
+    assert drain(policy) == ['b', 'a']
+
+
+def test_gdsf_resize_keeps_access_count():
+    policy = GDSFPolicy(100 * MB)
+    policy.touch('a', 0)
+    policy.resize('a', 2 * MB)
+    assert policy.entries['a'][1:] == [1, 2 * MB]
+    assert policy.pop() == 'a'
+
+
+def test_get_policy():
+    assert get_policy('ARC') is ARCPolicy
+    with pytest.raises(ValueError):
+        get_policy('fifo')
+
+
+def test_sketch_never_underestimates():
+    sketch = CountMinSketch(256)  # 总次数不到 10 * width，不会减半
+    counts = {f'key{i}': i % 7 + 1 for i in range(200)}
+    for key, count in counts.items():
+        for _ in range(count):
+            sketch.add(key)
+    assert all(sketch.estimate(key) >= count for key, count in counts.items())
+
+
+def test_sketch_saturates_and_halves():
+    sketch = CountMinSketch(16)
+    assert sketch.width == 16
+    for _ in range(20):
+        sketch.add('hot')
+    assert sketch.estimate('hot') == 15  # 计数器最多到 15
+    for i in range(sketch.sample):
+        sketch.add(f'cold{i}')
+    assert sketch.estimate('hot') < 15  # 累计增加 10 * width 次后减半
+    assert sketch.additions < sketch.sample
+
+
+def test_tiny_lfu_admits_only_more_frequent_than_victim():
+    admission = TinyLFU(4096)
+    assert admission.admit('doc', None)  # 没有可以淘汰的文件
+    admission.record('cached')
+    admission.record('cached')
+    admission.record('doc')
+    assert not admission.admit('doc', 'cached')
+    admission.record('doc')
+    assert not admission.admit('doc', 'cached')  # 次数相同时保留已经缓存的文件
+    admission.record('doc')
+    assert admission.admit('doc', 'cached')
+    assert not admission.admit('scan', 'cached')
+
+
+@pytest.mark.parametrize('policy_class', POLICIES.values())
+def test_victim_is_next_pop_and_not_removed(policy_class):
+    policy = policy_class(100 * MB)
+    assert policy.victim() is None
+    for key in 'abc':
+        policy.touch(key, MB)
+    policy.touch('a')
+    victim = policy.victim()
+    assert victim in policy and len(policy) == 3
+    assert policy.pop() == victim
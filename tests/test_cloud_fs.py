@@ -0,0 +1,148 @@
+import errno
+
+import pytest
+from diskcache import Cache
+from easydict import EasyDict
+from fuse import FuseOSError
+
+from drivers.local_disk import Driver
+from internal import cloud_fs as cloud_fs_module
+from internal.cloud_fs import CloudFS
+from internal.dir_info import DirInfoManager
+from internal.driver import drivers_obj
+from internal.inode import InodeTable
+from internal.negative_cache import negativeCache
+
+NAME = 'test-cloud-fs'
+
+
+class FlakyDriver(Driver):
+    """ 指定的操作返回失败或者抛出异常 """
+
+    def __init__(self, root):
+        super().__init__(EasyDict(root_path=root))
+        self.fail = {}  # 操作名称 -> 'false' / 'raise'
+        self.calls = []
+
+    def _call(self, action, *args):
+        self.calls.append((action,) + args)
+        mode = self.fail.get(action)
+        if mode == 'raise':
+            raise IOError(f'{action} failed')
+        if mode == 'false':
+            return False
+        return getattr(super(), action)(*args)
+
+    def move(self, filePath, destPath):
+        return self._call('move', filePath, destPath)
+
+    def rename(self, filePath, newName):
+        return self._call('rename', filePath, newName)
+
+    def delete(self, filePath):
+        return self._call('delete', filePath)
+
+
+@pytest.fixture
+def driver(tmp_path):
+    (tmp_path / 'disk' / 'a').mkdir(parents=True)
+    (tmp_path / 'disk' / 'b').mkdir()
+    (tmp_path / 'disk' / 'a' / 'x.txt').write_bytes(b'x')
+    driver = drivers_obj[NAME] = FlakyDriver(str(tmp_path / 'disk'))
+    yield driver
+    drivers_obj.pop(NAME, None)
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    with Cache(str(tmp_path / 'inode-table')) as buffer:
+        manager = DirInfoManager(InodeTable(), buffer)
+        for path, isdir in (('/a', True), ('/b', True), ('/a/x.txt', False)):
+            manager.add_file_attr(NAME, path, {'isdir': isdir, 'size': 1, 'mtime': 1, 'ctime': 1}, shown=True)
+        monkeypatch.setattr(cloud_fs_module, 'dirInfoManager', manager)
+        yield manager
+
+
+@pytest.fixture
+def fs(driver, manager):
+    fs = CloudFS.__new__(CloudFS)
+    fs.name = NAME
+    return fs
+
+
+def test_rename_moves_then_renames(fs, driver, manager, tmp_path):
+    fs.rename('/a/x.txt', '/b/y.txt')
+    assert [call[0] for call in driver.calls] == ['move', 'rename']
+    assert (tmp_path / 'disk' / 'b' / 'y.txt').exists()
+    assert manager.inodes.lookup(NAME, '/a/x.txt') is None
+    assert manager.get_attr(NAME, '/b/y.txt') is not None
+
+
+def test_failed_rename_undoes_move(fs, driver, manager, tmp_path):
+    driver.fail['rename'] = 'false'
+    with pytest.raises(FuseOSError) as error:
+        fs.rename('/a/x.txt', '/b/y.txt')
+    assert error.value.errno == errno.EIO
+    assert driver.calls[-1] == ('move', '/b/x.txt', '/a')  # 撤销已经完成的移动
+    assert (tmp_path / 'disk' / 'a' / 'x.txt').exists()
+    assert manager.get_attr(NAME, '/a/x.txt') is not None
+    assert manager.inodes.lookup(NAME, '/b/y.txt') is None
+
+
+def test_failed_undo_follows_cloud_state(fs, driver, manager):
+    driver.fail['rename'] = 'raise'
+    moves = []
+
+    def move(filePath, destPath):
+        moves.append(filePath)
+        return len(moves) == 1 and Driver.move(driver, filePath, destPath)  # 第一次移动成功，撤销时失败
+
+    driver.move = move
+    with pytest.raises(FuseOSError):
+        fs.rename('/a/x.txt', '/b/y.txt')
+    assert moves == ['/a/x.txt', '/b/x.txt']
+    assert manager.inodes.lookup(NAME, '/a/x.txt') is None
+    assert manager.get_attr(NAME, '/b/x.txt') is not None  # 文件实际所在的位置
+
+
+def test_failed_move_keeps_cache(fs, driver, manager):
+    driver.fail['move'] = 'raise'
+    with pytest.raises(FuseOSError):
+        fs.rename('/a/x.txt', '/b/x.txt')
+    assert [call[0] for call in driver.calls] == ['move']
+    assert manager.get_attr(NAME, '/a/x.txt') is not None
+
+
+@pytest.mark.parametrize('mode', ['false', 'raise'])
+def test_failed_delete_keeps_cache(fs, driver, manager, mode):
+    driver.fail['delete'] = mode
+    with pytest.raises(FuseOSError):
+        fs.unlink('/a/x.txt')
+    with pytest.raises(FuseOSError):
+        fs.rmdir('/b')
+    assert manager.get_attr(NAME, '/a/x.txt') is not None
+    assert manager.get_attr(NAME, '/b') is not None
+
+    driver.fail.clear()
+    fs.unlink('/a/x.txt')
+    fs.rmdir('/b')
+    assert manager.inodes.lookup(NAME, '/a/x.txt') is None
+    assert manager.inodes.lookup(NAME, '/b') is None
+
+
+def test_negative_cache_needs_complete_parent(fs, manager, monkeypatch):
+    reads = []
+    monkeypatch.setattr(manager, 'readDirAsync', lambda *args: reads.append(args[1]))
+    parent = manager.inodes.lookup(NAME, '/a')
+    manager.inodes.set_listed(parent)  # 只读取到第一页
+    with pytest.raises(FuseOSError):
+        fs.getattr('/a/later.txt')
+    assert not negativeCache.has(NAME, '/a/later.txt', parent.generation)  # 可能在之后的分页中
+    assert reads == ['/a']
+
+    manager.inodes.set_listed(parent, complete=True)
+    with pytest.raises(FuseOSError):
+        fs.getattr('/a/later.txt')
+    assert negativeCache.has(NAME, '/a/later.txt', parent.generation)
+    assert reads == ['/a']
+    negativeCache.discard(NAME, '/a/later.txt')
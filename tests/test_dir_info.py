@@ -0,0 +1,283 @@
+import threading
+
+import pytest
+from diskcache import Cache
+from easydict import EasyDict
+
+from internal.driver import drivers_obj
+from internal.dir_info import DirInfoManager
+from internal.inode import InodeTable, STALE
+from internal.scheduler import FOREGROUND, PriorityScheduler, SPECULATIVE
+from internal.temp_fs import tempFs
+
+NAME = 'test-import'
+
+
+def item(path, isdir=False, size=10, **extra):
+    return EasyDict({'name': path.rsplit('/', 1)[1], 'path': path,
+                     'info': {'isdir': isdir, 'size': 0 if isdir else size, 'mtime': 1, 'ctime': 1, **extra}})
+
+
+class ListDriver:
+    """ 按目录返回子项 """
+
+    def __init__(self, items):
+        self.items = items
+
+    def list(self, dir='/'):
+        return [item for item in self.items if item['path'].rsplit('/', 1)[0] == dir.rstrip('/')]
+
+
+class TreeDriver:
+    """ 递归列表按页返回，每返回一页调用一次 on_page """
+
+    def __init__(self, pages, on_page=None):
+        self.pages = pages
+        self.on_page = on_page or (lambda index: None)
+
+    def listall_pages(self, path):
+        for index, page in enumerate(self.pages):
+            yield page
+            self.on_page(index)
+
+
+class GatedDriver(ListDriver):
+    """ 读取目录时等待 gate，记录读取次数，可以设置读取失败 """
+
+    def __init__(self, items):
+        super().__init__(items)
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.calls = 0
+        self.fail = False
+
+    def list(self, dir='/'):
+        self.calls += 1
+        self.started.set()
+        self.gate.wait(5)
+        if self.fail:
+            raise IOError('list failed')
+        return super().list(dir)
+
+
+class PagedDriver:
+    """ 第一页返回后等待 gate 才返回第二页 """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.gate = threading.Event()
+        self.waiting = threading.Event()
+
+    def list_pages(self, path):
+        yield self.pages[0]
+        self.waiting.set()
+        self.gate.wait(5)
+        yield from self.pages[1:]
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    with Cache(str(tmp_path / 'inode-table')) as buffer:
+        manager = DirInfoManager(InodeTable(), buffer)
+        monkeypatch.setattr(manager, 'create_shortcut', lambda *args, **kwargs: pytest.fail('shortcut created'))
+        yield manager
+    drivers_obj.pop(NAME, None)
+
+
+@pytest.fixture
+def shortcuts(manager, monkeypatch):
+    """ 用普通文件代替快捷方式，返回生成过的快捷方式路径 """
+    made = []
+
+    def create_shortcut(target_path, shortcut_path, *args, **kwargs):
+        made.append(shortcut_path)
+        with open(shortcut_path, 'wb') as f:
+            f.write(b'lnk' * 100)
+
+    monkeypatch.setattr(manager, 'create_shortcut', create_shortcut)
+    monkeypatch.setattr(manager, 'get_file_type_description', lambda suffix: '')
+    monkeypatch.setattr(manager, 'get_default_icon', lambda suffix: None)
+    yield made
+    for path in ('/x.txt.lnk', '/d/x.txt.lnk', '/d/y.txt.lnk'):
+        uid = manager.cache_id(NAME, path)
+        if uid is not None and tempFs.has(NAME, uid):
+            tempFs.remove(NAME, uid)
+
+
+def test_import_tree(manager):
+    drivers_obj[NAME] = TreeDriver([
+        [item('/a', isdir=True), item('/a/x.txt')],
+        [item('/a/b', isdir=True), item('/a/b/y.txt', size=20), item('/z.txt')],
+    ])
+    manager.importTree(NAME, '/', 1)
+
+    assert sorted(manager.list_dir(NAME, '/')) == ['a', 'z.txt.lnk']
+    assert sorted(manager.list_dir(NAME, '/a')) == ['b', 'x.txt.lnk']
+    assert manager.list_dir(NAME, '/a/b') == ['y.txt.lnk']
+    # 原文件保留真实大小，快捷方式还没有生成
+    assert manager.get_attr(NAME, '/a/b/y.txt')['st_size'] == 20
+    assert manager.get_attr(NAME, '/a/b/y.txt.lnk')['st_size'] == 0
+    assert not tempFs.has(NAME, manager.cache_id(NAME, '/a/b/y.txt.lnk'))
+
+
+def test_import_does_not_hold_directories(manager):
+    states = []
+
+    def on_page(index):
+        root = manager.inodes.lookup(NAME, '/')
+        states.append((root.listed, manager.inodes.freshness(root, 60), (NAME, '/') in manager.inflight))
+
+    drivers_obj[NAME] = TreeDriver([[item('/a', isdir=True)], [item('/b', isdir=True)]], on_page)
+    manager.importTree(NAME, '/', 1)
+
+    # 导入期间根目录没有标记为已读取，也没有占用读取状态，readdir 会照常读取
+    assert states[0] == (False, STALE, False)
+    assert sorted(manager.list_dir(NAME, '/')) == ['a', 'b']
+
+
+def test_import_prunes_removed_items(manager):
+    drivers_obj[NAME] = TreeDriver([[item('/a', isdir=True), item('/a/b', isdir=True)]])
+    manager.importTree(NAME, '/', 1)
+    drivers_obj[NAME] = TreeDriver([[item('/a', isdir=True)]])
+    manager.importTree(NAME, '/', 1)
+
+    assert manager.list_dir(NAME, '/a') == []
+    assert manager.inodes.lookup(NAME, '/a/b') is None
+
+
+def test_driver_fields_follow_node(manager, tmp_path):
+    drivers_obj[NAME] = TreeDriver([[item('/a', isdir=True), item('/a/x.txt', fs_id=7, md5='m')]])
+    manager.importTree(NAME, '/', 1)
+    inodes = manager.inodes
+    assert inodes.get_extra(NAME, '/a/x.txt') == {'fs_id': 7, 'md5': 'm'}
+    assert inodes.get_extra(NAME, '/a/x.txt.lnk') is None and inodes.get_extra(NAME, '/a') is None
+
+    inodes.move(NAME, '/a', '/b')  # 移动后不需要重新查找
+    assert inodes.get_extra(NAME, '/b/x.txt') == {'fs_id': 7, 'md5': 'm'}
+    drivers_obj[NAME] = TreeDriver([[item('/b', isdir=True), item('/b/x.txt', fs_id=8, md5='m')]])
+    manager.importTree(NAME, '/', 1)  # 属性没有变化，附加字段仍然更新
+    assert inodes.get_extra(NAME, '/b/x.txt')['fs_id'] == 8
+
+    with Cache(str(tmp_path / 'records')) as cache:
+        for _, node in inodes.walk(inodes.roots[NAME], '/'):
+            cache[node.ino] = node.record()
+        cache[10000] = (inodes.roots[NAME].ino, 'old.txt', {'st_size': 1}, True, False)  # 旧版本的记录
+        restarted = InodeTable()
+        restarted.load(cache)
+    assert restarted.get_extra(NAME, '/b/x.txt')['fs_id'] == 8
+    assert restarted.get_extra(NAME, '/old.txt') is None
+
+
+def test_shortcut_created_when_displayed(manager, shortcuts):
+    drivers_obj[NAME] = TreeDriver([[item('/x.txt')]])
+    manager.importTree(NAME, '/', 1)
+
+    attr = manager.ensure_shortcut(NAME, '/x.txt.lnk')
+    assert attr['st_size'] == 300
+    assert manager.get_attr(NAME, '/x.txt.lnk')['st_size'] == 300
+    assert manager.ensure_shortcut(NAME, '/x.txt.lnk') is None  # 已经生成过
+    assert len(shortcuts) == 1
+
+
+def test_evicted_shortcut_is_recreated(manager, shortcuts):
+    drivers_obj[NAME] = ListDriver([item('/d', isdir=True), item('/d/x.txt')])
+    manager.readDir(NAME, '/d', 1)
+    uid = manager.cache_id(NAME, '/d/x.txt.lnk')
+    assert tempFs.has(NAME, uid)
+
+    tempFs.remove(NAME, uid)  # 快捷方式被淘汰
+    manager.inodes.end_revalidate(manager.inodes.lookup(NAME, '/d'), False)
+    manager.readDir(NAME, '/d', 1)
+    assert tempFs.has(NAME, uid)
+    assert manager.list_dir(NAME, '/d') == ['x.txt.lnk']
+    assert len(shortcuts) == 2
+
+
+def test_merge_read_keeps_deeper_request():
+    queued = (NAME, '/a', 1, '/')
+    assert DirInfoManager._merge_read(queued, (NAME, '/a', 4, None)) == (NAME, '/a', 4, None)
+    assert DirInfoManager._merge_read(queued, (NAME, '/a', 0, '/b')) == queued
+
+
+@pytest.fixture
+def pool(manager):
+    manager.pool = PriorityScheduler(4)
+    yield manager.pool
+    manager.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def wait_all(manager, path, count, stream=False):
+    """ 多个线程同时等待目录读取，返回各自的结果 """
+    results = [None] * count
+
+    def wait(index):
+        if stream:
+            results[index] = list(manager.streamDir(NAME, path, timeout=5))
+        else:
+            results[index] = manager.waitDir(NAME, path, timeout=5)
+
+    threads = [threading.Thread(target=wait, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_reads_share_one_listing(manager, shortcuts, pool):
+    driver = drivers_obj[NAME] = GatedDriver([item('/d', isdir=True), item('/d/x.txt'), item('/d/y.txt')])
+    futures = [manager.readDirAsync(NAME, '/d', 1, priority) for priority in (SPECULATIVE, FOREGROUND, SPECULATIVE)]
+    assert driver.started.wait(5)
+    futures.append(manager.readDirAsync(NAME, '/d', 1, FOREGROUND))  # 正在读取时提交
+    assert all(future is futures[0] for future in futures)
+
+    waiters, waited = wait_all(manager, '/d', 3)
+    streams, streamed = wait_all(manager, '/d', 3, stream=True)
+    driver.gate.set()
+    for thread in waiters + streams:
+        thread.join(5)
+
+    assert driver.calls == 1
+    assert waited == [True] * 3
+    assert all(sorted(entries) == ['x.txt.lnk', 'y.txt.lnk'] for entries in streamed)
+    assert not manager.inflight
+
+
+@pytest.mark.parametrize('where', ['driver', 'task'])
+def test_failed_listing_wakes_waiters(manager, shortcuts, pool, monkeypatch, where):
+    driver = drivers_obj[NAME] = GatedDriver([item('/d/x.txt')])
+    driver.fail = True
+    if where == 'task':  # 异常没有被 readDir 捕获，Future 以异常结束
+        def fail(*args):
+            driver.list('/d')
+        monkeypatch.setattr(manager, 'readDir', fail)
+
+    future = manager.readDirAsync(NAME, '/d', 1, FOREGROUND)
+    assert driver.started.wait(5)
+    waiters, waited = wait_all(manager, '/d', 3)
+    streams, streamed = wait_all(manager, '/d', 3, stream=True)
+    driver.gate.set()
+    for thread in waiters + streams:
+        thread.join(2)
+        assert not thread.is_alive()  # 没有等到超时
+
+    assert future.done()
+    assert waited == [True] * 3 and streamed == [[]] * 3
+    assert not manager.inflight
+    assert manager.readDirAsync(NAME, '/d', 1, FOREGROUND) is not future  # 失败的目录可以重新读取
+
+
+def test_stream_waits_for_first_listing_to_complete(manager, pool):
+    dirs = [item(f'/big/d{i}', isdir=True) for i in range(1500)]
+    driver = drivers_obj[NAME] = PagedDriver([dirs[:1000], dirs[1000:]])
+    manager.readDirAsync(NAME, '/big', 1, FOREGROUND)
+    assert driver.waiting.wait(5)  # 第一页已经加入，第二页还没有返回
+    assert manager.inodes.lookup(NAME, '/big').listed and not manager.inodes.is_complete(NAME, '/big')
+
+    streamed = []
+    thread = threading.Thread(target=lambda: streamed.extend(manager.streamDir(NAME, '/big', timeout=3)))
+    thread.start()
+    driver.gate.set()
+    thread.join(5)
+
+    assert len(streamed) == 1500 and len(set(streamed)) == 1500
+    assert manager.inodes.is_complete(NAME, '/big')
+    assert len(list(manager.streamDir(NAME, '/big', timeout=0))) == 1500  # 完整读取过，直接返回
@@ -0,0 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from internal.downloader import Downloader
+from internal.single_flight import singleFlight
+
+NAME = 'test-downloader'
+BLOCK = 4
+
+
+class FakeReader:
+    """ 记录下载的分段，fail 中的分段下载失败，gate 设置前阻塞下载 """
+    block_size = BLOCK
+
+    def __init__(self, fail=()):
+        self.fetched = []
+        self.fail = set(fail)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def file_id(self, name, path):
+        return path
+
+    def fetch(self, name, path, file_size, start, end):
+        self.gate.wait(5)
+        with self.lock:
+            self.fetched.append((start, end))
+        if (start, end) in self.fail:
+            raise IOError(f'{start}-{end} failed')
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolExecutor(4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def make(reader, pool, segment_size=8, connections=1):
+    downloader = Downloader(reader, pool)
+    downloader.segment_size = segment_size
+    downloader.segment_count = 1024
+    downloader.file_connections = connections
+    return downloader
+
+
+def test_split_aligns_and_starts_at_offset(pool):
+    downloader = make(FakeReader(), pool, segment_size=7)
+    assert list(downloader._split(30, 0)) == [(0, 8), (8, 16), (16, 24), (24, 30)]
+    assert list(downloader._split(30, 17)) == [(16, 24), (24, 30), (0, 8), (8, 16)]
+    assert list(downloader._split(30, 100)) == [(24, 30), (0, 8), (8, 16), (16, 24)]
+    assert list(downloader._split(0, 0)) == []
+
+
+def test_split_respects_segment_count(pool):
+    downloader = make(FakeReader(), pool, segment_size=4)
+    downloader.segment_count = 4
+    assert len(downloader._split(100, 0)) == 4
+
+
+def test_segments_are_fetched_in_order(pool):
+    reader = FakeReader()
+    task = make(reader, pool).download(NAME, '/ordered', 32, offset=20)
+    assert task.wait(5) and task.error is None
+    assert reader.fetched == [(16, 24), (24, 32), (0, 8), (8, 16)]
+    assert (NAME, '/ordered') not in singleFlight.flights
+
+
+def test_repeated_download_joins_running_task(pool):
+    reader = FakeReader()
+    reader.gate.clear()
+    downloader = make(reader, pool, connections=2)
+    first = downloader.download(NAME, '/joined', 64)
+    second = downloader.download(NAME, '/joined', 64, offset=40)
+    assert second is first
+    reader.gate.set()
+    assert first.wait(5)
+    assert sorted(reader.fetched) == [(start, start + 8) for start in range(0, 64, 8)]
+
+
+def test_error_stops_task_and_is_reported(pool):
+    reader = FakeReader(fail={(8, 16)})
+    task = make(reader, pool).download(NAME, '/broken', 64)
+    assert task.wait(5)
+    assert isinstance(task.error, IOError)
+    assert reader.fetched == [(0, 8), (8, 16)]  # 出错后不再下载剩余的分段
+    assert (NAME, '/broken') not in singleFlight.flights
+
+
+def test_empty_file_is_done_immediately(pool):
+    task = make(FakeReader(), pool).download(NAME, '/empty', 0)
+    assert task.done.is_set()
+    assert (NAME, '/empty') not in singleFlight.flights
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+from easydict import EasyDict
+
+from drivers.local_disk import Driver
+from drivers.local_disk import driver as local_disk_driver
+
+
+@pytest.fixture
+def driver(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'b' / 'deep.txt').write_bytes(b'0123456789')
+    (tmp_path / 'a' / 'file.txt').write_bytes(b'hello')
+    (tmp_path / 'root.txt').write_bytes(b'')
+    return Driver(EasyDict(root_path=str(tmp_path)))
+
+
+def test_list(driver):
+    result = driver.list(dir='/a')
+    assert [item.path for item in result] == ['/a/b', '/a/file.txt']
+    assert result[0].info.isdir
+    assert result[1].info.size == 5
+
+
+def test_listall_pages(driver):
+    items = [item for page in driver.listall_pages('/') for item in page]
+    assert sorted(item.path for item in items) == ['/a', '/a/b', '/a/b/deep.txt', '/a/file.txt', '/root.txt']
+
+    items = [item for page in driver.listall_pages('/a') for item in page]
+    assert sorted(item.path for item in items) == ['/a/b', '/a/b/deep.txt', '/a/file.txt']
+
+
+def test_listall_pages_limit(driver, tmp_path, monkeypatch):
+    monkeypatch.setattr(local_disk_driver, 'LIST_LIMIT', 2)
+    pages = list(driver.listall_pages('/'))
+    assert [len(page) for page in pages] == [2, 2, 1]
+
+
+def test_download(driver):
+    assert driver.download('/a/b/deep.txt', 2, 5) == b'234'
+
+
+def test_rename_and_delete(driver, tmp_path):
+    assert driver.rename('/a/file.txt', 'renamed.txt')
+    assert os.path.exists(tmp_path / 'a' / 'renamed.txt')
+    assert driver.delete('/a')
+    assert not os.path.exists(tmp_path / 'a')
+
+
+def test_changes(driver, tmp_path):
+    first = driver.changes(None)
+    assert first.reset and first.changes == []
+
+    (tmp_path / 'a' / 'file.txt').write_bytes(b'hello world')
+    (tmp_path / 'root.txt').unlink()
+    (tmp_path / 'new.txt').write_bytes(b'new')
+
+    result = driver.changes(first.cursor)
+    assert not result.reset and not result.has_more
+    changes = {change.path: change for change in result.changes}
+    assert sorted(changes) == ['/a/file.txt', '/new.txt', '/root.txt']
+    assert changes['/root.txt'].deleted
+    assert not changes['/a/file.txt'].deleted and changes['/a/file.txt'].info['size'] == 11
+
+    assert driver.changes(result.cursor).changes == []
@@ -0,0 +1,126 @@
+import pytest
+
+from internal.read_ahead import ReadAhead
+
+NAME = 'test-read-ahead'
+BLOCK = 4096
+MB = 1024 * 1024
+
+
+class FakeReader:
+    block_size = BLOCK
+
+    def __init__(self, cached=True):
+        self.fetched = []
+        self.cached = cached
+
+    def prefetch(self, name, path, file_size, start, end):
+        self.fetched.append((start, end))
+        return self.cached
+
+
+class FakeDownloader:
+    def __init__(self):
+        self.started = []
+
+    def download(self, name, path, file_size, start):
+        self.started.append(start)
+
+
+class QueuePool:
+    """ 只记录提交的预读，由测试决定何时执行 """
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def run(self):
+        tasks, self.tasks = self.tasks, []
+        for fn, args in tasks:
+            fn(*args)
+        return [args[-2:] for _, args in tasks]
+
+
+@pytest.fixture
+def read_ahead():
+    read_ahead = ReadAhead(FakeReader(), FakeDownloader(), QueuePool())
+    read_ahead.max_window = 64 * BLOCK
+    read_ahead.max_inflight = 4
+    return read_ahead
+
+
+def sequential(read_ahead, fh, count, size=BLOCK, file_size=MB, start=0):
+    for i in range(count):
+        read_ahead.on_read(fh, NAME, '/file', file_size, start + i * size, size)
+        read_ahead.pool.run()
+
+
+def test_first_sequential_read_prefetches_ahead(read_ahead):
+    read_ahead.on_read(1, NAME, '/file', MB, 0, BLOCK)
+    state = read_ahead.states[1]
+    assert state.window == 4 * BLOCK
+    assert read_ahead.pool.run() == [(BLOCK, 2 * BLOCK), (2 * BLOCK, 3 * BLOCK),
+                                     (3 * BLOCK, 4 * BLOCK), (4 * BLOCK, 5 * BLOCK)]
+    assert state.inflight == 0 and state.ahead_end == 5 * BLOCK
+    assert read_ahead.reader.fetched
+
+
+def test_window_doubles_up_to_max(read_ahead):
+    windows = []
+    for i in range(64):
+        read_ahead.on_read(1, NAME, '/file', MB, i * BLOCK, BLOCK)
+        read_ahead.pool.run()
+        windows.append(read_ahead.states[1].window)
+    growth = sorted(set(windows))
+    assert growth == [4 * BLOCK, 8 * BLOCK, 16 * BLOCK, 32 * BLOCK, 64 * BLOCK]
+    assert windows == sorted(windows)
+
+
+def test_inflight_is_capped(read_ahead):
+    sequential(read_ahead, 1, 1)
+    read_ahead.on_read(1, NAME, '/file', MB, BLOCK, 3 * BLOCK)  # 预读没有执行完时不超过 max_inflight
+    read_ahead.on_read(1, NAME, '/file', MB, 4 * BLOCK, 4 * BLOCK)
+    assert len(read_ahead.pool.tasks) <= read_ahead.max_inflight
+    assert read_ahead.states[1].inflight == len(read_ahead.pool.tasks)
+
+
+def test_random_read_resets_window(read_ahead):
+    sequential(read_ahead, 1, 8)
+    assert read_ahead.states[1].window > 0
+    read_ahead.on_read(1, NAME, '/file', MB, 200 * BLOCK, BLOCK)
+    state = read_ahead.states[1]
+    assert state.window == 0 and state.ahead_end == 0
+    assert not read_ahead.pool.tasks
+
+    sequential(read_ahead, 1, 1, start=201 * BLOCK)  # 从新位置继续顺序读取时重新开始预读
+    assert state.window == 4 * BLOCK
+
+
+def test_state_is_per_handle_and_released(read_ahead):
+    sequential(read_ahead, 1, 4)
+    read_ahead.on_read(2, NAME, '/file', MB, 100 * BLOCK, BLOCK)  # 另一个句柄的随机读取不影响第一个
+    assert read_ahead.states[1].window > 0 and read_ahead.states[2].window == 0
+
+    read_ahead.release(1)
+    assert 1 not in read_ahead.states and 2 in read_ahead.states
+    read_ahead.release(1)
+
+
+def test_long_sequential_read_starts_segmented_download(read_ahead):
+    sequential(read_ahead, 1, 64)
+    assert read_ahead.downloader.started  # 窗口达到最大值并且剩余部分足够大
+
+    small = ReadAhead(FakeReader(), FakeDownloader(), QueuePool())
+    small.max_window = 64 * BLOCK
+    sequential(small, 1, 64, file_size=80 * BLOCK)
+    assert not small.downloader.started
+
+
+def test_bypassed_file_is_prefetched_without_segmented_download(read_ahead):
+    read_ahead.reader.cached = False  # 没有通过准入的文件
+    sequential(read_ahead, 1, 64)
+    assert read_ahead.states[1].bypass
+    assert read_ahead.reader.fetched[-1][1] > 64 * BLOCK  # 仍然顺序预读
+    assert not read_ahead.downloader.started
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from internal.scheduler import FOREGROUND, PARENT, SPECULATIVE, PriorityScheduler
+
+
+@pytest.fixture
+def scheduler():
+    """ 单线程的调度器，第一个任务阻塞工作线程，之后提交的任务都在排队 """
+    scheduler = PriorityScheduler(1)
+    gate = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        gate.wait(5)
+
+    scheduler.submit('block', FOREGROUND, block)
+    started.wait(5)
+    scheduler.open = gate.set
+    yield scheduler
+    gate.set()
+    scheduler.shutdown(wait=True, cancel_futures=True)
+
+
+def run(scheduler, futures):
+    """ 放开工作线程，等待所有任务结束 """
+    scheduler.open()
+    for future in futures:
+        if not future.cancelled():
+            future.result(5)
+
+
+def test_runs_by_priority_then_submission_order(scheduler):
+    order = []
+    futures = [scheduler.submit(key, priority, order.append, key)
+               for key, priority in (('s1', SPECULATIVE), ('p1', PARENT), ('f1', FOREGROUND), ('s2', SPECULATIVE),
+                                     ('f2', FOREGROUND))]
+    run(scheduler, futures)
+    assert order == ['f1', 'f2', 'p1', 's1', 's2']
+
+
+def test_duplicate_key_shares_future(scheduler):
+    calls = []
+    first = scheduler.submit('a', SPECULATIVE, calls.append, 1)
+    second = scheduler.submit('a', SPECULATIVE, calls.append, 2)
+    assert first is second
+    run(scheduler, [first])
+    assert calls == [1]  # 没有 merge 时保留排队中的参数
+
+
+def test_resubmit_promotes(scheduler):
+    order = []
+    futures = [scheduler.submit(key, SPECULATIVE, order.append, key) for key in ('a', 'b', 'c')]
+    scheduler.submit('c', FOREGROUND, order.append, 'c')
+    assert scheduler.promote('b', PARENT)
+    assert not scheduler.promote('missing', FOREGROUND)
+    run(scheduler, futures)
+    assert order == ['c', 'b', 'a']
+
+
+def test_merge_keeps_new_args(scheduler):
+    calls = []
+
+    def merge(queued, new):
+        return max(queued, new)
+
+    future = scheduler.submit('read', SPECULATIVE, calls.append, 1, merge=merge)
+    scheduler.submit('read', FOREGROUND, calls.append, 4, merge=merge)  # 更深的请求不会丢失
+    scheduler.submit('read', SPECULATIVE, calls.append, 2, merge=merge)
+    run(scheduler, [future])
+    assert calls == [4]
+
+    calls.clear()
+    future = scheduler.submit('read', SPECULATIVE, calls.append, 1)
+    scheduler.promote('read', FOREGROUND, (3,), merge)
+    future.result(5)
+    assert calls == [3]
+
+
+def test_cancel_speculative_by_group(scheduler):
+    calls = []
+    kept = scheduler.submit('a', SPECULATIVE, calls.append, 'a', group='/keep')
+    dropped = scheduler.submit('b', SPECULATIVE, calls.append, 'b', group='/other')
+    promoted = scheduler.submit('c', SPECULATIVE, calls.append, 'c', group='/other')
+    ungrouped = scheduler.submit('d', SPECULATIVE, calls.append, 'd')
+    scheduler.promote('c', FOREGROUND)  # 提升后不再属于预加载分组
+
+    assert scheduler.cancel_speculative(lambda group: group == '/keep') == 1
+    assert dropped.cancelled()
+    run(scheduler, [kept, promoted, ungrouped])
+    assert calls == ['c', 'a', 'd']
+
+
+def test_error_is_set_on_future(scheduler):
+    def fail():
+        raise ValueError('boom')
+
+    future = scheduler.submit('fail', FOREGROUND, fail)
+    scheduler.open()
+    with pytest.raises(ValueError):
+        future.result(5)
+    assert scheduler.submit('after', FOREGROUND, lambda: 1).result(5) == 1
+
+
+def test_shutdown_cancels_pending(scheduler):
+    future = scheduler.submit('a', SPECULATIVE, lambda: None)
+    scheduler.shutdown(wait=False, cancel_futures=True)
+    assert future.cancelled()
+    with pytest.raises(RuntimeError):
+        scheduler.submit('b', FOREGROUND, lambda: None)
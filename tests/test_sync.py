@@ -0,0 +1,109 @@
+import pytest
+from diskcache import Cache
+from easydict import EasyDict
+
+from internal import sync
+from internal.driver import drivers_obj
+from internal.dir_info import DirInfoManager
+from internal.inode import InodeTable, STALE, FRESH
+from drivers.baidu_netdisk import Driver as BaiduDriver
+
+NAME = 'test-sync'
+
+
+def item(path, isdir=True, size=0):
+    return EasyDict({'name': path.rsplit('/', 1)[1], 'path': path, 'deleted': False,
+                     'info': {'isdir': isdir, 'size': size, 'mtime': 1, 'ctime': 1}})
+
+
+def deleted(path):
+    return EasyDict({'path': path, 'deleted': True})
+
+
+class ChangeDriver:
+    """ 依次返回准备好的变化，changes 为异常时抛出 """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.cursors = []
+
+    def changes(self, cursor):
+        self.cursors.append(cursor)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return EasyDict(result)
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    with Cache(str(tmp_path / 'inode-table')) as buffer:
+        manager = DirInfoManager(InodeTable(), buffer)
+        monkeypatch.setattr(sync, 'dirInfoManager', manager)
+        for path in ('/', '/a'):
+            node = manager.inodes.ensure(NAME, path)
+            manager.inodes.set_listed(node)
+        manager.add_file_attr(NAME, '/a', {'isdir': True, 'mtime': 1, 'ctime': 1}, shown=True)
+        manager.add_file_attr(NAME, '/a/old', {'isdir': True, 'mtime': 1, 'ctime': 1}, shown=True)
+        yield manager
+    drivers_obj.pop(NAME, None)
+
+
+@pytest.fixture
+def engine():
+    engine = sync.SyncEngine()
+    engine.cursors = {}
+    engine.interval = 0
+    return engine
+
+
+def test_apply_change(manager):
+    manager.apply_change(NAME, item('/a/new'))
+    manager.apply_change(NAME, deleted('/a/old'))
+    manager.apply_change(NAME, item('/unlisted/child'))  # 没有读取过的目录之后读取时自然是最新的
+
+    assert manager.list_dir(NAME, '/a') == ['new']
+    assert manager.inodes.lookup(NAME, '/a/old') is None
+    assert manager.inodes.lookup(NAME, '/unlisted/child') is None
+
+
+def test_poll_follows_cursor(manager, engine):
+    drivers_obj[NAME] = ChangeDriver(
+        {'changes': [item('/a/b')], 'cursor': 'c1', 'has_more': True, 'reset': False},
+        {'changes': [deleted('/a/old')], 'cursor': 'c2', 'has_more': False, 'reset': False},
+    )
+    assert engine.poll(NAME) == 2
+    assert drivers_obj[NAME].cursors == [None, 'c1']
+    assert engine.cursors[NAME] == 'c2'
+    assert manager.list_dir(NAME, '/a') == ['b']
+    assert NAME in manager.synced
+
+
+def test_poll_reset_marks_directories_stale(manager, engine):
+    node = manager.inodes.lookup(NAME, '/a')
+    manager.inodes.end_revalidate(node, True)
+    assert node.state == FRESH
+
+    drivers_obj[NAME] = ChangeDriver({'changes': [], 'cursor': 'c1', 'has_more': False, 'reset': True})
+    engine.poll(NAME)
+    assert node.state == STALE
+
+
+def test_run_stops_without_change_feed(manager, engine):
+    drivers_obj[NAME] = ChangeDriver(NotImplementedError())
+    engine._run(NAME)
+    assert drivers_obj[NAME].cursors == [None]
+
+
+def test_run_stops_after_repeated_failures(manager, engine):
+    drivers_obj[NAME] = ChangeDriver(*[IOError('http 500')] * (sync.MAX_FAILURES + 1))
+    engine._run(NAME)
+    assert len(drivers_obj[NAME].cursors) == sync.MAX_FAILURES
+    assert NAME not in manager.synced
+
+
+def test_baidu_diff_is_opt_in():
+    driver = BaiduDriver.__new__(BaiduDriver)
+    driver.use_diff = False
+    with pytest.raises(NotImplementedError):
+        driver.changes(None)
@@ -0,0 +1,231 @@
+import os
+import time
+
+import pytest
+from diskcache import Cache
+
+from internal import temp_fs as temp_fs_module
+from internal.cache_policy import LRUPolicy
+from internal.temp_fs import TempFs
+from internal.write_behind import WriteBehind
+
+NAME = 'test-temp-fs'
+
+
+class Opener:
+    """ 在同一个目录上创建 TempFs，模拟重启 """
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.opened = []
+
+    def __call__(self, max_size=1 << 20):
+        temp_fs = TempFs(root=str(self.tmp_path / 'temp'), max_size=max_size,
+                         meta=Cache(str(self.tmp_path / 'meta')),
+                         log=WriteBehind(Cache(str(self.tmp_path / 'log'))))
+        temp_fs.weight  # 等待后台线程按配置的策略重建
+        temp_fs.policy = LRUPolicy
+        temp_fs._weight = None
+        temp_fs.weight  # 按 LRU 回放，测试只关心先后顺序
+        self.opened.append(temp_fs)
+        return temp_fs
+
+    def restart(self, temp_fs, **kwargs):
+        self.close(temp_fs)
+        return self(**kwargs)
+
+    def close(self, temp_fs):
+        if temp_fs in self.opened:
+            self.opened.remove(temp_fs)
+            temp_fs.close()
+            temp_fs.log.close()
+            temp_fs.log.cache.close()
+            temp_fs.meta.close()
+
+
+@pytest.fixture
+def opener(tmp_path):
+    opener = Opener(tmp_path)
+    yield opener
+    for temp_fs in list(opener.opened):
+        opener.close(temp_fs)
+
+
+def key(uid):
+    return TempFs.generate_key(NAME, uid)
+
+
+def order(temp_fs):
+    """ 淘汰顺序，最先淘汰的在前 """
+    return [{key(uid): uid for uid in 'abcdefgh'}.get(k, k) for k in temp_fs.weight]
+
+
+def test_replay_restores_order(opener):
+    temp_fs = opener()
+    for uid in 'abc':
+        temp_fs.allocate(NAME, uid, 10)
+    temp_fs.record(NAME, 'a')
+    temp_fs.record(NAME, 'x')  # 没有缓存的文件不计入淘汰策略
+    assert order(temp_fs) == ['b', 'c', 'a']
+
+    temp_fs = opener.restart(temp_fs)
+    assert order(temp_fs) == ['b', 'c', 'a']
+    assert temp_fs.log_records == 3  # 同一条记录中的 a 只保留最后一次
+
+
+def test_replay_skips_removed_files(opener):
+    temp_fs = opener()
+    for uid in 'abc':
+        temp_fs.allocate(NAME, uid, 10)
+    temp_fs.remove(NAME, 'b')
+
+    temp_fs = opener.restart(temp_fs)
+    assert order(temp_fs) == ['a', 'c']
+    assert temp_fs.meta['size'] == 20
+
+
+def test_files_without_log_are_replayed_first(opener):
+    temp_fs = opener()
+    temp_fs.allocate(NAME, 'a', 10)
+    temp_fs.close()
+    with temp_fs.meta.transact():  # 旧版本留下的缓存文件，只有元信息没有访问记录
+        for uid, stamp in (('c', 2), ('b', 1)):
+            temp_fs.meta[key(uid)] = {'path': f'/none/{uid}', 'size': 10, 'used': 10, 'time': stamp}
+        temp_fs.meta.incr('size', 20)
+
+    temp_fs = opener.restart(temp_fs)
+    assert order(temp_fs) == ['b', 'c', 'a']
+    logged = [k for seq in temp_fs.log.cache for k in temp_fs.log.cache[seq]]
+    assert set(logged) == {key(uid) for uid in 'abc'}  # 已经压缩进访问日志
+
+
+def test_compact_keeps_order_and_later_accesses(opener):
+    temp_fs = opener()
+    for uid in 'abcd':
+        temp_fs.allocate(NAME, uid, 10)
+    for uid in 'badcab':
+        temp_fs.record(NAME, uid)
+        with temp_fs.lock:
+            temp_fs._write_batch()  # 每次访问单独一条记录
+    assert temp_fs.log_records == 9  # 分配的 4 个和 b 在第一条记录中，之后每次访问一条
+    before = order(temp_fs)
+
+    temp_fs.compact()
+    assert temp_fs.log_records == 4
+    assert len(temp_fs.log.cache) == 1
+    temp_fs.record(NAME, 'd')  # 压缩之后的访问
+    temp_fs.remove(NAME, 'c')
+
+    temp_fs = opener.restart(temp_fs)
+    expected = [uid for uid in before if uid not in 'cd'] + ['d']
+    assert order(temp_fs) == expected
+
+
+def test_maybe_compact_threshold(opener, monkeypatch):
+    monkeypatch.setattr(temp_fs_module, 'LOG_COMPACT_MIN', 4)
+    temp_fs = opener()
+    temp_fs.allocate(NAME, 'a', 10)
+    temp_fs.allocate(NAME, 'b', 10)
+    for _ in range(3):
+        temp_fs.record(NAME, 'a')
+        with temp_fs.lock:
+            temp_fs._write_batch()
+    temp_fs._maybe_compact()
+    assert temp_fs.log_records == 4  # 没有超过阈值
+
+    temp_fs.record(NAME, 'b')
+    with temp_fs.lock:
+        temp_fs._write_batch()
+    temp_fs._maybe_compact()
+    assert temp_fs.log_records == 2
+    assert order(temp_fs) == ['a', 'b']
+
+
+def test_restart_after_compaction_continues_sequence(opener):
+    temp_fs = opener()
+    for uid in 'abc':
+        temp_fs.allocate(NAME, uid, 10)
+    flush = temp_fs.log.flush
+
+    def concurrent_flush():
+        temp_fs.log.flush = flush
+        for uid in 'abca':  # 压缩取出淘汰顺序之后、写入之前的访问，每次一条记录
+            temp_fs.record(NAME, uid)
+            with temp_fs.lock:
+                temp_fs._write_batch()
+        flush()
+        flush()
+
+    temp_fs.log.flush = concurrent_flush
+    temp_fs.compact()
+    cache = temp_fs.log.cache
+    assert cache.peekitem(last=True)[0] < max(cache)  # 压缩的记录比之后的访问晚写入
+
+    temp_fs = opener.restart(temp_fs)
+    assert order(temp_fs) == ['b', 'c', 'a']
+    temp_fs.record(NAME, 'b')  # 新的序号不能覆盖已有的记录
+
+    temp_fs = opener.restart(temp_fs)
+    assert order(temp_fs) == ['c', 'a', 'b']
+
+
+def test_evict_skips_pinned_without_touching(opener):
+    temp_fs = opener()
+    for uid in 'abc':
+        temp_fs.allocate(NAME, uid, 10)
+    temp_fs.pin(NAME, 'a')
+    assert temp_fs.evict(20) == 10
+    assert order(temp_fs) == ['a', 'c']  # 正在读取的 a 留在原来的位置
+    temp_fs.unpin(NAME, 'a')
+
+
+def test_reserve_gives_up_when_every_file_is_pinned(opener):
+    temp_fs = opener(max_size=100)
+    temp_fs.pin(NAME, 'a')
+    temp_fs.allocate(NAME, 'a', 90)
+    start = time.monotonic()
+    assert not temp_fs.reserve(20)  # 淘汰不能腾出空间，不再等待
+    assert time.monotonic() - start < 5
+    assert temp_fs.has(NAME, 'a')
+
+    temp_fs.unpin(NAME, 'a')
+    assert temp_fs.reserve(20)
+    assert not temp_fs.has(NAME, 'a')
+
+
+def test_reconcile_checks_files_in_batches(opener, monkeypatch):
+    monkeypatch.setattr(temp_fs_module, 'RECONCILE_BATCH', 2)
+    temp_fs = opener()
+    paths = {uid: temp_fs.allocate(NAME, uid, 10) for uid in 'abc'}
+    for path in paths.values():
+        with open(path, 'wb') as f:
+            f.write(bytes(10))
+    os.remove(paths['b'])
+    os.truncate(paths['c'], 4)
+    temp_fs.meta.incr('size', 7)
+
+    temp_fs.reconcile()
+    assert temp_fs.meta['size'] == 30
+    assert all(temp_fs.has(NAME, uid) for uid in 'abc')  # 可能正在分配，第二次校正才移除
+
+    temp_fs.reconcile()
+    assert [uid for uid in 'abc' if temp_fs.has(NAME, uid)] == ['a']
+    assert temp_fs.meta['size'] == 10
+    assert order(temp_fs) == ['a']
+    assert not os.path.exists(paths['c'])
+
+
+def test_admit_compares_with_next_victim(opener):
+    temp_fs = opener(max_size=100)
+    temp_fs.allocate(NAME, 'a', 40)
+    temp_fs.allocate(NAME, 'b', 30)
+    for _ in range(2):
+        temp_fs.record(NAME, 'b')
+    assert temp_fs.admit(NAME, 'c', 20)  # 不超过高水位
+    assert not temp_fs.admit(NAME, 'c', 30)
+    temp_fs.record(NAME, 'c')  # 比下一个要淘汰的 a 打开次数多
+    assert temp_fs.admit(NAME, 'c', 30)
+    temp_fs.record(NAME, 'a')
+    temp_fs.record(NAME, 'a')  # 下一个要淘汰的变为 b
+    assert not temp_fs.admit(NAME, 'c', 30)
+    assert not temp_fs.admit(NAME, 'd', 95)